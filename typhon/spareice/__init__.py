@@ -3,6 +3,7 @@
 """All SPARE-ICE related modules."""
 
 from typhon.spareice.array import *
+from typhon.spareice.cache import ReadCache, ShadowCache
 from typhon.spareice.collocations import *  # noqa
 from typhon.spareice.common import *  # noqa
 from typhon.spareice.datasets import *  # noqa
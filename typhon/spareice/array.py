@@ -10,6 +10,7 @@ import textwrap
 import warnings
 
 import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
 import pandas as pd
 
 try:
@@ -30,6 +31,7 @@ except ImportError:
 __all__ = [
     'Array',
     'GroupedArrays',
+    'LazyArray',
 ]
 
 unit_mapper = {
@@ -48,22 +50,50 @@ class InvalidUnitString(Exception):
         super(InvalidUnitString, self).__init__(*args, **kwargs)
 
 
+# Lengths of the CF time units (and their common abbreviations) in
+# nanoseconds:
+_unit_nanoseconds = {
+    **dict.fromkeys(["nanoseconds", "nanosecond", "ns"], 1),
+    **dict.fromkeys(
+        ["microseconds", "microsecond", "us"], 1000),
+    **dict.fromkeys(
+        ["milliseconds", "millisecond", "msecs", "msec", "ms"], 1000**2),
+    **dict.fromkeys(
+        ["seconds", "second", "secs", "sec", "s"], 1000**3),
+    **dict.fromkeys(
+        ["minutes", "minute", "mins", "min"], 60 * 1000**3),
+    **dict.fromkeys(
+        ["hours", "hour", "hrs", "hr", "h"], 3600 * 1000**3),
+    **dict.fromkeys(["days", "day", "d"], 86400 * 1000**3),
+}
+
+# Calendars that numpy.datetime64 can represent. The gregorian calendar
+# differs from the proleptic one only before 1582-10-15:
+_standard_calendars = {"standard", "gregorian", "proleptic_gregorian"}
+# Kept as tuple since this date is out of the range of pandas.Timestamp
+# (before pandas 2.0):
+_gregorian_start = (1582, 10, 15)
+
+
 def num2date(times, units, calendar=None):
-    """Convert an array of integers into datetime objects.
+    """Convert an array of numbers into datetime objects.
 
     This function optimizes the num2date function of python-netCDF4 if the
-    standard calendar is used.
+    standard calendar is used: the numbers are converted by integer
+    arithmetic to numpy.datetime64 objects with nanosecond resolution
+    directly. Masked or non-finite values become NaT.
 
     Args:
-        times: An array of integers representing timestamps.
+        times: An array of numbers representing timestamps.
         units: A string with the format "{unit} since {epoch}",
             e.g. "seconds since 1970-01-01T00:00:00".
         calendar: (optional) Standard is gregorian. If others are used,
             netCDF4.num2date will be called.
 
     Returns:
-        Either an array of numpy.datetime64 objects (if standard gregorian
-        calendar is used), otherwise an array of python datetime objects.
+        Either an array of numpy.datetime64 objects (if a standard calendar
+        is used or the dates are convertible), otherwise an array of python
+        datetime objects.
     """
     try:
         unit, epoch = units.split(" since ")
@@ -75,19 +105,79 @@ def num2date(times, units, calendar=None):
     else:
         calendar = calendar.lower()
 
-    if calendar != "gregorian":
-        return netCDF4.num2date(times, units, calendar).astype(
-            "M8[%s]" % unit_mapper[unit])
+    factor = _unit_nanoseconds.get(unit.strip().lower(), None)
+    if calendar in _standard_calendars and factor is not None:
+        converted_data = _num2datetime64(times, factor, epoch, calendar)
+        if converted_data is not None:
+            return converted_data
 
-    # Numpy uses the epoch 1970-01-01 natively.
-    converted_data = times.astype("M8[%s]" % unit_mapper[unit])
+    # The slow way via python-netCDF4 (e.g. for dates out of the range of
+    # datetime64[ns] or other calendars):
+    dates = netCDF4.num2date(times, units, calendar)
+    try:
+        return np.asarray(dates).astype("M8[ns]")
+    except (TypeError, ValueError):
+        return dates
 
-    # numpy.datetime64 cannot read certain time formats while pandas can.
-    epoch = pd.Timestamp(epoch).to_datetime64()
 
-    # Maybe there is another epoch used?
-    if epoch != np.datetime64("1970-01-01"):
-        converted_data -= np.datetime64("1970-01-01") - epoch
+def _num2datetime64(times, factor, epoch, calendar):
+    """Convert numbers to datetime64[ns] via integer arithmetic
+
+    Args:
+        times: An array of numbers.
+        factor: Length of the time unit in nanoseconds.
+        epoch: The reference time as string.
+        calendar: Name of a standard calendar.
+
+    Returns:
+        An array of numpy.datetime64 objects or None if this is not possible.
+    """
+    try:
+        epoch = pd.Timestamp(epoch.strip())
+    except (ValueError, OverflowError, pd.errors.OutOfBoundsDatetime):
+        return None
+
+    if epoch.tzinfo is not None:
+        epoch = epoch.tz_convert(None)
+
+    if calendar != "proleptic_gregorian" \
+            and (epoch.year, epoch.month, epoch.day) < _gregorian_start:
+        return None
+
+    # Since pandas 2.0, Timestamps may lie outside the range of
+    # datetime64[ns] (the cast to it would silently overflow):
+    if not pd.Timestamp.min <= epoch <= pd.Timestamp.max:
+        return None
+    epoch_ns = epoch.to_datetime64().astype("M8[ns]")
+
+    values = np.ma.getdata(times)
+    if values.dtype.kind not in "iuf":
+        return None
+
+    invalid = np.ma.getmaskarray(times)
+    if values.dtype.kind == "f":
+        invalid = invalid | ~np.isfinite(values)
+    if invalid.any():
+        values = np.where(invalid, 0, values)
+
+    # The results must fit into 64 bit integers:
+    if values.size and np.abs(values).max() * float(factor) \
+            + abs(float(epoch_ns.astype("i8"))) >= 2.**63:
+        return None
+
+    if values.dtype.kind == "f":
+        # We convert the integer and fractional parts separately to keep
+        # the precision of large timestamps:
+        whole = np.floor(values)
+        nanoseconds = whole.astype("i8") * factor \
+            + np.round((values - whole) * factor).astype("i8")
+    else:
+        nanoseconds = values.astype("i8") * factor
+
+    converted_data = nanoseconds.astype("m8[ns]") + epoch_ns
+
+    if invalid.any():
+        converted_data[invalid] = np.datetime64("NaT")
     return converted_data
 
 
@@ -149,6 +239,16 @@ class Array(np.ndarray):
 
         return obj
 
+    def __reduce__(self):
+        # The attributes and dimensions must be pickled as well (e.g. when
+        # returning an Array from a worker process):
+        reconstruct, arguments, state = super().__reduce__()
+        return reconstruct, arguments, (state, self.attrs, self.dims)
+
+    def __setstate__(self, state):
+        state, self.attrs, self.dims = state
+        super().__setstate__(state)
+
     def __array_finalize__(self, obj):
         if obj is None:
             return
@@ -360,6 +460,232 @@ class Array(np.ndarray):
         return xr.DataArray(self, attrs=self.attrs, dims=self.dims)
 
 
+class LazyArray(NDArrayOperatorsMixin):
+    """Proxy of a netCDF variable that is read on first access.
+
+    This is used by :meth:`GroupedArrays.from_netcdf` with *lazy=True*. It
+    holds only the path of the file and the name of the variable and behaves
+    like an :class:`Array`:
+
+    * Slicing it with integers or slices (e.g. *lazy[10:20, 0]*) reads only
+      the selected hyperslab from the file.
+    * Any other access (numpy functions, operators, methods or other kinds of
+      indexing) reads the whole variable once and keeps it in memory.
+
+    Use :meth:`load` to get the variable as Array explicitly.
+    """
+
+    def __init__(self, filename, variable, shape, dtype, attrs=None,
+                 dims=None, convert_times=True, index=None):
+        """Initialise a LazyArray object.
+
+        You should not need to call this directly, use
+        :meth:`GroupedArrays.from_netcdf` instead.
+
+        Args:
+            filename: Path of the netCDF file.
+            variable: Full path of the variable in the file (including its
+                groups), e.g. *group/subgroup/var*.
+            shape: Shape of the variable (after applying *index*).
+            dtype: Numpy dtype of the variable after loading.
+            attrs: Dictionary with the attributes of the variable.
+            dims: Names of the dimensions of the variable.
+            convert_times: If true, the variable is converted to datetime64
+                if it has time units.
+            index: A tuple with one slice for each dimension of the variable
+                in the file that limits which part of it is visible.
+        """
+        self.filename = filename
+        self.variable = variable
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.attrs = {} if attrs is None else attrs
+        self.dims = dims
+        self.convert_times = convert_times
+
+        if index is None:
+            index = tuple(slice(0, length, 1) for length in self.shape)
+        self._index = index
+
+        # The loaded data:
+        self._data = None
+
+    @classmethod
+    def from_variable(cls, filename, nc_var, convert_times=True, slices=None):
+        """Create a LazyArray from an open netCDF4 variable
+
+        Args:
+            filename: Path of the netCDF file.
+            nc_var: A netCDF4.Variable object.
+            convert_times: If true, the variable is converted to datetime64
+                if it has time units.
+            slices: A dictionary with dimension names and slices that
+                should be applied to the variable.
+
+        Returns:
+            A LazyArray object.
+        """
+        slices = {} if slices is None else slices
+        index = tuple(
+            slice(*slices.get(dim, slice(None)).indices(length))
+            for dim, length in zip(nc_var.dimensions, nc_var.shape)
+        )
+
+        # Which dtype has the variable after reading and converting? We
+        # simply convert an empty array:
+        dtype = nc_var.dtype
+        if convert_times and "units" in nc_var.__dict__:
+            try:
+                dtype = num2date(
+                    np.empty(0, dtype), nc_var.units,
+                    getattr(nc_var, "calendar", None)
+                ).dtype
+            except (InvalidUnitString, KeyError, ValueError):
+                pass
+
+        group_path = nc_var.group().path.strip("/")
+        return cls(
+            filename, f"{group_path}/{nc_var.name}".lstrip("/"),
+            shape=[len(range(*part.indices(length)))
+                   for part, length in zip(index, nc_var.shape)],
+            dtype=dtype, attrs=nc_var.__dict__, dims=nc_var.dimensions,
+            convert_times=convert_times, index=index,
+        )
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.load()
+        return data if dtype is None else data.astype(dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [
+            item.load() if isinstance(item, LazyArray) else item
+            for item in inputs
+        ]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, item):
+        # All other attributes and methods are taken from the loaded array:
+        if item.startswith("__") or item in ("_data", "_index"):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+    def __getitem__(self, item):
+        if self._data is not None:
+            return self._data[item]
+
+        index = self._compose_index(item)
+        if index is None:
+            # This is no simple hyperslab:
+            return self.load()[item]
+
+        return self._read(index)
+
+    def __len__(self):
+        if not self.shape:
+            raise TypeError("len() of unsized object")
+        return self.shape[0]
+
+    def __repr__(self):
+        state = "loaded" if self._data is not None else "not loaded"
+        return f"LazyArray('{self.variable}', shape={self.shape}, " \
+               f"dtype={self.dtype}, {state})"
+
+    @property
+    def itemsize(self):
+        return self.dtype.itemsize
+
+    @property
+    def nbytes(self):
+        return self.size * self.itemsize
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def loaded(self):
+        """True if the whole variable has been read already"""
+        return self._data is not None
+
+    def load(self):
+        """Read the whole variable (only once)
+
+        Returns:
+            An Array object.
+        """
+        if self._data is None:
+            self._data = self._read(self._index)
+        return self._data
+
+    def _compose_index(self, item):
+        """Translate an index on this array to an index on the variable
+
+        Returns:
+            A tuple of slices and integers for the variable in the file or
+            None if *item* is not a combination of integers and slices.
+        """
+        if not isinstance(item, tuple):
+            item = (item,)
+
+        if len(item) > len(self._index) or not all(
+                isinstance(part, (slice, int, np.integer)) for part in item):
+            return None
+
+        index = []
+        for i, part in enumerate(self._index):
+            visible = range(part.start, part.stop, part.step)
+            if i >= len(item):
+                index.append(part)
+                continue
+
+            # range objects do the bounds checks and negative indices for us:
+            selected = visible[item[i]]
+            if isinstance(selected, range):
+                # netCDF4 does not accept negative steps:
+                if selected.step < 0:
+                    return None
+                index.append(
+                    slice(selected.start, selected.stop, selected.step))
+            else:
+                index.append(int(selected))
+
+        return tuple(index)
+
+    def _read(self, index):
+        with netCDF4.Dataset(self.filename, "r") as root:
+            group = root
+            *groups, name = self.variable.split("/")
+            for group_name in groups:
+                group = group.groups[group_name]
+
+            nc_var = group.variables[name]
+            data = _read_netcdf_variable(nc_var, self.convert_times, index)
+
+        return Array(data, attrs=self.attrs, dims=self.dims)
+
+
+def _read_netcdf_variable(nc_var, convert_times, index=slice(None)):
+    """Read (a part of) a netCDF variable and convert times if needed"""
+    # Handle time fields differently
+    if convert_times and "units" in nc_var.__dict__:
+        try:
+            return num2date(
+                nc_var[index], nc_var.units,
+                getattr(nc_var, "calendar", None)
+            )
+        except InvalidUnitString:
+            # This means it is no time variable
+            return nc_var[index]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return nc_var[index]
+
+
 class GroupedArrays:
     """A specialised dictionary for arrays.
 
@@ -502,7 +828,7 @@ class GroupedArrays:
                     return self._groups[var][rest]
                 else:
                     raise KeyError("'{}' is not a group!".format(var))
-        elif isinstance(item, (tuple, list)) and len(item) \
+        elif isinstance(item, (tuple, list)) and len(item) == 2 \
                 and isinstance(item[0], str) and isinstance(item[1], int):
             return self[item[0]][:, item[1]]
         else:
@@ -524,10 +850,11 @@ class GroupedArrays:
 
         if not rest:
             # Try automatic conversion from numpy array to Array.
-            if not isinstance(value, (Array, GroupedArrays, type(self))):
+            if not isinstance(
+                    value, (Array, LazyArray, GroupedArrays, type(self))):
                 value = Array(value)
 
-            if isinstance(value, Array):
+            if isinstance(value, (Array, LazyArray)):
                 self._vars[var] = value
 
                 # Maybe someone wants to create a variable with a name that
@@ -647,7 +974,7 @@ class GroupedArrays:
             # The data could contain datetime objects. A numerical collapser
             # function will crash with such an object. Hence, we convert the
             # datetime objects to floats temporarily.
-            if isinstance(data.item(0), datetime):
+            if data.dtype.kind == "M" or isinstance(data.item(0), datetime):
                 numerical_data = data.astype("M8[ns]").astype("int")
                 binned_data = numerical_data.bin(bins)
                 collapsed_data[var] = \
@@ -779,7 +1106,8 @@ class GroupedArrays:
 
     @classmethod
     def from_netcdf(cls, filename, fields=None, convert_times=True,
-                    group=None,):
+                    group=None, time_window=None, time_field="time",
+                    lazy=False):
         """Creates an GroupedArrays object from a netCDF file.
 
         Args:
@@ -790,12 +1118,32 @@ class GroupedArrays:
             convert_times: Set this to true if you want to convert time
                 fields into datetime objects.
             group:
+            time_window: (optional) A tuple of two datetime objects. If given,
+                only the parts of the variables between these two times are
+                read from the file. Like :meth:`Dataset.find`, the start is
+                inclusive and the end exclusive. None means an open bound
+                (e.g. *(start, None)*). The time variable of each
+                group (see *time_field*) must be one-dimensional and sorted;
+                all variables that share its dimension are sliced along it.
+                Subgroups without a time variable use the slice of their
+                parent group.
+            time_field: (optional) The name of the time variable in each group
+                that is used for *time_window*. Default is *time*.
+            lazy: (optional) If true, the variables are not read but
+                represented by :class:`LazyArray` objects. They are read when
+                they are used for the first time and slicing them reads only
+                the selected part from the file. Only the headers (and the
+                time variables if *time_window* is given) are read here. Not
+                possible with multiple files.
 
         Returns:
             An GroupedArrays object.
         """
 
         if isinstance(filename, (tuple, list)):
+            if lazy:
+                raise ValueError(
+                    "Lazy loading is not possible with multiple files!")
             opener = netCDF4.MFDataset
         else:
             opener = netCDF4.Dataset
@@ -807,26 +1155,38 @@ class GroupedArrays:
                 group = root[group]
 
             return cls._get_group_from_netcdf_group(
-                group, fields, convert_times
+                group, fields, convert_times, time_window, time_field,
+                lazy_file=filename if lazy else None,
             )
 
     @classmethod
-    def _get_group_from_netcdf_group(cls, group, fields, convert_times):
+    def _get_group_from_netcdf_group(
+            cls, group, fields, convert_times, time_window=None,
+            time_field="time", slices=None, lazy_file=None):
         array_group = cls()
 
         array_group.attrs.update(**group.__dict__)
 
+        # The slices of the dimensions that should be read (the dimensions of
+        # a group are visible in its subgroups as well):
+        slices = {} if slices is None else slices.copy()
+        if time_window is not None and time_field in group.variables:
+            slices.update(cls._get_time_slice(
+                group.variables[time_field], time_window
+            ))
+
         # Limit the reading of the file to some fields:
         if fields is not None:
             for field in fields:
                 if isinstance(group[field], netCDF4._netCDF4.Group):
                     array_group[field] = \
                         cls._get_group_from_netcdf_group(
-                            field, None, convert_times)
+                            group[field], None, convert_times, time_window,
+                            time_field, slices, lazy_file)
                 else:
                     array_group[field] = \
                         GroupedArrays._get_variable_from_netcdf_group(
-                            group[field], convert_times
+                            group[field], convert_times, slices, lazy_file
                         )
             return array_group
 
@@ -834,19 +1194,63 @@ class GroupedArrays:
         # Add the variables:
         for var, data in group.variables.items():
             array_group[var] = GroupedArrays._get_variable_from_netcdf_group(
-                data, convert_times
+                data, convert_times, slices, lazy_file
             )
 
         # Add the groups
         for subgroup, subgroup_obj in group.groups.items():
             array_group[subgroup] = \
                 cls._get_group_from_netcdf_group(
-                    subgroup_obj, None, convert_times)
+                    subgroup_obj, None, convert_times, time_window,
+                    time_field, slices, lazy_file)
 
         return array_group
 
     @staticmethod
-    def _get_variable_from_netcdf_group(nc_var, convert_times):
+    def _get_time_slice(nc_var, time_window):
+        """Find the slice of a time variable that lies in a time window
+
+        Only the time variable itself is read completely. The window is
+        half-open, i.e. times equal to its end are excluded. Hence, adjacent
+        windows do not share any records.
+
+        Args:
+            nc_var: A netCDF4 variable.
+            time_window: A tuple of two datetime objects (or None for open
+                bounds).
+
+        Returns:
+            A dictionary with the dimension of the time variable and the
+            slice. Empty if the variable is not one-dimensional, sorted or
+            convertible to datetimes.
+        """
+        if len(nc_var.dimensions) != 1:
+            return {}
+
+        try:
+            times = num2date(
+                nc_var[:], nc_var.units, getattr(nc_var, "calendar", None)
+            ).astype("M8[us]")
+        except (AttributeError, InvalidUnitString, KeyError, ValueError):
+            return {}
+
+        # We can use binary search only on sorted times:
+        if np.any(times[1:] < times[:-1]):
+            return {}
+
+        start, end = time_window
+        return {
+            nc_var.dimensions[0]: slice(
+                None if start is None else np.searchsorted(
+                    times, np.datetime64(start, "us"), side="left"),
+                None if end is None else np.searchsorted(
+                    times, np.datetime64(end, "us"), side="left"),
+            )
+        }
+
+    @staticmethod
+    def _get_variable_from_netcdf_group(
+            nc_var, convert_times, slices=None, lazy_file=None):
         # There might be empty fields:
         if not nc_var:
             return Array(
@@ -854,19 +1258,20 @@ class GroupedArrays:
                 dims=nc_var.dimensions,
             )
 
-        # Handle time fields differently
-        if convert_times and "units" in nc_var.__dict__:
-            try:
-                data = num2date(nc_var[:], nc_var.units)
-            except InvalidUnitString:
-                # This means it is no time variable
-                data = nc_var[:]
-            except Exception as e:
-                raise e
+        # Scalars are not worth to be read lazily:
+        if lazy_file is not None and nc_var.dimensions:
+            return LazyArray.from_variable(
+                lazy_file, nc_var, convert_times, slices)
+
+        # Read only the hyperslab of the variable that we need:
+        if slices and any(dim in slices for dim in nc_var.dimensions):
+            index = tuple(
+                slices.get(dim, slice(None)) for dim in nc_var.dimensions
+            )
         else:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                data = nc_var[:]
+            index = slice(None)
+
+        data = _read_netcdf_variable(nc_var, convert_times, index)
 
         return Array(
             data, attrs=nc_var.__dict__,
@@ -1051,6 +1456,20 @@ class GroupedArrays:
         """
         self.attrs["MAIN_GROUP"] = sub_group
 
+    def load(self):
+        """Read all variables that have not been loaded yet
+
+        Only needed for objects created by :meth:`from_netcdf` with
+        *lazy=True*, e.g. before the file is deleted.
+
+        Returns:
+            This object.
+        """
+        for var in list(self.vars(deep=True)):
+            if isinstance(self[var], LazyArray):
+                self[var] = self[var].load()
+        return self
+
     @classmethod
     def merge(cls, objects, groups=None, overwrite_error=True):
         """Merges multiple GroupedArrays objects to one.
@@ -1212,17 +1631,20 @@ class GroupedArrays:
 
         return obj
 
-    def select(self, indices_or_fields, inplace=False):
+    def select(self, indices_or_fields=None, inplace=False, fields=None):
         """Select a part of this GroupedArrays.
 
         Args:
-            indices_or_fields:
+            indices_or_fields: Indices or a slice that are applied to all
+                variables or a list of field names.
             inplace:
+            fields: A list of field names that should be selected. Unlike
+                *indices_or_fields*, they are not tried as indices first.
 
         Returns:
 
         """
-        if isinstance(indices_or_fields, str):
+        if isinstance(indices_or_fields, str) or isinstance(fields, str):
             raise TypeError("For field selection indices_or_fields must be "
                             "a tuple/list of strings.")
 
@@ -1234,24 +1656,26 @@ class GroupedArrays:
             obj.attrs.update(**self.attrs)
 
         # Try selecting by indices or slices:
-        try:
+        if fields is None:
+            try:
+                for var in self.vars(True):
+                    obj[var] = self[var][indices_or_fields]
+                return obj
+            except IndexError as e:
+                fields = list(indices_or_fields)
+                if not isinstance(fields[0], str):
+                    raise IndexError(
+                        str(e) + "\nCould not select parts of '%s'.\n" % var)
+
+        if inplace:
+            # We want to keep the original object and simply drop all
+            # unwanted variables.
+            unwanted_vars = set(obj.vars(True)) - set(fields)
+            obj.drop(unwanted_vars, inplace=True)
+        else:
             for var in self.vars(True):
-                obj[var] = self[var][indices_or_fields]
-        except IndexError as e:
-            fields = list(indices_or_fields)
-            if isinstance(fields[0], str):
-                if inplace:
-                    # We want to keep the original object and simply drop all
-                    # unwanted variables.
-                    unwanted_vars = set(obj.vars(True)) - set(fields)
-                    obj.drop(unwanted_vars, inplace=True)
-                else:
-                    for var in self.vars(True):
-                        if var in indices_or_fields:
-                            obj[var] = self[var]
-            else:
-                raise IndexError(
-                    str(e) + "\nCould not select parts of '%s'.\n" % var)
+                if var in fields:
+                    obj[var] = self[var]
 
         return obj
 
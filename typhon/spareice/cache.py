@@ -0,0 +1,533 @@
+"""
+This module contains caches for the content of dataset files: an in-memory
+cache to avoid reading the same file several times and a persistent cache
+that stores slowly decodable files in a fast format. Both are used by
+:class:`~typhon.spareice.datasets.Dataset`.
+"""
+
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from typhon.spareice.array import Array, GroupedArrays
+
+try:
+    import xarray as xr
+except ImportError:
+    pass
+
+__all__ = [
+    "ReadCache",
+    "ShadowCache",
+]
+
+
+class ReadCache:
+    """Thread-safe LRU cache for the content of read files.
+
+    The entries are keyed on the path, the modification time and the size of
+    a file and the arguments that were used to read it. Hence, files that
+    have been changed since they were cached are read again. If adding a new
+    entry exceeds the byte budget, the least recently used entries are
+    removed.
+
+    One ReadCache object can be shared by many datasets (e.g. by passing it to
+    several :class:`~typhon.spareice.datasets.Dataset` objects). Note that
+    worker processes (e.g. of :meth:`Dataset.map` with processes) work on
+    their own copy of the cache.
+
+    The cached arrays are shared by all users of an entry and are not copied.
+    Hence, they are made read-only (numpy.ndarray.flags.writeable is False)
+    when they are added to the cache. This also applies to the data that
+    :meth:`Dataset.read` returns for a cached file. Copy an array before
+    changing it in place. pandas objects cannot be protected like this and
+    are copied instead.
+
+    Examples:
+
+    .. code-block:: python
+
+        from typhon.spareice import Dataset, ReadCache
+
+        # Keep up to 2 GB of read data in memory:
+        cache = ReadCache(2 * 1024**3)
+        dataset = Dataset("path/to/{year}/{doy}.nc", read_cache=cache)
+
+        # Reads all files:
+        data = dataset.collect("2018-01-01", "2018-01-02")
+        # Reads nothing:
+        data = dataset.collect("2018-01-01", "2018-01-02")
+
+        print(cache.stats)
+    """
+
+    def __init__(self, max_bytes=None):
+        """Initialise a ReadCache object.
+
+        Args:
+            max_bytes: Maximal number of bytes that the cached objects may
+                use. Default is 1 GB.
+        """
+        self.max_bytes = 1024**3 if max_bytes is None else max_bytes
+
+        # The cached objects in order of their last use (the least recently
+        # used first) and their sizes:
+        self._entries = OrderedDict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        # Locks cannot be pickled (needed when using Dataset.map with
+        # processes):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        """Dictionary with the hits, misses, entries and used bytes"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "nbytes": self.nbytes,
+            }
+
+    @staticmethod
+    def key(path, handler=None, **read_args):
+        """Create the key for a file and its reading arguments
+
+        Args:
+            path: Path of the file.
+            handler: The file handler object that reads the file.
+            **read_args: Additional keyword arguments for the reading method.
+
+        Returns:
+            A hashable tuple or None if the file does not exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return (
+            os.path.abspath(path), stat.st_mtime_ns, stat.st_size,
+            id(handler), _normalise(read_args),
+        )
+
+    def get(self, key, default=None):
+        """Get a cached object and mark it as recently used
+
+        Args:
+            key: A key created by :meth:`key`.
+            default: Returned if the key is not in the cache.
+
+        Returns:
+            A shallow copy of the cached object (i.e. the read-only arrays
+            are shared but you can add or remove fields without changing the
+            cache) or *default*.
+        """
+        with self._lock:
+            if key is None or key not in self._entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            obj, _ = self._entries[key]
+
+        return _shallow_copy(obj)
+
+    def put(self, key, obj, nbytes):
+        """Add an object to the cache
+
+        Objects that are bigger than the budget are not cached. The numpy
+        arrays of the object become read-only since they are shared with the
+        cache.
+
+        Args:
+            key: A key created by :meth:`key`.
+            obj: The object to cache.
+            nbytes: The size of the object in bytes.
+
+        Returns:
+            None
+        """
+        if key is None or obj is None or not 0 < nbytes <= self.max_bytes:
+            return
+
+        _freeze(obj)
+        obj = _shallow_copy(obj)
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = obj, nbytes
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, (_, old_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= old_nbytes
+
+    def clear(self):
+        """Remove all entries and reset the counters.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class ShadowCache:
+    """Persistent cache of read files in a memory-mappable format.
+
+    Some file formats (e.g. HDF4 or AAPP level 1b files) take much longer to
+    decode than to read. The ShadowCache stores the GroupedArrays objects that
+    a file handler returned in a directory under *root*: each variable as
+    *.npy* file and the attributes of all groups and variables in a JSON file.
+    Later reads of the same file (with the same modification time, size,
+    handler and reading arguments) load the arrays via
+    :func:`numpy.load` with *mmap_mode="r"*, i.e. only the parts of the
+    arrays that are really used are loaded from disk. Note that these arrays
+    are read-only.
+
+    Objects that are not GroupedArrays or contain arrays with object dtype are
+    not cached. If the cache grows beyond *max_bytes*, the least recently used
+    entries are removed. Several processes can share one cache directory.
+
+    Examples:
+
+    .. code-block:: python
+
+        from typhon.spareice import Dataset
+        from typhon.spareice.handlers import CloudSat
+
+        dataset = Dataset(
+            "path/to/{year}/{doy}/{year}{doy}{hour}{minute}{second}_*.hdf",
+            handler=CloudSat(),
+            shadow_cache="/scratch/user/cloudsat_cache",
+        )
+
+        # The first call decodes the HDF4 files, the second does not:
+        data = dataset.collect("2018-01-01", "2018-01-02")
+        data = dataset.collect("2018-01-01", "2018-01-02")
+    """
+
+    def __init__(self, root, max_bytes=None):
+        """Initialise a ShadowCache object.
+
+        Args:
+            root: Path of the cache directory (need not exist).
+            max_bytes: Maximal number of bytes that all cached files may
+                use. Default is 10 GB.
+        """
+        self.root = root
+        self.max_bytes = 10 * 1024**3 if max_bytes is None else max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        # The entries never change, hence we remember their sizes:
+        self._sizes = {}
+
+        os.makedirs(self.root, exist_ok=True)
+
+    @property
+    def stats(self):
+        """Dictionary with the hits, misses, entries and used bytes"""
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "nbytes": sum(nbytes for _, _, nbytes in entries),
+        }
+
+    @staticmethod
+    def key(path, handler=None, **read_args):
+        """Create the key for a file and its reading arguments
+
+        Other than for :class:`ReadCache`, the key must be the same in all
+        processes. Hence, the handler is described by its class and its
+        attributes.
+
+        Args:
+            path: Path of the file.
+            handler: The file handler object that reads the file.
+            **read_args: Additional keyword arguments for the reading method.
+
+        Returns:
+            A hexadecimal string or None if the file does not exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        description = repr((
+            os.path.abspath(path), stat.st_mtime_ns, stat.st_size,
+            type(handler).__module__, type(handler).__qualname__,
+            _normalise(getattr(handler, "__dict__", {})),
+            _normalise(read_args),
+        ))
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def get(self, key, default=None):
+        """Load a cached GroupedArrays object
+
+        Args:
+            key: A key created by :meth:`key`.
+            default: Returned if the key is not in the cache.
+
+        Returns:
+            A GroupedArrays object with memory-mapped arrays or *default*.
+        """
+        if key is None:
+            self.misses += 1
+            return default
+
+        entry = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return default
+
+        data = GroupedArrays(name=meta["name"])
+        data.attrs.update(meta["attrs"])
+        for group, attrs in meta["groups"].items():
+            data[group] = GroupedArrays(name=group.split("/")[-1])
+            data[group].attrs.update(attrs)
+        for i, (var, var_meta) in enumerate(meta["vars"].items()):
+            data[var] = Array(
+                np.load(os.path.join(entry, f"{i}.npy"), mmap_mode="r"),
+                attrs=var_meta["attrs"], dims=var_meta["dims"],
+            )
+
+        # Mark this entry as recently used:
+        os.utime(os.path.join(entry, "meta.json"))
+
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store a GroupedArrays object in the cache
+
+        Other objects are silently ignored.
+
+        Args:
+            key: A key created by :meth:`key`.
+            data: A GroupedArrays object.
+
+        Returns:
+            None
+        """
+        if key is None or not isinstance(data, GroupedArrays):
+            return
+
+        variables = list(data.items(deep=True))
+        if any(array.dtype.hasobject for _, array in variables):
+            return
+
+        nbytes = sum(array.nbytes for _, array in variables)
+        if nbytes > self.max_bytes:
+            return
+
+        try:
+            meta = json.dumps({
+                "name": data.name,
+                "attrs": data.attrs,
+                "groups": {
+                    group: data[group].attrs
+                    for group in data.groups(deep=True)
+                },
+                "vars": {
+                    var: {
+                        "attrs": getattr(array, "attrs", {}),
+                        "dims": list(getattr(array, "dims", [])),
+                    }
+                    for var, array in variables
+                },
+                "nbytes": nbytes,
+            }, default=_to_json)
+        except (TypeError, ValueError):
+            # The attributes cannot be stored
+            return
+
+        # We write everything into a temporary directory first and rename it
+        # afterwards. Hence, other processes never see incomplete entries:
+        entry = os.path.join(self.root, key)
+        tmp_entry = f"{entry}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_entry)
+        try:
+            for i, (_, array) in enumerate(variables):
+                np.save(os.path.join(tmp_entry, f"{i}.npy"),
+                        np.asarray(array), allow_pickle=False)
+            with open(os.path.join(tmp_entry, "meta.json"), "w") as file:
+                file.write(meta)
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another process has already stored this entry
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+
+        self._evict()
+
+    def clear(self):
+        """Remove all entries and reset the counters.
+
+        Returns:
+            None
+        """
+        for _, entry, _ in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _entries(self):
+        """Get all complete entries
+
+        Returns:
+            A list of tuples of the last access time, the path and the size
+            of the entries.
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            entry = os.path.join(self.root, name)
+            meta_file = os.path.join(entry, "meta.json")
+            try:
+                if name not in self._sizes:
+                    with open(meta_file) as file:
+                        self._sizes[name] = json.load(file)["nbytes"]
+                entries.append(
+                    (os.stat(meta_file).st_mtime, entry, self._sizes[name]))
+            except (OSError, ValueError, KeyError):
+                # Incomplete or removed entries (or foreign files)
+                self._sizes.pop(name, None)
+                continue
+        return entries
+
+    def _evict(self):
+        """Remove the least recently used entries until the budget is kept"""
+        entries = sorted(self._entries())
+        total = sum(nbytes for _, _, nbytes in entries)
+        for _, entry, nbytes in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= nbytes
+
+
+def _to_json(value):
+    """Convert numpy attributes to JSON-compatible types"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"{type(value)} is not JSON serializable!")
+
+
+def _normalise(value):
+    """Convert reading arguments to a hashable and order-independent form"""
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (str(key), _normalise(item)) for key, item in value.items()
+        ))
+    elif isinstance(value, (list, tuple)):
+        return type(value).__name__, tuple(_normalise(item) for item in value)
+    elif isinstance(value, (set, frozenset)):
+        return "set", tuple(sorted(repr(item) for item in value))
+    elif isinstance(value, np.ndarray):
+        return "ndarray", value.dtype.str, value.shape, value.tobytes()
+    elif hasattr(value, "__code__"):
+        # Functions should be described by their location and not by their
+        # id (needed for keys of persistent caches):
+        return (value.__module__, value.__qualname__,
+                value.__code__.co_firstlineno)
+
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def _freeze(obj):
+    """Make the numpy arrays of an object read-only"""
+    if isinstance(obj, GroupedArrays):
+        for value in obj._vars.values():
+            _freeze(value)
+        for group in obj._groups.values():
+            _freeze(group)
+    elif isinstance(obj, np.ndarray):
+        obj.flags.writeable = False
+    elif isinstance(obj, (tuple, list)):
+        for item in obj:
+            _freeze(item)
+
+    try:
+        if isinstance(obj, (xr.Dataset, xr.DataArray)):
+            for variable in obj.variables.values() \
+                    if isinstance(obj, xr.Dataset) else [obj.variable]:
+                # Lazily loaded variables are not touched:
+                if isinstance(variable.data, np.ndarray):
+                    variable.data.flags.writeable = False
+    except NameError:
+        pass
+
+
+def _shallow_copy(obj):
+    """Copy the containers of an object but not its (read-only) arrays
+
+    pandas objects are copied completely since their arrays cannot be made
+    read-only.
+    """
+    if isinstance(obj, GroupedArrays):
+        new = copy.copy(obj)
+        new.attrs = obj.attrs.copy()
+        new._vars = obj._vars.copy()
+        new._groups = {
+            name: _shallow_copy(group) for name, group in obj._groups.items()
+        }
+        return new
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        return obj.copy(deep=True)
+    elif isinstance(obj, np.ndarray):
+        return obj.view()
+    elif isinstance(obj, (tuple, list)):
+        return type(obj)(_shallow_copy(item) for item in obj)
+
+    try:
+        if isinstance(obj, (xr.Dataset, xr.DataArray)):
+            return obj.copy(deep=False)
+    except NameError:
+        pass
+
+    return obj
@@ -1,20 +1,22 @@
 import abc
+from datetime import timedelta
 import logging
+from multiprocessing.pool import ThreadPool
 import time
 
 
 import numpy as np
-from scipy.spatial import distance_matrix
 from sklearn.neighbors import BallTree as SklearnBallTree
 import typhon.constants
 from typhon.geodesy import geocentric2cart
-from typhon.spareice.array import Array
 from typhon.utils.time import to_timedelta
 
 __all__ = [
         "Finder",
         "BallTree",
         "BruteForce",
+        "GridHash",
+        "SweepLine",
     ]
 
 
@@ -24,6 +26,56 @@ class Finder(metaclass=abc.ABCMeta):
     # should be used in multiple threads because it can handle such GIL issues.
     loves_threading = True
 
+    # Finders that build an index of the secondary data alone (e.g. a Ball
+    # tree) can set this flag. Their indices are cached in *index_cache* and
+    # reused when the same secondary data is collocated again (e.g. by
+    # collocate_datasets with one long secondary file and many short primary
+    # files).
+    reusable_index = False
+
+    # The caching is disabled by default. Set this to a ReadCache object to
+    # enable it (see the *index_cache* parameter of collocate_datasets). Only
+    # indices of secondary data with an *index_key* (passed to
+    # find_collocations) are cached:
+    index_cache = None
+
+    # Finders that can search for the *k* nearest neighbours themselves
+    # (passed as keyword argument to find_collocations) set this flag. For
+    # all other finders, collocate selects the nearest neighbours from the
+    # found collocations afterwards:
+    finds_nearest = False
+
+    def get_index(self, key, build, *params, only_cached=False):
+        """Get the cached index of data or build it
+
+        The index is identified by the finder class, *key* and *params*.
+
+        Args:
+            key: A hashable object that identifies the indexed data, e.g.
+                the files where they come from and their slice. The data are
+                not compared, hence the key must change when the data
+                change. If this is None, the index is not cached.
+            build: A function without arguments that builds the index and
+                returns it and its size in bytes.
+            *params: Additional hashable parameters that change the index
+                (e.g. the indexed fields or the leaf size of a tree).
+            only_cached: If true, a missing index is not built and None is
+                returned instead.
+
+        Returns:
+            The index returned by *build* (or None).
+        """
+        if not self.reusable_index or self.index_cache is None \
+                or key is None:
+            return None if only_cached else build()[0]
+
+        key = (type(self).__module__, type(self).__qualname__, params, key)
+        index = self.index_cache.get(key)
+        if index is None and not only_cached:
+            index, nbytes = build()
+            self.index_cache.put(key, index, nbytes)
+        return index
+
     @abc.abstractmethod
     def find_collocations(
             self, primary_data, secondary_data, max_interval, max_distance,
@@ -38,10 +90,17 @@ class Finder(metaclass=abc.ABCMeta):
                 xarray.Dataset object. Needs to meet the same conditions as
                 primary_data ("lat", "lon" and "time" fields).
             max_interval: The maximum interval of time between two data points
-                in seconds. If this is None, the data will be searched for
-                spatial collocations only.
+                in seconds. The time differences of collocations are less
+                than this (all finders compare them in nanoseconds). If this
+                is None, the data will be searched for spatial collocations
+                only.
             max_distance: The maximum distance between two data points in
                 kilometers to meet the collocation criteria.
+            **kwargs: Additional options. Finders with *finds_nearest* accept
+                *k*: find only the k nearest secondary points for each
+                primary point. Finders with *reusable_index* accept
+                *index_key*: identifies the secondary data for the
+                *index_cache* (see :meth:`get_index`).
 
         Returns:
             Four lists:
@@ -62,10 +121,32 @@ class Finder(metaclass=abc.ABCMeta):
 
 
 class BallTree(Finder):
-    def __init__(self, leaf_size=None):
+    # The tree of the secondary data can be reused:
+    reusable_index = True
+
+    # Searches for the k nearest neighbours with Ball tree queries:
+    finds_nearest = True
+
+    def __init__(self, leaf_size=None, space_time=False):
+        """Initialise a BallTree finder.
+
+        Args:
+            leaf_size: The leaf size of the Ball tree. Default is 16.
+            space_time: If true and both, *max_interval* and *max_distance*
+                are given, the time is added as fourth coordinate to the Ball
+                tree (scaled so that *max_interval* corresponds to
+                *max_distance*). The tree is searched with the Chebyshev
+                metric and the exact criteria are checked afterwards. Hence,
+                the temporary candidate pairs are only those that are close in
+                space *and* time. This needs much less memory when the data
+                have many spatial but few temporal matches (e.g. polar
+                orbiting satellites near the poles). Default is false.
+                Ignored when searching for the nearest neighbours.
+        """
         super(BallTree, self).__init__()
 
         self.leaf_size = 16 if leaf_size is None else leaf_size
+        self.space_time = space_time
 
     def find_collocations(
         self, primary_data, secondary_data, max_interval, max_distance,
@@ -75,12 +156,23 @@ class BallTree(Finder):
         if max_interval is not None:
             max_interval = to_timedelta(max_interval)
 
+        k = kwargs.get("k")
+
+        if self.space_time and k is None and max_interval is not None \
+                and max_distance is not None:
+            return self._find_space_time(
+                primary_data, secondary_data, max_interval, max_distance)
+
         if max_distance is None:
-            # Search for temporal collocations only
-            primary_time = \
-                primary_data["time"].astype("M8[s]").astype("int")
-            secondary_time = \
-                secondary_data["time"].astype("M8[s]").astype("int")
+            # Search for temporal collocations only. The Ball tree works with
+            # floats, hence we use the seconds since the first secondary time
+            # and search with a small margin. The exact time differences are
+            # checked afterwards (in nanoseconds like by all finders):
+            primary_time = _time_as_int(primary_data["time"])
+            secondary_time = _time_as_int(secondary_data["time"])
+            offset = secondary_time.min() if secondary_time.size else 0
+            primary_time = (primary_time - offset) / 1e9
+            secondary_time = (secondary_time - offset) / 1e9
 
             # The BallTree implementation only allows 2-dimensional data, hence
             # we need to add an empty second dimension
@@ -92,7 +184,7 @@ class BallTree(Finder):
                 [secondary_time, np.zeros_like(secondary_time)]
             )
 
-            max_radius = max_interval.total_seconds()
+            max_radius = max_interval.total_seconds() + 1e-3
         else:
             # We try to find collocations by building one 3-d Ball tree
             # (see https://en.wikipedia.org/wiki/K-d_tree) and searching for
@@ -104,7 +196,7 @@ class BallTree(Finder):
             # a distance of 5 degrees in longitude, the error is smaller than
             # 177 meters.
             cart_points = geocentric2cart(
-                6371000.0, # typhon.constants.earth_radius,
+                typhon.constants.earth_radius,
                 primary_data["lat"],
                 primary_data["lon"]
             )
@@ -112,7 +204,7 @@ class BallTree(Finder):
 
             # We need to convert the secondary data as well:
             cart_points = geocentric2cart(
-                6371000.0, # typhon.constants.earth_radius,
+                typhon.constants.earth_radius,
                 secondary_data["lat"],
                 secondary_data["lon"]
             )
@@ -122,97 +214,689 @@ class BallTree(Finder):
             # convert it to meters.
             max_radius = max_distance*1000
 
-        # It is more efficient to build the tree with the largest data corpus:
-        tree_with_primary = primary_points.size > secondary_points.size
-
-        # Search for all collocations
-        if tree_with_primary:
-            tree = SklearnBallTree(primary_points, leaf_size=self.leaf_size)
-            results = tree.query_radius(secondary_points, r=max_radius)
+        if k is not None:
+            return self._find_nearest(
+                primary_data, secondary_data, primary_points,
+                secondary_points, max_interval, max_distance, max_radius, k,
+                kwargs.get("index_key"),
+            )
 
-            # Build the list of the collocation pairs:
-            pairs = np.array([
-                [primary_index, secondary_index]
-                for secondary_index, primary_indices in enumerate(results)
-                for primary_index in primary_indices
-            ]).T
-        else:
-            tree = SklearnBallTree(secondary_points, leaf_size=self.leaf_size)
-            results = tree.query_radius(primary_points, r=max_radius)
+        # A cached tree of the secondary data is always reused. Otherwise,
+        # the tree is built with the larger data corpus (see _query_pairs)
+        # and only cached if this is the secondary data:
+        tree = self.get_index(
+            kwargs.get("index_key"),
+            lambda: _build_tree(secondary_points, self.leaf_size),
+            "time" if max_distance is None else "space", self.leaf_size,
+            only_cached=primary_points.size > secondary_points.size,
+        )
 
-            # Build the list of the collocation pairs:
-            pairs = np.array([
-                [primary_index, secondary_index]
-                for primary_index, secondary_indices in enumerate(results)
-                for secondary_index in secondary_indices
-            ]).T
+        pairs = _query_pairs(
+            primary_points, secondary_points, max_radius, self.leaf_size,
+            secondary_tree=tree
+        )
 
         # No collocations were found.
-        if not pairs.any():
+        if not pairs.size:
             return pairs
 
         # Check here for temporal collocations:
-        if max_distance is not None and max_interval is not None:
+        if max_interval is not None:
+            # Comparing integers is much faster than comparing datetime64
+            # objects:
+            primary_time = _time_as_int(primary_data["time"])
+            secondary_time = _time_as_int(secondary_data["time"])
 
             # Check whether the time differences between the spatial
             # collocations are less than the temporal boundary:
             passed_time_check = np.abs(
-                primary_data["time"][pairs[0]]
-                - secondary_data["time"][pairs[1]]
-            ) < np.timedelta64(max_interval)
+                primary_time[pairs[0]] - secondary_time[pairs[1]]
+            ) < _time_as_int(max_interval)
 
             # Just keep all indices which satisfy the temporal condition.
             pairs = pairs[:, passed_time_check]
 
         return pairs
 
+    def _find_nearest(
+            self, primary_data, secondary_data, primary_points,
+            secondary_points, max_interval, max_distance, max_radius, k,
+            index_key=None):
+        """Find the k nearest secondary points for each primary point
+
+        The Ball tree is queried for the k nearest neighbours. Neighbours
+        farther away than *max_radius* or - in a spatial search - outside of
+        *max_interval* are dropped. Primary points that have fewer than k
+        valid neighbours although the farthest queried neighbour is still
+        within *max_radius* are queried again with twice as many neighbours.
+
+        Returns:
+            A 2xN numpy array with the indices of the pairs. The neighbours
+            of each primary point are sorted by their distance.
+        """
+        dtype = np.int32 \
+            if max(len(primary_points), len(secondary_points)) < 2**31 \
+            else np.int64
+        if not len(primary_points) or not len(secondary_points) or k < 1:
+            return np.empty((2, 0), dtype=dtype)
+
+        tree = self.get_index(
+            index_key,
+            lambda: _build_tree(secondary_points, self.leaf_size),
+            "time" if max_distance is None else "space", self.leaf_size,
+        )
+
+        check_time = max_interval is not None
+        if check_time:
+            primary_time = _time_as_int(primary_data["time"])
+            secondary_time = _time_as_int(secondary_data["time"])
+            max_interval = _time_as_int(max_interval)
+
+        queried = np.arange(len(primary_points))
+        neighbours = min(k, len(secondary_points))
+        primary_indices, secondary_indices = [], []
+        while queried.size:
+            distances, indices = tree.query(
+                primary_points[queried], k=neighbours)
+
+            valid = distances <= max_radius
+            if check_time:
+                valid &= np.abs(
+                    primary_time[queried, np.newaxis]
+                    - secondary_time[indices]
+                ) < max_interval
+
+            # The neighbours are sorted by their distance, i.e. we keep the
+            # first k valid ones. A primary point is done if it has k valid
+            # neighbours or if there are no further candidates:
+            rank = np.cumsum(valid, axis=1)
+            done = (rank[:, -1] >= k) | (distances[:, -1] > max_radius) \
+                | (neighbours == len(secondary_points))
+            rows, columns = np.nonzero(valid & (rank <= k) & done[:, None])
+            primary_indices.append(queried[rows])
+            secondary_indices.append(indices[rows, columns])
+
+            queried = queried[~done]
+            neighbours = min(2 * neighbours, len(secondary_points))
+
+        primary_indices = np.concatenate(primary_indices)
+        order = np.argsort(primary_indices, kind="stable")
+        return np.array([
+            primary_indices[order],
+            np.concatenate(secondary_indices)[order]
+        ]).astype(dtype)
+
+    def _find_space_time(
+            self, primary_data, secondary_data, max_interval, max_distance):
+        """Find collocations with one Ball tree over space and time"""
+        max_radius = max_distance * 1000
+        primary_points = np.column_stack(geocentric2cart(
+            typhon.constants.earth_radius,
+            primary_data["lat"], primary_data["lon"]))
+        secondary_points = np.column_stack(geocentric2cart(
+            typhon.constants.earth_radius,
+            secondary_data["lat"], secondary_data["lon"]))
+
+        primary_time = _time_as_int(primary_data["time"])
+        secondary_time = _time_as_int(secondary_data["time"])
+        interval = _time_as_int(max_interval)
+        if not primary_time.size or not secondary_time.size or interval <= 0:
+            return np.empty((2, 0), dtype=np.int32)
+
+        # The time becomes the fourth coordinate. We subtract a common offset
+        # before converting it to floats to keep the precision and scale it
+        # so that max_interval is as long as max_distance:
+        offset = min(primary_time.min(), secondary_time.min())
+        scale = max_radius / interval
+        primary_points = np.column_stack(
+            [primary_points, (primary_time - offset) * scale])
+        secondary_points = np.column_stack(
+            [secondary_points, (secondary_time - offset) * scale])
+
+        # The Chebyshev distance of two points (the maximum of the coordinate
+        # differences) is never greater than their euclidean distance in
+        # space or their time difference. Hence, the candidates contain all
+        # collocations:
+        pairs = _query_pairs(
+            primary_points, secondary_points, max_radius, self.leaf_size,
+            metric="chebyshev"
+        )
+        if not pairs.size:
+            return pairs
+
+        # Check the exact criteria (the same as for the spatial search):
+        distances = np.sqrt(np.sum(
+            (primary_points[pairs[0], :3]
+             - secondary_points[pairs[1], :3]) ** 2,
+            axis=1
+        ))
+        passed = (distances <= max_radius) & (np.abs(
+            primary_time[pairs[0]] - secondary_time[pairs[1]]) < interval)
+
+        return pairs[:, passed]
+
+
+def _build_tree(points, leaf_size):
+    """Build a Ball tree and return it with its size in bytes"""
+    tree = SklearnBallTree(points, leaf_size=leaf_size)
+    return tree, sum(np.asarray(array).nbytes for array in tree.get_arrays())
+
+
+def _query_pairs(
+        primary_points, secondary_points, max_radius, leaf_size,
+        metric="minkowski", secondary_tree=None):
+    """Find all pairs of points within a radius with a Ball tree
+
+    Args:
+        primary_points: A NxD numpy array with cartesian coordinates.
+        secondary_points: A MxD numpy array with cartesian coordinates.
+        max_radius: The maximal distance between two points.
+        leaf_size: The leaf size of the Ball tree.
+        metric: The distance metric of the Ball tree. Default is the
+            euclidean distance.
+        secondary_tree: A Ball tree of the secondary points. If given, it is
+            used instead of building a new tree.
+
+    Returns:
+        A 2xK numpy array with the indices of the primary (first row) and
+        secondary points (second row). Int32 if all indices fit into it.
+    """
+    # It is more efficient to build the tree with the largest data corpus:
+    tree_with_primary = secondary_tree is None \
+        and primary_points.size > secondary_points.size
+
+    if tree_with_primary:
+        tree_points, query_points = primary_points, secondary_points
+    else:
+        tree_points, query_points = secondary_points, primary_points
+
+    if secondary_tree is not None:
+        tree = secondary_tree
+    else:
+        tree = SklearnBallTree(
+            tree_points, leaf_size=leaf_size, metric=metric)
+    results = tree.query_radius(query_points, r=max_radius)
+
+    dtype = np.int32 \
+        if max(len(tree_points), len(query_points)) < 2**31 else np.int64
+
+    # Build the collocation pairs: each query point is repeated as often as
+    # it has neighbours in the tree.
+    counts = np.fromiter(
+        (len(result) for result in results), dtype=np.int64,
+        count=len(results)
+    )
+    query_indices = np.repeat(
+        np.arange(len(query_points), dtype=dtype), counts)
+    if counts.any():
+        tree_indices = np.concatenate(results).astype(dtype, copy=False)
+    else:
+        tree_indices = np.empty(0, dtype=dtype)
+
+    if tree_with_primary:
+        return np.array([tree_indices, query_indices])
+    return np.array([query_indices, tree_indices])
+
+
+def _expand_ranges(starts, ends):
+    """Enumerate the index ranges [start, end) of many points at once
+
+    Args:
+        starts: The first indices of the ranges (one for each point).
+        ends: The indices after the last indices of the ranges.
+
+    Returns:
+        Two numpy arrays: the index of the point (repeated for each index in
+        its range) and the indices of the ranges.
+    """
+    counts = ends - starts
+    points = np.repeat(np.arange(len(starts)), counts)
+
+    # The indices are consecutive within each range:
+    offsets = np.arange(counts.sum()) \
+        - np.repeat(np.cumsum(counts) - counts, counts)
+    return points, np.repeat(starts, counts) + offsets
+
+
+def _select_nearest(primary_data, secondary_data, pairs, max_distance, k):
+    """Keep only the k nearest secondary points for each primary point
+
+    Args:
+        primary_data: The primary data (see :meth:`Finder.find_collocations`).
+        secondary_data: The secondary data.
+        pairs: A 2xN numpy array with the indices of the collocations.
+        max_distance: If this is None, the nearest neighbours in time are
+            selected. Otherwise the nearest ones in space.
+        k: Number of neighbours to keep.
+
+    Returns:
+        A 2xM numpy array with the indices of the selected collocations. The
+        neighbours of each primary point are sorted by their distance.
+    """
+    pairs = np.asarray(pairs)
+    if not pairs.size:
+        return pairs
+
+    if max_distance is None:
+        distances = np.abs(
+            _time_as_int(primary_data["time"])[pairs[0]]
+            - _time_as_int(secondary_data["time"])[pairs[1]]
+        )
+    else:
+        # The squared chord distance has the same order as the distance
+        # along the sphere:
+        primary_points = np.column_stack(geocentric2cart(
+            1., primary_data["lat"], primary_data["lon"]))
+        secondary_points = np.column_stack(geocentric2cart(
+            1., secondary_data["lat"], secondary_data["lon"]))
+        distances = np.sum(
+            (primary_points[pairs[0]] - secondary_points[pairs[1]]) ** 2,
+            axis=1
+        )
+
+    order = np.lexsort((distances, pairs[0]))
+    pairs = pairs[:, order]
+
+    # The rank of each pair among the pairs of its primary point:
+    starts = np.flatnonzero(np.diff(pairs[0], prepend=-1))
+    rank = np.arange(pairs.shape[1]) \
+        - np.repeat(starts, np.diff(np.append(starts, pairs.shape[1])))
+    return pairs[:, rank < k]
+
+
+def _time_as_int(time):
+    """Convert datetime64 / timedelta objects to int64 nanoseconds"""
+    if isinstance(time, timedelta):
+        time = np.timedelta64(time)
+    time = np.asarray(time)
+    if time.dtype.kind == "M":
+        return time.astype("M8[ns]").view("int64")
+    return time.astype("m8[ns]").view("int64")
+
 
 class BruteForce(Finder):
-    def __init__(self):
+    """Find collocations by comparing each point with each other point
+
+    This is inefficient (O(n*m) time) but simple and hence useful as
+    reference for the other finders. The points are compared in tiles of
+    primary and secondary points whose temporary arrays fit into *max_bytes*.
+    The squared chord distances of a tile are calculated via one matrix
+    product, i.e. :math:`|p-s|^2 = |p|^2 + |s|^2 - 2 p \\cdot s`.
+    """
+
+    def __init__(self, max_bytes=None, threads=None):
+        """Initialise a BruteForce finder.
+
+        Args:
+            max_bytes: Maximal number of bytes that the temporary arrays of
+                one tile may use. Default is 256 MB.
+            threads: Number of threads that compare the tiles in parallel.
+                Note that each thread needs up to *max_bytes*. Default is 1.
+        """
         super(BruteForce, self).__init__()
 
+        self.max_bytes = 256 * 1024**2 if max_bytes is None else max_bytes
+        self.threads = threads
+
     def find_collocations(
             self, primary_data, secondary_data, max_interval, max_distance,
             **kwargs
     ):
 
+        if max_distance is None and max_interval is None:
+            raise ValueError(
+                "Either max_distance or max_interval must be given!")
+
         timer = time.time()
 
-        # Find all spatial collocations by brute-force:
-        primary_points = geocentric2cart(
-            typhon.constants.earth_radius,
-            primary_data["lat"], primary_data["lon"])
-        secondary_points = geocentric2cart(
-            typhon.constants.earth_radius,
-            secondary_data["lat"], secondary_data["lon"])
+        if max_interval is not None:
+            max_interval = _time_as_int(to_timedelta(max_interval))
+            primary_time = _time_as_int(primary_data["time"])
+            secondary_time = _time_as_int(secondary_data["time"])
+        else:
+            primary_time = secondary_time = None
+
+        if max_distance is not None:
+            primary_points = np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                primary_data["lat"], primary_data["lon"]))
+            secondary_points = np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                secondary_data["lat"], secondary_data["lon"]))
+            max_distance = (max_distance * 1000) ** 2
+        else:
+            primary_points = secondary_points = None
+
+        primary_size = len(primary_data["time"])
+        secondary_size = len(secondary_data["time"])
+        dtype = np.int32 \
+            if max(primary_size, secondary_size) < 2**31 else np.int64
+
+        # Each element of a tile needs at most one 8-byte array at once
+        # (the float64 squared distances or the int64 time differences, see
+        # _compare_tile) and three boolean masks (the masks of both criteria
+        # and their combination):
+        elements = max(1, self.max_bytes // (8 + 3))
+        columns = int(max(1, min(secondary_size, np.sqrt(elements))))
+        rows = int(max(1, min(primary_size, elements // columns)))
+        tiles = [
+            (row, column, rows, columns)
+            for row in range(0, primary_size, rows)
+            for column in range(0, secondary_size, columns)
+        ]
+
+        data = (primary_points, secondary_points, primary_time,
+                secondary_time, max_interval, max_distance)
+        if self.threads is not None and self.threads > 1:
+            with ThreadPool(self.threads) as pool:
+                results = pool.starmap(
+                    _compare_tile, [(data, *tile) for tile in tiles])
+        else:
+            results = [_compare_tile(data, *tile) for tile in tiles]
 
-        distances = distance_matrix(
-            np.column_stack(primary_points),
-            np.column_stack(secondary_points)
-        )
-        primary_indices, secondary_indices = np.nonzero(
-            distances < max_distance*1000)
+        if results:
+            pairs = np.concatenate(results, axis=1).astype(dtype)
+        else:
+            pairs = np.empty((2, 0), dtype=dtype)
 
         logging.debug(
-            "\tFound {} primary and {} secondary spatial collocations in "
-            "{:.2f}s.".format(
-                primary_indices.size,
-                secondary_indices.size,
-                time.time() - timer
+            "\tFound {} collocations in {} tiles in {:.2f}s.".format(
+                pairs.shape[1], len(tiles), time.time() - timer
             )
         )
 
-        # Check the temporal condition:
-        if max_interval is not None:
-            intervals = \
-                np.abs(primary_data["time"][primary_indices]
-                       - secondary_data["time"][secondary_indices])
-            passed_time_check = intervals < max_interval
+        return pairs
+
+
+def _compare_tile(data, row, column, rows, columns):
+    """Find the pairs within one tile of the BruteForce finder
+
+    Args:
+        data: A tuple with the cartesian points and times of the primary and
+            secondary data, the maximal interval in nanoseconds and the
+            maximal squared distance in meters. Points or times are None if
+            they should not be checked.
+        row: Index of the first primary point of the tile.
+        column: Index of the first secondary point of the tile.
+        rows: Number of primary points in the tile.
+        columns: Number of secondary points in the tile.
+
+    Returns:
+        A 2xN numpy array with the indices of the pairs.
+    """
+    primary_points, secondary_points, primary_time, secondary_time, \
+        max_interval, max_distance = data
+    primary_slice = slice(row, row + rows)
+    secondary_slice = slice(column, column + columns)
+
+    mask = None
+    if max_distance is not None:
+        primary_tile = primary_points[primary_slice]
+        secondary_tile = secondary_points[secondary_slice]
+
+        # The matrix product is calculated by BLAS and hence fast:
+        distances = primary_tile @ secondary_tile.T
+        distances *= -2
+        distances += np.einsum("ij,ij->i", primary_tile, primary_tile)[
+            :, np.newaxis]
+        distances += np.einsum("ij,ij->i", secondary_tile, secondary_tile)
+        mask = distances < max_distance
+        del distances
+
+    if max_interval is not None:
+        # Computed in place to need only one int64 array:
+        intervals = primary_time[primary_slice, np.newaxis] \
+            - secondary_time[np.newaxis, secondary_slice]
+        np.abs(intervals, out=intervals)
+        intervals = intervals < max_interval
+        mask = intervals if mask is None else mask & intervals
+
+    primary_indices, secondary_indices = np.nonzero(mask)
+    return np.array([primary_indices + row, secondary_indices + column])
+
+
+class SweepLine(Finder):
+    """Find collocations by sweeping a time window over the sorted data
+
+    Both data arrays are sorted by time once. Then the primary points are
+    processed in blocks that cover at most *max_interval* (and
+    *block_size* points). The secondary points that can collocate with a
+    block lie within *max_interval* before and after it. They are found by
+    binary search and only among them a Ball tree searches for spatial
+    neighbours. Hence, this needs roughly O(n log n) time for long time
+    series instead of comparing everything with everything.
+
+    This finds the same pairs as :class:`BallTree`.
+    """
+    def __init__(self, leaf_size=None, block_size=None):
+        """Initialise a SweepLine object.
+
+        Args:
+            leaf_size: Leaf size of the Ball trees (default is 16).
+            block_size: Maximal number of primary points in one block
+                (default is 10'000).
+        """
+        super(SweepLine, self).__init__()
+
+        self.leaf_size = 16 if leaf_size is None else leaf_size
+        self.block_size = 10_000 if block_size is None else block_size
+
+    def find_collocations(
+        self, primary_data, secondary_data, max_interval, max_distance,
+        **kwargs
+    ):
+        if max_interval is None:
+            # Without a time window there is nothing to sweep:
+            return BallTree(self.leaf_size).find_collocations(
+                primary_data, secondary_data, max_interval, max_distance,
+                **kwargs
+            )
+
+        max_interval = to_timedelta(max_interval)
 
-            primary_indices = primary_indices[passed_time_check]
-            secondary_indices = secondary_indices[passed_time_check]
+        primary_time = _time_as_int(primary_data["time"])
+        secondary_time = _time_as_int(secondary_data["time"])
+        interval = int(_time_as_int(max_interval))
 
-        return Array(primary_indices), Array(secondary_indices)
+        # Sort both data arrays by time:
+        primary_order = np.argsort(primary_time, kind="stable")
+        secondary_order = np.argsort(secondary_time, kind="stable")
+        primary_time = primary_time[primary_order]
+        secondary_time = secondary_time[secondary_order]
 
+        if max_distance is None:
+            pairs = self._find_temporal(
+                primary_time, secondary_time, interval)
+        else:
+            primary_points = np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                np.asarray(primary_data["lat"])[primary_order],
+                np.asarray(primary_data["lon"])[primary_order],
+            ))
+            secondary_points = np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                np.asarray(secondary_data["lat"])[secondary_order],
+                np.asarray(secondary_data["lon"])[secondary_order],
+            ))
+            pairs = self._find_spatial_temporal(
+                primary_time, secondary_time, interval,
+                primary_points, secondary_points, max_distance*1000,
+            )
 
+        # Let the indices point to the unsorted data again:
+        pairs = np.array([
+            primary_order[pairs[0]], secondary_order[pairs[1]]
+        ])
+        return pairs[:, np.lexsort(pairs[::-1])]
+
+    @staticmethod
+    def _find_temporal(primary_time, secondary_time, interval):
+        """Find all pairs with a time difference of less than *interval*"""
+        starts = np.searchsorted(
+            secondary_time, primary_time - interval, side="right")
+        ends = np.searchsorted(
+            secondary_time, primary_time + interval, side="left")
+        return np.array(_expand_ranges(starts, ends))
+
+    def _find_spatial_temporal(
+            self, primary_time, secondary_time, interval, primary_points,
+            secondary_points, max_radius):
+        """Find pairs within the distance and the time window block-wise"""
+        pairs = [np.empty((2, 0), dtype=int)]
+
+        block_start = 0
+        while block_start < primary_time.size:
+            # The primary block covers at most one time interval:
+            block_end = min(
+                np.searchsorted(
+                    primary_time, primary_time[block_start] + interval,
+                    side="right"),
+                block_start + self.block_size
+            )
+
+            # All secondary points that might collocate with this block:
+            secondary_start = np.searchsorted(
+                secondary_time, primary_time[block_start] - interval,
+                side="right")
+            secondary_end = np.searchsorted(
+                secondary_time, primary_time[block_end - 1] + interval,
+                side="left")
+
+            if secondary_start < secondary_end:
+                block_pairs = _query_pairs(
+                    primary_points[block_start:block_end],
+                    secondary_points[secondary_start:secondary_end],
+                    max_radius, self.leaf_size,
+                )
+                block_pairs[0] += block_start
+                block_pairs[1] += secondary_start
+
+                # Check the exact temporal condition:
+                passed_time_check = np.abs(
+                    primary_time[block_pairs[0]]
+                    - secondary_time[block_pairs[1]]
+                ) < interval
+                pairs.append(block_pairs[:, passed_time_check])
+
+            block_start = block_end
+
+        return np.hstack(pairs)
+
+
+class GridHash(Finder):
+    """Find collocations by hashing the points into a spatial grid
+
+    The points are converted to 3D-cartesian coordinates (like by
+    :class:`BallTree`) and put into cubic cells with the edge length of
+    *max_distance*. Two points that are not farther away from each other
+    than *max_distance* must lie in the same or in neighbouring cells. Hence,
+    the secondary points are sorted by their cell keys and for each of the 27
+    neighbouring cells of the primary points the candidates are found by
+    binary search. The distances (and time differences) of the candidates are
+    checked exactly afterwards.
+
+    This needs only numpy operations (which release the GIL for large arrays)
+    and memory linear in the number of points and candidates. It is fast for
+    small distances (e.g. a few kilometers) but gets slow for large ones since
+    each cell contains many points then.
+
+    This finds the same pairs as :class:`BallTree`. Temporal-only searches
+    are delegated to :class:`SweepLine`.
+    """
 
+    def find_collocations(
+        self, primary_data, secondary_data, max_interval, max_distance,
+        **kwargs
+    ):
+        if max_distance is None:
+            return SweepLine().find_collocations(
+                primary_data, secondary_data, max_interval, max_distance,
+                **kwargs
+            )
+
+        radius = typhon.constants.earth_radius
+        max_radius = max_distance * 1000
+
+        # The cell keys are unique integers as long as the grid is not too
+        # fine. We add a margin of two cells to each side, so the neighbours
+        # of all cells have valid keys too:
+        cells_per_axis = 2 * int(np.ceil(radius / max_radius)) + 5
+        if cells_per_axis**3 >= 2**62:
+            return BallTree().find_collocations(
+                primary_data, secondary_data, max_interval, max_distance,
+                **kwargs
+            )
+
+        primary_points = np.column_stack(geocentric2cart(
+            radius, np.asarray(primary_data["lat"]),
+            np.asarray(primary_data["lon"]),
+        ))
+        secondary_points = np.column_stack(geocentric2cart(
+            radius, np.asarray(secondary_data["lat"]),
+            np.asarray(secondary_data["lon"]),
+        ))
+
+        # Sorting both point sets by their cell keys makes the binary search
+        # and the lookup of the coordinates much more cache-friendly:
+        primary_keys = self._cell_keys(
+            primary_points, max_radius, cells_per_axis)
+        primary_order = np.argsort(primary_keys, kind="stable")
+        primary_keys = primary_keys[primary_order]
+        primary_points = primary_points[primary_order]
+
+        secondary_keys = self._cell_keys(
+            secondary_points, max_radius, cells_per_axis)
+        secondary_order = np.argsort(secondary_keys, kind="stable")
+        secondary_keys = secondary_keys[secondary_order]
+        secondary_points = secondary_points[secondary_order]
+
+        if max_interval is not None:
+            primary_time = _time_as_int(primary_data["time"])[primary_order]
+            secondary_time = \
+                _time_as_int(secondary_data["time"])[secondary_order]
+            interval = _time_as_int(to_timedelta(max_interval))
+
+        dtype = np.int32 \
+            if max(len(primary_points), len(secondary_points)) < 2**31 \
+            else np.int64
+
+        pairs = [np.empty((2, 0), dtype=dtype)]
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                # The three neighbouring cells along the z-axis have
+                # consecutive keys, so we can look them up at once:
+                neighbour_keys = primary_keys \
+                    + (dx * cells_per_axis + dy) * cells_per_axis
+                primary_indices, secondary_indices = _expand_ranges(
+                    np.searchsorted(
+                        secondary_keys, neighbour_keys - 1, side="left"),
+                    np.searchsorted(
+                        secondary_keys, neighbour_keys + 1, side="right"),
+                )
+
+                # The exact checks:
+                passed = np.sum(
+                    (primary_points[primary_indices]
+                     - secondary_points[secondary_indices]) ** 2,
+                    axis=1
+                ) <= max_radius ** 2
+                if max_interval is not None:
+                    passed &= np.abs(
+                        primary_time[primary_indices]
+                        - secondary_time[secondary_indices]
+                    ) < interval
+
+                pairs.append(np.array([
+                    primary_order[primary_indices[passed]],
+                    secondary_order[secondary_indices[passed]],
+                ], dtype=dtype))
+
+        return np.hstack(pairs)
+
+    @staticmethod
+    def _cell_keys(points, edge, cells_per_axis):
+        """Get the unique integer key of the cell of each point"""
+        cells = np.floor(points / edge).astype(np.int64) \
+            + cells_per_axis // 2
+        return (cells[:, 0] * cells_per_axis + cells[:, 1]) \
+            * cells_per_axis + cells[:, 2]
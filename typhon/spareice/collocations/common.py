@@ -7,9 +7,15 @@ TODO: I would like to have this package as typhon.collocations.
 Created by John Mrziglod, June 2017
 """
 
+import copy
 from datetime import datetime, timedelta
+import hashlib
+import json
 import logging
+import os
+import shutil
 import time
+from multiprocessing import Pool as ProcessPool
 from multiprocessing.pool import ThreadPool
 import traceback
 import warnings
@@ -19,10 +25,14 @@ import pandas as pd
 import scipy.stats
 from typhon.math import cantor_pairing
 from typhon.spareice.array import Array, GroupedArrays
+from typhon.spareice.cache import ReadCache
 from typhon.spareice.datasets import Dataset, DataSlider
+from typhon.spareice.shared import SharedObject
 from typhon.utils.time import to_datetime, to_timedelta
 
-from .algorithms import BallTree, BruteForce
+from .algorithms import (
+    BallTree, BruteForce, GridHash, SweepLine, _select_nearest
+)
 
 __all__ = [
     "collocate",
@@ -35,6 +45,8 @@ __all__ = [
 ALGORITHM = {
     "BallTree": BallTree,
     "BruteForce": BruteForce,
+    "GridHash": GridHash,
+    "SweepLine": SweepLine,
 }
 
 COLLOCATION_FIELD = "__collocation_ids"
@@ -89,18 +101,103 @@ class CollocatedDataset(Dataset):
 
     @staticmethod
     def _add_fields_to_data(data, original_dataset, group, fields):
-        try:
-            original_file = data[group].attrs["__original_file"]
-        except KeyError:
+        return CollocatedDataset._hydrate_group(
+            data, original_dataset, group, fields)
+
+    @staticmethod
+    def _hydrate_group(data, original_dataset, group, fields):
+        """Gather fields of one group from its original files
+
+        The collocated points are grouped by their original file. Hence, each
+        file is read only once (and only the requested fields).
+
+        Args:
+            data: A GroupedArrays object with collocations.
+            original_dataset: The Dataset object with the original files.
+            group: Name of the group in *data*.
+            fields: List of the field names.
+
+        Returns:
+            *data* with the added fields.
+        """
+        attrs = data[group].attrs
+        if "__original_files" in attrs:
+            original_files = attrs["__original_files"].split(";")
+        elif "__original_file" in attrs:
+            original_files = [attrs["__original_file"]]
+        else:
             raise KeyError(
                 "The collocation files does not contain information about "
                 "their original files.")
-        original_data = original_dataset.read(original_file)[fields]
-        original_indices = data[group]["__original_indices"]
-        data[group] = GroupedArrays.merge(
-            [data[group], original_data[original_indices]],
-            overwrite_error=False
-        )
+
+        if "__original_file_sizes" not in attrs:
+            raise KeyError(
+                "The collocation files does not contain the sizes of "
+                "their original files.")
+
+        indices = np.asarray(data[group]["__original_indices"])
+
+        # The indices refer to the concatenated data of all original files:
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.atleast_1d(attrs["__original_file_sizes"]))]
+        ).astype(int)
+        file_ids = np.searchsorted(offsets, indices, side="right") - 1
+        file_indices = indices - offsets[file_ids]
+
+        gathered = {}
+        for file_id in np.unique(file_ids):
+            selected = file_ids == file_id
+            original_data = original_dataset.read(
+                original_files[file_id], fields=fields)
+            for field in fields:
+                values = original_data[field][file_indices[selected]]
+                if field not in gathered:
+                    gathered[field] = Array(
+                        np.empty((len(indices),) + values.shape[1:],
+                                 dtype=values.dtype),
+                        attrs=dict(getattr(values, "attrs", {})),
+                    )
+                gathered[field][selected] = values
+
+        for field, values in gathered.items():
+            data[group][field] = values
+
+        return data
+
+    def hydrate(self, data, datasets, fields):
+        """Add fields from the original files to collocated data
+
+        Use this for collocations that have been stored with the
+        *index_only* option of :func:`collocate_datasets`, i.e. that only
+        contain the indices, times and positions of the collocated points.
+        But it works with all collocations.
+
+        Args:
+            data: A GroupedArrays object read from this dataset.
+            datasets: A list of the original Dataset objects. Their names must
+                be the names of the groups in *data*.
+            fields: A dictionary with the names of the groups and lists of
+                the fields that should be added to them.
+
+        Returns:
+            *data* with the added fields.
+
+        Examples:
+
+        .. code-block:: python
+
+            collocations = CollocatedDataset(
+                "collocations/{year}/{doy}/{hour}{minute}{second}.nc",
+            )
+            data = collocations.collect("2018-01-01", "2018-01-02")
+            data = collocations.hydrate(
+                data, [mhs, avhrr], {"MHS": ["brightness_temperature"]}
+            )
+        """
+        datasets = {dataset.name: dataset for dataset in datasets}
+
+        for group, group_fields in fields.items():
+            self._hydrate_group(data, datasets[group], group, group_fields)
 
         return data
 
@@ -303,7 +400,8 @@ class CollocatedDataset(Dataset):
 
 
 def collocate(arrays, max_interval=None, max_distance=None,
-              algorithm=None, threads=None,):
+              algorithm=None, threads=None, processes=None, k=None,
+              index_key=None):
     """Find collocations between two data arrays
 
     Collocations are two or more data points that are located close to each
@@ -321,8 +419,9 @@ def collocate(arrays, max_interval=None, max_distance=None,
         arrays: A list of data arrays that fulfill the specifications from
             above. So far, only collocating two arrays is implemented.
         max_interval: The maximum interval of time between two data points
-            in seconds. If this is None, the data will be searched for spatial
-            collocations only.
+            in seconds. The time differences of collocations are less than
+            this (all finders compare them in nanoseconds). If this is None,
+            the data will be searched for spatial collocations only.
         max_distance: The maximum distance between two data points in
             kilometers to meet the collocation criteria. If this is None,
             the data will be searched for temporal collocations only. Either
@@ -333,12 +432,32 @@ def collocate(arrays, max_interval=None, max_distance=None,
             a string with the name of an algorithm. Default is the
             *BallTree* algorithm. See below for a table of available
             algorithms.
-        threads:
+        threads: Number of threads that search for collocations in parallel.
+            The data is split into time bins (or chunks if *max_interval* is
+            not given) that are processed by the threads. Only used if the
+            finder algorithm loves threading. Default is no parallelisation.
+        processes: Number of processes that search for collocations in
+            parallel. Like *threads* but the time, latitude and longitude
+            arrays are passed to the worker processes via shared memory.
+            Overrides *threads*.
+        k: If this is given, only the *k* nearest secondary points (in space
+            or - if *max_distance* is None - in time) that meet the criteria
+            are returned for each primary point. Hence, you do not need to
+            collapse the collocations later. Finders that support it (e.g.
+            *BallTree*) search directly for the nearest neighbours, for the
+            others they are selected from all found collocations.
+        index_key: A hashable object that identifies the secondary data,
+            e.g. the files where they come from and their slice. If the
+            finder algorithm has an *index_cache*, its index of the
+            secondary data (e.g. the Ball tree) is cached with this key and
+            reused by later calls with the same key. Ignored when the data
+            are split into bins (see *threads*). Default is no caching.
 
     Returns:
         A 2xN numpy array where N is the number of found collocations. The
         first row contains the indices of the collocations in *data1*, the
-        second row the indices in *data2*.
+        second row the indices in *data2*. With *k*, N is at most k times
+        the size of *data1*.
 
     How the collocations are going to be found is specified by the used
     algorithm. The following algorithms are possible (you can use your
@@ -354,11 +473,25 @@ def collocate(arrays, max_interval=None, max_distance=None,
     +--------------+------------------------------------------------------+
     | BruteForce   | Finds the collocation by comparing each point of the |
     |              |                                                      |
-    |              | dataset with each other. Should be only used for     |
+    |              | dataset with each other (in tiles of limited memory).|
+    |              |                                                      |
+    |              | Should be only used for testing purposes since it is |
+    |              |                                                      |
+    |              | very time consuming for big datasets.                |
+    +--------------+------------------------------------------------------+
+    | GridHash     | Sorts the points into a grid of cubic cells with the |
     |              |                                                      |
-    |              | testing purposes since it is inefficient and very    |
+    |              | edge length *max_distance* and compares only points  |
     |              |                                                      |
-    |              | memory- and time consuming for big datasets.         |
+    |              | in neighbouring cells. Fast for small distances.     |
+    +--------------+------------------------------------------------------+
+    | SweepLine    | Sorts the data by time and searches with Ball trees  |
+    |              |                                                      |
+    |              | only among the points within the time window. Finds  |
+    |              |                                                      |
+    |              | the same collocations as BallTree but is faster for  |
+    |              |                                                      |
+    |              | long and dense time series.                          |
     +--------------+------------------------------------------------------+
 
     .. [1] http://scikit-learn.org/stable/modules/generated/sklearn.neighbors.BallTree.html
@@ -405,225 +538,233 @@ def collocate(arrays, max_interval=None, max_distance=None,
     if max_interval is not None:
         max_interval = to_timedelta(max_interval, numbers_as="seconds")
 
-    if algorithm is None:
-        algorithm = BallTree()
-    else:
-        if isinstance(algorithm, str):
-            try:
-                algorithm = ALGORITHM[algorithm]()
-            except KeyError:
-                raise ValueError("Unknown algorithm: %s" % algorithm)
-        else:
-            algorithm = algorithm
+    algorithm = _get_algorithm(algorithm)
 
-    threads = 2 if threads is None else threads
+    if processes is not None and processes > 1:
+        workers, worker_type = processes, "process"
+    elif threads is not None and threads > 1 and algorithm.loves_threading:
+        workers, worker_type = threads, "thread"
+    else:
+        workers, worker_type = 1, None
 
     # If the time matters (i.e. max_interval is not None), we split the data
     # into temporal bins. This produces an overhead that is only negligible if
     # we have a lot of data:
-    data_magnitude = arrays[0]["time"].shape[0] * arrays[1]["time"].shape[0]
-
-    # We can search for spatial collocations (max_interval=None), temporal
-    # collocations (max_distance=None) or both.
-    if max_interval is not None and data_magnitude > 100_0000:
-        # Search for temporal and temporal-spatial collocations #
-
-        # We start by selecting only the time period where both data
-        # arrays have data and that lies in the time period requested by the
-        # user.
-        common_time = _select_common_time(
-            arrays[0]["time"], arrays[1]["time"], max_interval
-        )
-
-        if common_time is None:
-            # There was no common time window found
-            return np.array([[], []])
-
-        start, end, *time_indices = common_time
+    data_magnitude = len(arrays[0]["time"]) * len(arrays[1]["time"])
 
-        # Select the relevant data:
-        # TODO: We should convert the data arrays first to an GroupedArrays or
-        # TODO: xarray explicitly
-        arrays[0] = arrays[0][time_indices[0]]
-        arrays[1] = arrays[1][time_indices[1]]
-
-        # We need this frequency as pandas.Timestamp because we use
-        # pandas.period_range later.
-        bin_size = pd.Timedelta(
-            (pd.Timestamp(end) - pd.Timestamp(start)) / (4 * threads - 1)
+    if worker_type is not None \
+            or (max_interval is not None and data_magnitude > 100_0000):
+        pairs = _collocate_bins(
+            arrays, algorithm, max_interval, max_distance, workers,
+            worker_type, k,
         )
-
-        # Now let's split the two data arrays along their time coordinate so we
-        # avoid searching for spatial collocations that do not fulfill the
-        # temporal condition in the first place. However, the overhead of the
-        # finding algorithm must be considered too (for example the BallTree
-        # creation time). We choose therefore a bin size of roughly 10'000
-        # elements and minimum bin duration of max_interval.
-        # The collocations that we will miss at the bin edges are going to be
-        # found later.
-        # TODO: Unfortunately, a first attempt parallelizing this using threads
-        # TODO: worsened the performance.
-        pairs_without_overlaps = np.hstack([
-            _collocate_period(arrays[0], arrays[1], period)
-            for period in pd.period_range(start, end, freq=bin_size)
-        ])
-
-        # Now, imagine our situation like this:
-        #
-        # [ PRIMARY BIN 1       ][ PRIMARY BIN 2        ]
-        # ---------------------TIME--------------------->
-        #   ... [ -max_interval ][ +max_interval ] ...
-        # ---------------------TIME--------------------->
-        # [ SECONDARY BIN 1     ][ SECONDARY BIN 2      ]
-        #
-        # We have already found the collocations between PRIMARY BIN 1 &
-        # SECONDARY BIN 1 and PRIMARY BIN 2 & SECONDARY BIN 2. However, the
-        # [-max_interval] part of PRIMARY BIN 2 might be collocated with the
-        # [+max_interval] part of SECONDARY BIN 1 (the same applies to
-        # [+max_interval] of the PRIMARY BIN 1 and [-max_interval] of the
-        # SECONDARY BIN 2). Let's find them here:
-        pairs_of_overlaps = np.hstack([
-            _collocate_period(
-                *arrays,
-                algorithm, (max_interval, max_distance),
-                pd.Period(date - max_interval, max_interval)
-                if prev1_with_next2 else pd.Period(date, max_interval),
-                pd.Period(date, max_interval) if prev1_with_next2
-                else pd.Period(date - max_interval, max_interval),
-            )
-            for date in pd.date_range(start, end, freq=bin_size)[1:-1]
-            for prev1_with_next2 in [True, False]
-        ])
-
-        # Put all collocations together then. Note that they are not sorted:
-        pairs = np.hstack([pairs_without_overlaps, pairs_of_overlaps])
-
-        # No collocations were found.
-        if not pairs.any():
-            return pairs
-
-        # We selected a common time window and cut off a part in the beginning,
-        # do you remember? Now we shift the indices so that they point again
-        # to the real original data.
-        pairs[0] += np.where(time_indices[0])[0][0]
-        pairs[1] += np.where(time_indices[1])[0][0]
     else:
         # Search for spatial or temporal-spatial collocations but do not do any
         # pre-binning:
+        kwargs = {}
+        if k is not None:
+            kwargs["k"] = k
+        if index_key is not None:
+            kwargs["index_key"] = index_key
         pairs = algorithm.find_collocations(
-            *arrays, max_distance=max_distance, max_interval=max_interval
+            *arrays, max_distance=max_distance, max_interval=max_interval,
+            **kwargs
         )
 
+    if k is not None and not algorithm.finds_nearest:
+        pairs = _select_nearest(*arrays, pairs, max_distance, k)
+
     return pairs
 
 
-def _select_common_time(data1, data2, max_interval):
-    common_start = np.max(
-        [data1["time"].min(), data1["time"].min()]
-    ) - max_interval
-    common_end = np.min(
-        [data1["time"].max(), data1["time"].max()]
-    ) + max_interval
-
-    # Return the indices from the data in the common time window
-    indices1 = (common_start <= data1["time"]) & (data1["time"] <= common_end)
-    if not indices1.any():
-        return None
-
-    indices2 = (common_start <= data2["time"]) & (data2["time"] <= common_end)
-    if not indices2.any():
-        return None
-
-    return common_start, common_end, indices1, indices2
-
-
-def _collocate_period(data1, data2, algorithm, algorithm_args,
-                      period1, period2=None, ):
-    if period2 is None:
-        period2 = period1
-
-    # Select the period
-    indices1 = np.where(
-        (period1.start_time < data1["time"])
-        & (data1["time"] < period1.end_time)
-    )[0]
-    if not indices1.any():
-        return np.array([[], []])
-
-    indices2 = np.where(
-        (period2.start_time < data2["time"])
-        & (data2["time"] < period2.end_time)
-    )[0]
-    if not indices2.any():
-        return np.array([[], []])
-
-    pair_indices = algorithm.find_collocations(
-        data1[indices1], data2[indices2],
-        *algorithm_args,
+def _get_algorithm(algorithm):
+    """Get the Finder object for the *algorithm* argument of collocate"""
+    if algorithm is None:
+        return BallTree()
+    elif isinstance(algorithm, str):
+        try:
+            return ALGORITHM[algorithm]()
+        except KeyError:
+            raise ValueError("Unknown algorithm: %s" % algorithm)
+    return algorithm
+
+
+def _collocate_bins(
+        arrays, algorithm, max_interval, max_distance, workers, worker_type,
+        k=None):
+    """Split the data into time bins and search for collocations in each bin
+
+    Each primary point belongs to exactly one bin. The secondary points of a
+    bin are all points within *max_interval* before and after the bin, i.e.
+    the bins overlap for the secondary data and no collocations are lost at
+    the bin edges (nor found twice). Without *max_interval*, the primary data
+    is simply split into chunks and searched against all secondary points.
+
+    Args:
+        arrays: A list of two data arrays (see :func:`collocate`).
+        algorithm: A Finder object.
+        max_interval: A timedelta object or None.
+        max_distance: The maximum distance in kilometers or None.
+        workers: Number of parallel workers.
+        worker_type: Either *process*, *thread* or None (no parallelisation).
+        k: Number of nearest neighbours to find (or None for all).
+
+    Returns:
+        A 2xN numpy array with the indices of the collocations.
+    """
+    # We need only the time and position columns sorted by time:
+    columns, orders = [], []
+    for array in arrays:
+        times = np.asarray(array["time"]).astype("M8[ns]")
+        order = np.argsort(times, kind="stable")
+        columns.append({
+            "time": times[order],
+            "lat": np.asarray(array["lat"])[order],
+            "lon": np.asarray(array["lon"])[order],
+        })
+        orders.append(order)
+
+    # The overhead of the finding algorithm must be considered too (for
+    # example the BallTree creation time). Hence, we do not want to have too
+    # many bins but enough to balance the load between the workers:
+    bins = _get_bins(
+        columns[0]["time"], columns[1]["time"], max_interval,
+        4 * workers - 1
+    )
+    if not bins:
+        return np.array([[], []], dtype=int)
+
+    # Processes get the data via shared memory instead of pickling it for
+    # each bin:
+    if worker_type == "process":
+        data = SharedObject(columns, transfer=False)
+        pool = ProcessPool(workers)
+    elif worker_type == "thread":
+        data = columns
+        pool = ThreadPool(workers)
+    else:
+        data = columns
+        pool = None
+
+    jobs = [
+        (data, algorithm, max_interval, max_distance, bounds, k)
+        for bounds in bins
+    ]
+    try:
+        if pool is None:
+            results = [_collocate_bin(*job) for job in jobs]
+        else:
+            results = pool.starmap(_collocate_bin, jobs)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if worker_type == "process":
+            data.release()
+
+    # Let the indices point to the unsorted data again:
+    pairs = np.hstack(results)
+    return np.array([orders[0][pairs[0]], orders[1][pairs[1]]])
+
+
+def _get_bins(primary_time, secondary_time, max_interval, number):
+    """Get the index ranges of the primary and secondary data of each bin
+
+    Args:
+        primary_time: Sorted datetime64 array.
+        secondary_time: Sorted datetime64 array.
+        max_interval: A timedelta object or None.
+        number: Maximal number of bins.
+
+    Returns:
+        A list of tuples: start and end index of the primary and start and
+        end index of the secondary data.
+    """
+    if not len(primary_time) or not len(secondary_time):
+        return []
+
+    if max_interval is None:
+        edges = np.unique(
+            np.linspace(0, len(primary_time), number + 1).astype(int))
+        return [
+            (start, end, 0, len(secondary_time))
+            for start, end in zip(edges[:-1], edges[1:])
+        ]
+
+    # The bins include the points at exactly max_interval, the finder checks
+    # the exact (exclusive) interval anyway:
+    max_interval = np.timedelta64(max_interval, "ns")
+
+    # Only the time period where both arrays have data matters:
+    start = max(primary_time[0], secondary_time[0] - max_interval)
+    end = min(primary_time[-1], secondary_time[-1] + max_interval)
+    if start > end:
+        return []
+
+    edges = np.searchsorted(
+        primary_time,
+        start + (end - start) * np.linspace(0, 1, number + 1)[:-1],
+        side="left",
     )
+    edges = np.unique(np.append(
+        edges, np.searchsorted(primary_time, end, side="right")))
+
+    bins = []
+    for primary_start, primary_end in zip(edges[:-1], edges[1:]):
+        # All secondary points that might collocate with this bin:
+        secondary_start = np.searchsorted(
+            secondary_time, primary_time[primary_start] - max_interval,
+            side="left")
+        secondary_end = np.searchsorted(
+            secondary_time, primary_time[primary_end - 1] + max_interval,
+            side="right")
+
+        if secondary_start < secondary_end:
+            bins.append((
+                primary_start, primary_end, secondary_start, secondary_end
+            ))
+
+    return bins
 
-    if not pair_indices.any():
-        return np.array([[], []])
-
-    # We selected a time period, hence we must correct the found indices
-    # to let them point to the original data1 and data2
-    pair_indices[0] = indices1[pair_indices[0]]
-    pair_indices[1] = indices2[pair_indices[1]]
-
-    # Get also the indices where we searched in overlapping periods
-    # overlapping_with_before = \
-    #     np.where(
-    #         (period.start_time - max_interval < data1["time"])
-    #         & (data1["time"] < period.start_time)
-    #     )
-    # overlapping_with_after = \
-    #     np.where(
-    #         (period.end_time - max_interval < data1["time"])
-    #         & (data1["time"] < period.end_time)
-    #     )
-
-    # Return also unique collocation ids to detect duplicates later
-    return pair_indices
-
-# TODO: Parallelizing collocate() does not work properly since threading and
-# the GIL introduces a significant overhead. Maybe one should give
-# multiprocessing a try but this would require pickling many (possibly huge)
-# data arrays. Hence, this is so far deprecated:
-# def _parallelizing():
-#     # We need to decide whether we should parallelize everything by using
-#     # threads or not.
-#     if (time_indices[0].size > 10000 and time_indices[1].size > 10000) or
-#             algorithm.loves_threading:
-#         # Oh yes, let's parallelize it and create a pool of threads! Why
-#         # threads instead of processes? We do not want to pickle the arrays
-#         # (because they could be huge) and we trust our finding algorithm
-#         # when it says it loves threading.
-#         pool = ThreadPool(threads, )
-#
-#         # Get all overlaps (time periods where two threads search for
-#         # collocations):
-#         # overlap_indicess = [
-#         #     [[period.start_time-max_interval, period.start_time],
-#         #      [period.end_time + max_interval, period.end_time]]
-#         #     for i, period in enumerate(periods)
-#         #     if i > 0
-#         # ]
-#
-#         overlapping_pairs = \
-#             pool.map(_collocate_thread_period, periods)
-#
-#         # The search periods had overlaps. Hence the collocations contain
-#         # duplicates.
-#         pairs = np.hstack([
-#             pairs_of_thread[0]
-#             for i, pairs_of_thread in enumerate(overlapping_pairs)
-#             if pairs_of_thread is not None
-#         ])
+
+def _collocate_bin(
+        data, algorithm, max_interval, max_distance, bounds, k=None):
+    """Search for collocations in one bin (also used by worker processes)
+
+    Args:
+        data: A list of two dictionaries with sorted time, lat and lon
+            arrays.
+        algorithm: A Finder object.
+        max_interval: A timedelta object or None.
+        max_distance: The maximum distance in kilometers or None.
+        bounds: The index ranges from :func:`_get_bins`.
+        k: Number of nearest neighbours to find (or None for all).
+
+    Returns:
+        A 2xN numpy array with the indices of the collocations.
+    """
+    primary_start, primary_end, secondary_start, secondary_end = bounds
+
+    pairs = np.asarray(algorithm.find_collocations(
+        {field: values[primary_start:primary_end]
+         for field, values in data[0].items()},
+        {field: values[secondary_start:secondary_end]
+         for field, values in data[1].items()},
+        max_interval=max_interval, max_distance=max_distance,
+        **({} if k is None else {"k": k})
+    ))
+
+    if not pairs.size:
+        return np.empty((2, 0), dtype=int)
+
+    # The indices should point to the whole data again:
+    return np.array([pairs[0] + primary_start, pairs[1] + secondary_start])
 
 
 def collocate_datasets(
         datasets, start=None, end=None, output=None, verbose=True,
-        **collocate_args,):
+        read_cache=None, chunk=None, max_workers=None, manifest=None,
+        index_only=False, index_cache=None, **collocate_args,):
     """Finds all collocations between two datasets and store them in files.
 
     Collocations are two or more data points that are located close to each
@@ -643,6 +784,13 @@ def collocate_datasets(
     *dataset_name/__collocations* - Tells you which data points collocate
         with each other by giving their indices.
 
+    The primary files are processed in independent chunks (optionally in
+    parallel processes). If a *manifest* file is given, each completed chunk
+    is recorded in it. If the collocating is interrupted (e.g. by a crash),
+    calling this function again with the same arguments skips the completed
+    chunks whose input files have not changed and whose output files still
+    exist.
+
     TODO: Revise and extend documentation.
 
     Args:
@@ -652,6 +800,38 @@ def collocate_datasets(
         output: Either a path as string containing placeholders or a
             Dataset-like object.
         verbose: If true, it prints logging messages.
+        read_cache: Secondary files that overlap with several primary files
+            are read only once. This can be a
+            :class:`~typhon.spareice.cache.ReadCache` object (e.g. to share
+            it between several calls), its maximal number of bytes or False
+            to disable the caching. Default is a ReadCache that holds up to
+            1 GB. All chunks share this cache, with *max_workers* each
+            worker process has its own copy. See :class:`DataSlider` for
+            details.
+        chunk: All primary files that start within the same period of this
+            length (a timedelta object or a string such as "1 day") build
+            one chunk. Default is one chunk for each primary file.
+        max_workers: Number of processes that collocate the chunks in
+            parallel. Note that you cannot use the *processes* option of
+            :func:`collocate` then. Default is 1.
+        manifest: Path of the JSON file that records the completed chunks,
+            e.g. *collocations_manifest.json* in the base directory of
+            *output*. Default is None, i.e. all chunks are processed and
+            nothing is recorded.
+        index_only: If true, only the times, positions and indices of the
+            collocated points and the paths of their original files are
+            stored. Other fields can be added from the original files on
+            demand with :meth:`CollocatedDataset.hydrate`. Default is false.
+        index_cache: The finder algorithm can keep its index of the
+            secondary data (e.g. the Ball tree of *BallTree*) and reuse it
+            for the next primary files that overlap with the same secondary
+            files. This can be a :class:`~typhon.spareice.cache.ReadCache`
+            object, its maximal number of bytes or True (a ReadCache with
+            512 MB). The indices are identified by the secondary files
+            (their paths and modification times) and the slice of their
+            data. This works only with finders that support it (e.g.
+            *BallTree*) and if :func:`collocate` does not split the data
+            into bins (see its *threads* parameter). Default is no caching.
         **collocate_args: Additional keyword arguments that are allowed for
             :func:`collocate` except *arrays*.
 
@@ -694,30 +874,251 @@ def collocate_datasets(
             f"Find collocations between {primary.name} and {secondary.name} "
             f"from {start} to {end}"
         )
+        print("Retrieve time coverages from files...")
+
+    chunks = _get_chunks(
+        primary.find(start, end, no_files_error=False), start, chunk)
+
+    if manifest:
+        keys = [
+            _get_chunk_key(files, datasets, index_only, collocate_args)
+            for files in chunks
+        ]
+        completed = {
+            key: record
+            for key, record in _load_manifest(manifest).items()
+            if all(os.path.exists(file) for file in record["outputs"])
+        }
+    else:
+        keys = list(range(len(chunks)))
+        completed = {}
+
+    chunk_files = dict(zip(keys, chunks))
+
+    # The same secondary data are often collocated with several primary
+    # files (e.g. one long secondary file and many short primary files).
+    # Hence, we can keep the indices of the finder (e.g. the Ball tree):
+    if index_cache is not None and index_cache is not False:
+        algorithm = _get_algorithm(collocate_args.get("algorithm"))
+        if algorithm.reusable_index:
+            algorithm = copy.copy(algorithm)
+            algorithm.index_cache = _get_read_cache(
+                512 * 1024**2 if index_cache is True else index_cache)
+            collocate_args = {**collocate_args, "algorithm": algorithm}
+
+    chunk_keys = [key for key in keys if key not in completed]
+
+    if verbose and len(chunk_keys) < len(chunks):
+        print(f"Skip {len(chunks) - len(chunk_keys)} of {len(chunks)} chunks "
+              f"that have been completed already.")
 
     total_collocations = [0, 0]
 
+    # Secondary files that overlap with several chunks are read only once.
+    # Hence, all chunks share one read cache (or one per worker process):
+    parallel = max_workers is not None and max_workers > 1 \
+        and len(chunk_keys) > 1
+    if parallel:
+        pool = ProcessPool(
+            min(max_workers, len(chunk_keys)),
+            initializer=_init_chunk_worker, initargs=(read_cache,),
+        )
+        read_cache = None
+    else:
+        pool = None
+        read_cache = _get_read_cache(read_cache)
+
+    tasks = [
+        (key, datasets, chunk_files[key], output, verbose, read_cache,
+         index_only, collocate_args)
+        for key in chunk_keys
+    ]
+
+    if parallel:
+        results = pool.imap_unordered(_collocate_chunk, tasks)
+    else:
+        results = map(_collocate_chunk, tasks)
+
+    try:
+        for done, (key, outputs, n_collocations) in enumerate(results, 1):
+            total_collocations[0] += n_collocations[0]
+            total_collocations[1] += n_collocations[1]
+
+            if manifest:
+                completed[key] = {
+                    "files": [file.path for file in chunk_files[key]],
+                    "outputs": outputs,
+                    "collocations": n_collocations,
+                }
+                _save_manifest(manifest, completed)
+
+            if verbose:
+                _collocating_status(
+                    primary, secondary, timer, done, len(tasks))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
     if verbose:
-        print("Retrieve time coverages from files...")
+        print("-" * 79)
+        print(
+            f"Took {time.time()-timer:.2f} s to find {total_collocations[0]}"
+            f" ({primary.name}) and {total_collocations[1]} ({secondary.name})"
+            f" collocations.\nProcessed {len(tasks)} chunks of data."
+        )
 
-    for files, data in DataSlider(start, end, *datasets):
+    return output
 
-        primary_start, primary_end = data[primary.name].get_range("time")
 
-        if verbose:
-            _collocating_status(
-                primary, secondary, timer, start, end,
-                np.min([primary_end,
-                        data[secondary.name]["time"].max()]).astype("O"),
-            )
+def _get_chunks(files, start, chunk):
+    """Group the primary files to chunks
+
+    Args:
+        files: An iterable of FileInfo objects sorted by their starting time.
+        start: The starting time of the first chunk.
+        chunk: The length of the chunks as timedelta-like object. If this is
+            None, each file is one chunk.
+
+    Returns:
+        A list of lists of FileInfo objects.
+    """
+    if chunk is None:
+        return [[file] for file in files]
+
+    chunk = to_timedelta(chunk)
+    chunks = {}
+    for file in files:
+        number = max(0, (file.times[0] - start) // chunk)
+        chunks.setdefault(number, []).append(file)
+    return list(chunks.values())
+
+
+def _get_chunk_key(files, datasets, index_only, collocate_args):
+    """Get the key of a chunk for the manifest
+
+    The chunks are identified by their primary and secondary files (their
+    paths and modification times) and the collocation criteria. The finder
+    algorithm does not matter since all of them find the same collocations.
+
+    Args:
+        files: A list of FileInfo objects of the primary dataset.
+        datasets: The primary and the secondary dataset.
+        index_only: The index-only flag.
+        collocate_args: The keyword arguments for :func:`collocate`.
+
+    Returns:
+        A hexadecimal string.
+    """
+    primary, secondary = datasets
+    start = min(file.times[0] for file in files)
+    end = max(file.times[1] for file in files)
+    secondary_files = secondary.find(start, end, no_files_error=False)
+
+    max_interval = collocate_args.get("max_interval")
+    if max_interval is not None:
+        max_interval = str(to_timedelta(max_interval, numbers_as="seconds"))
+
+    content = [
+        primary.name, secondary.name, max_interval,
+        collocate_args.get("max_distance"), collocate_args.get("k"),
+        index_only,
+        [_get_file_stamp(file.path) for file in files],
+        [_get_file_stamp(file.path) for file in secondary_files],
+    ]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+
+def _get_file_stamp(path):
+    """Get the path and the modification time of a file"""
+    try:
+        return [path, os.stat(path).st_mtime_ns]
+    except OSError:
+        return [path, None]
+
+
+def _get_index_key(files, data):
+    """Get the key of the secondary data for the index cache of the finder
+
+    Args:
+        files: A list of FileInfo objects of the secondary data.
+        data: The secondary data (read from the whole files).
+
+    Returns:
+        A tuple with the paths and modification times of the files and the
+        slice of the data.
+    """
+    return (
+        tuple(tuple(_get_file_stamp(file.path)) for file in files),
+        (0, len(data["time"])),
+    )
+
+
+# The read cache of a worker process of collocate_datasets (shared by all
+# chunks that the worker collocates):
+_worker_read_cache = None
+
+
+def _get_read_cache(read_cache):
+    """Get the ReadCache object for the *read_cache* argument
+
+    Args:
+        read_cache: A ReadCache object, its maximal number of bytes, None
+            (a new ReadCache with the default budget) or False.
+
+    Returns:
+        A ReadCache object or False.
+    """
+    if read_cache is None or read_cache is True:
+        return ReadCache()
+    elif read_cache is False or isinstance(read_cache, ReadCache):
+        return read_cache
+    return ReadCache(read_cache)
+
+
+def _init_chunk_worker(read_cache):
+    """Create the read cache of a worker process of collocate_datasets"""
+    global _worker_read_cache
+    _worker_read_cache = _get_read_cache(read_cache)
+
+
+def _collocate_chunk(task):
+    """Collocate the primary files of one chunk and store the collocations
+
+    Args:
+        task: A tuple of the chunk key, the datasets, the primary files, the
+            output dataset, the verbose flag, the read cache, the index-only
+            flag and the keyword arguments for :func:`collocate`.
+
+    Returns:
+        The chunk key, a list of the created files and the number of the
+        primary and secondary collocations.
+    """
+    key, datasets, files, output, verbose, read_cache, index_only, \
+        collocate_args = task
+    primary, secondary = datasets
+
+    if read_cache is None:
+        read_cache = _worker_read_cache
+
+    outputs = []
+    total_collocations = [0, 0]
+
+    for raw_files, data in DataSlider(
+            None, None, *datasets, read_cache=read_cache, files=files):
 
         # Find the collocations in those data arrays:
+        if getattr(collocate_args.get("algorithm"), "index_cache", None) \
+                is not None:
+            index_key = _get_index_key(
+                raw_files[secondary.name], data[secondary.name])
+        else:
+            index_key = None
         collocations = collocate(
             [data[primary.name], data[secondary.name]],
-            **collocate_args,
+            index_key=index_key, **collocate_args,
         )
 
-        if not collocations.any():
+        if not collocations.size:
             if verbose:
                 print("Found no collocations!")
             continue
@@ -725,31 +1126,46 @@ def collocate_datasets(
         # Store the collocated data to the output dataset:
         filename, n_collocations = _store_collocations(
             output, datasets=[primary, secondary], raw_data=data,
-            collocations=collocations, files=files, **collocate_args
+            collocations=collocations, files=raw_files,
+            index_only=index_only, **collocate_args
         )
 
         if verbose:
             print(
-                f"Store {n_collocations[0]} ({datasets[0].name}) and "
-                f"{n_collocations[1]} ({datasets[1].name}) collocations in"
+                f"Store {n_collocations[0]} ({primary.name}) and "
+                f"{n_collocations[1]} ({secondary.name}) collocations in "
                 f"{filename}"
             )
 
-        total_collocations[0] += n_collocations[0]
-        total_collocations[1] += n_collocations[1]
+        outputs.append(str(filename))
+        total_collocations[0] += int(n_collocations[0])
+        total_collocations[1] += int(n_collocations[1])
 
-    if verbose:
-        print("-" * 79)
-        print(
-            f"Took {time.time()-timer:.2f} s to find {total_collocations[0]}"
-            f" ({primary.name}) and {total_collocations[1]} ({secondary.name})"
-            f" collocations.\nProcessed {end-start} hours of data."
-        )
+    return key, outputs, total_collocations
+
+
+def _load_manifest(filename):
+    """Load the completed chunks from a manifest file"""
+    try:
+        with open(filename) as file:
+            return json.load(file)["chunks"]
+    except FileNotFoundError:
+        return {}
 
 
-def _collocating_status(primary, secondary, timer, start, end, current_end):
-    current = (current_end - start).total_seconds()
-    progress = current / (end - start).total_seconds()
+def _save_manifest(filename, chunks):
+    """Save the completed chunks to a manifest file"""
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+    # First write all to a backup file. If something happens, only the
+    # backup file will be corrupted.
+    with open(filename + ".backup", "w") as file:
+        json.dump({"chunks": chunks}, file, indent=1)
+    shutil.move(filename + ".backup", filename)
+
+
+def _collocating_status(primary, secondary, timer, done, total):
+    progress = done / total
 
     elapsed_time = time.time()-timer
     expected_time = timedelta(
@@ -758,14 +1174,14 @@ def _collocating_status(primary, secondary, timer, start, end, current_end):
 
     print("-" * 79)
     print(
-        f"Collocating {primary.name} to {secondary.name}: {100*progress:d}% "
-        f"done ({expected_time} hours remaining)"
+        f"Collocating {primary.name} to {secondary.name}: "
+        f"{100*progress:.0f}% done ({expected_time} hours remaining)"
     )
 
 
 def _store_collocations(
         output, datasets, raw_data, collocations,
-        files, **collocate_args):
+        files, index_only=False, **collocate_args):
     """Merge the data, original indices, collocation indices and
     additional information of the datasets to one GroupedArrays object.
 
@@ -775,6 +1191,8 @@ def _store_collocations(
         raw_data:
         collocations:
         files:
+        index_only: If true, only the time, latitude and longitude fields of
+            the data are stored.
 
     Returns:
         List with number of collocations
@@ -842,7 +1260,11 @@ def _store_collocations(
         # Save the collocation indices in the metadata group:
         pairs.append(collocation_indices)
 
-        data = dataset_data[original_indices]
+        if index_only:
+            data = dataset_data.select(
+                fields=["time", "lat", "lon"])[original_indices]
+        else:
+            data = dataset_data[original_indices]
         data["__original_indices"] = Array(
             original_indices, dims=["time_id", ],
             attrs={
@@ -854,15 +1276,19 @@ def _store_collocations(
             # Set where the data came from:
             data.attrs["__original_files"] = \
                 ";".join(file.path for file in files[datasets[i].name])
+        if "__original_file_sizes" not in data.attrs:
+            # The original indices refer to the data of this one file:
+            data.attrs["__original_file_sizes"] = [len(dataset_data["time"])]
         output_data[datasets[i].name] = data
 
     metadata["pairs"] = pairs
 
     # Use only the times of the primary dataset as start and end time (makes it
     # easier to find corresponding files later):
-    time_coverage = output_data[datasets[0].name].get_range(
-        "time",
-    )
+    time_coverage = [
+        pd.Timestamp(timestamp).to_pydatetime(warn=False)
+        for timestamp in output_data[datasets[0].name].get_range("time")
+    ]
     output_data.attrs["start_time"] = \
         time_coverage[0].strftime("%Y-%m-%dT%H:%M:%S.%f")
     output_data.attrs["end_time"] = \
@@ -327,6 +327,10 @@ class Retriever:
 
                 output.write(retrieved_data, times=times, in_background=True)
 
+        if output is not None:
+            # Wait until all files are written:
+            output.flush()
+
         if output is None:
             if results:
                 return GroupedArrays.concat(results)
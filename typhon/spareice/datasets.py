@@ -5,12 +5,12 @@ Created by John Mrziglod, June 2017
 """
 
 import atexit
-from collections import defaultdict, Iterable, OrderedDict
+from collections import defaultdict, deque, Iterable, OrderedDict
 import copy
 from datetime import datetime, timedelta
 import gc
-import glob
-from itertools import tee
+import heapq
+from itertools import count, islice, tee
 import json
 import logging
 from multiprocessing import Pool as ProcessPool
@@ -28,8 +28,11 @@ import numpy as np
 import pandas as pd
 import typhon.files
 import typhon.plots
-from typhon.spareice.array import GroupedArrays
+from typhon.spareice.array import Array, GroupedArrays
+from typhon.spareice.cache import ReadCache, ShadowCache
 from typhon.spareice.handlers import CSV, expects_file_info, FileInfo, NetCDF4
+from typhon.spareice.index import FileIndex, InfoCache
+from typhon.spareice.shared import SharedObject
 from typhon.trees import IntervalTree
 from typhon.utils.time import set_time_resolution, to_datetime, to_timedelta
 import xarray as xr
@@ -45,6 +48,31 @@ __all__ = [
     "PlaceholderRegexError",
 ]
 
+# File extensions of the binary information cache (see the *info_cache*
+# parameter of Dataset). Other files are JSON caches unless they are binary
+# caches already:
+_binary_info_cache_extensions = (".sqlite", ".sqlite3", ".db")
+
+
+def _is_binary_info_cache(filename):
+    """Check whether an information cache file uses the binary format
+
+    Args:
+        filename: Path of the cache file (need not exist).
+
+    Returns:
+        True or False.
+    """
+    try:
+        with open(filename, "rb") as file:
+            header = file.read(16)
+    except OSError:
+        header = b""
+
+    if header:
+        return header == b"SQLite format 3\x00"
+    return filename.lower().endswith(_binary_info_cache_extensions)
+
 
 class InhomogeneousFilesError(Exception):
     """Should be raised if the files of a dataset do not have the same internal
@@ -234,6 +262,9 @@ class Dataset:
             placeholder=None, max_threads=None, max_processes=None,
             worker_type=None, read_args=None, write_args=None,
             concat_args=None, merge_args=None, compress=True, decompress=True,
+            index=None, scan_workers=None, synthesize_dirs=False,
+            write_workers=None, write_queue_size=None, read_cache=None,
+            shadow_cache=None, index_max_age=None,
     ):
         """Initializes a dataset object.
 
@@ -274,7 +305,40 @@ class Dataset:
                 are close) are significantly faster. Specify a name to a file
                 here (which need not exist) if you wish to save the information
                 data to a file. When restarting your script, this cache is
-                used.
+                used. Per default, the cache is stored as JSON file. If the
+                filename ends with *.sqlite* or *.db* (or the file is such a
+                binary cache already), it is stored in a binary table that is
+                loaded lazily and extended by new entries only. This is much
+                faster for large datasets and can be shared by several
+                processes.
+            index: Searching for files on large archives (e.g. on network
+                storage) may take minutes since the whole directory tree has
+                to be walked. Specify a name to a file here (which need not
+                exist, e.g. next to the dataset's files) to store a persistent
+                index of all files with their time coverages and placeholders.
+                Searches are answered from the index. Only directories that
+                have not been indexed yet (or not been checked for longer
+                than *index_max_age*) are scanned. Call :meth:`refresh_index`
+                to update the index incrementally: only the directories whose
+                modification time has changed are rescanned. Set
+                *Dataset.index_refresh* to true if you want to do this before
+                each search.
+            index_max_age: A timedelta object or string (e.g. "1 hour"). If
+                given, searches check the directories of the index again
+                whose last check is older than this. Default is to check them
+                only via :meth:`refresh_index`.
+            scan_workers: Number of threads that list directories
+                concurrently when searching for files. Listing a directory on
+                network file systems (e.g. Lustre or NFS) is a high-latency
+                round trip, hence this can speed up :meth:`find`
+                significantly. Default is *max_threads*. Set this to 1 to list
+                the directories one after another.
+            synthesize_dirs: If true, sub directories that contain only
+                temporal placeholders (e.g. *{year}/{doy}*) are not listed
+                when searching for files in a bounded time period. Instead,
+                their paths are generated directly from the period and it is
+                only checked whether they exist. This makes searches for short
+                periods in large archives much faster. Default is false.
             time_coverage: If this dataset consists of multiple files, this
                 parameter is the relative time coverage (i.e. a timedelta, e.g.
                 "1 hour") of each file. If the ending time of a file cannot be
@@ -316,6 +380,26 @@ class Dataset:
                 be passed to :meth:`read`.
             write_args: Additional keyword arguments in a dictionary that
                 should be passed to :meth:`write`.
+            write_workers: Number of threads that write the files passed to
+                :meth:`write` with *in_background=True*. Default is 1 since
+                not all file handlers can write in parallel threads (e.g.
+                HDF5 libraries that were not built thread-safe).
+            write_queue_size: Maximal number of files that wait for being
+                written in background. If the queue is full, :meth:`write`
+                blocks until a writer is free again. Default is twice
+                *write_workers*.
+            read_cache: Keep the content of read files in memory to avoid
+                reading them again. Either a
+                :class:`~typhon.spareice.cache.ReadCache` object (can be
+                shared between several datasets) or the maximal number of
+                bytes of a new cache. Default is no caching.
+            shadow_cache: Store the content of read files additionally in a
+                fast, memory-mappable format on disk and load it from there
+                when reading the files again. Useful for file formats that
+                are slow to decode (e.g. HDF4). Works only with handlers that
+                return GroupedArrays objects. Either a
+                :class:`~typhon.spareice.cache.ShadowCache` object or the
+                path of its directory. Default is no shadow cache.
             merge_args:
             concat_args:
 
@@ -410,6 +494,9 @@ class Dataset:
 
         # The default worker settings for map-like functions
         self.max_threads = 4 if max_threads is None else max_threads
+        self.scan_workers = \
+            self.max_threads if scan_workers is None else scan_workers
+        self.synthesize_dirs = synthesize_dirs
         self.max_processes = 4 if max_processes is None else max_processes
         self.worker_type = "process" if worker_type is None else worker_type
 
@@ -430,9 +517,17 @@ class Dataset:
         # Multiple calls of .find() can be very slow when using the handler as
         # as information retrieving method. Hence, we use a cache to store the
         # names and time coverages of already touched files in this dictionary.
+        # The threads of find() write into it, hence all writes are locked:
         self.info_cache_filename = info_cache
         self.info_cache = {}
-        if self.info_cache_filename is not None:
+        self._info_cache_lock = threading.RLock()
+        if self.info_cache_filename is not None \
+                and _is_binary_info_cache(self.info_cache_filename):
+            # The binary cache is loaded on the first lookup:
+            self.info_cache = InfoCache(self.info_cache_filename)
+            atexit.register(Dataset.save_info_cache,
+                            self, self.info_cache_filename)
+        elif self.info_cache_filename is not None:
             try:
                 # Load the time coverages from a file:
                 self.load_info_cache(self.info_cache_filename)
@@ -448,18 +543,62 @@ class Dataset:
                 atexit.register(Dataset.save_info_cache,
                                 self, self.info_cache_filename)
 
-        # Writing processes can be moved to background threads. But we do want
-        # to have too many backgrounds threads running at the same time, so we
-        # create FIFO queue. The queue limits the number of parallel threads
-        # to a maximum. The users can also make sure that all writing threads
-        # are finished before they move on in the code.
-        # TODO: We cannot use queues as attributes for Dataset because they
-        # TODO: cannot be pickled.
-        # self._write_queue = Queue(max_threads)
+        # Writing processes can be moved to background threads. But we do not
+        # want to have too many backgrounds threads running at the same time,
+        # so we use a fixed number of writers that get their jobs from a
+        # bounded FIFO queue. The queue and the writers are created with the
+        # first background job (see _start_writers). The users can also make
+        # sure that all files are written before they move on in the code
+        # (see flush).
+        self.write_workers = 1 if write_workers is None else write_workers
+        self.write_queue_size = 2 * self.write_workers \
+            if write_queue_size is None else write_queue_size
+        self._write_queue = None
+        self._write_errors = []
+        self._write_lock = threading.Lock()
+
+        # The in-memory cache for read files (see the *read_cache*
+        # parameter):
+        if read_cache is None or isinstance(read_cache, ReadCache):
+            self.read_cache = read_cache
+        else:
+            self.read_cache = ReadCache(read_cache)
+
+        # The persistent cache for read files (see the *shadow_cache*
+        # parameter):
+        if shadow_cache is None or isinstance(shadow_cache, ShadowCache):
+            self.shadow_cache = shadow_cache
+        else:
+            self.shadow_cache = ShadowCache(shadow_cache)
 
         # Dictionary for holding links to other datasets:
         self._link = {}
 
+        # Statistics about the last prefetching of imap / icollect (queue
+        # occupancy and waiting times):
+        self.prefetch_stats = {}
+
+        # The persistent file index (see the *index* parameter):
+        self.index = None if index is None else FileIndex(index)
+        self.index_refresh = False
+        self.index_max_age = None if index_max_age is None \
+            else to_timedelta(index_max_age)
+
+    def __getstate__(self):
+        # Queues, threads and locks cannot be pickled (needed when using
+        # Dataset.map with processes). The copies start their own writers:
+        state = self.__dict__.copy()
+        state["_write_queue"] = None
+        state["_write_errors"] = []
+        del state["_write_lock"]
+        del state["_info_cache_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._write_lock = threading.Lock()
+        self._info_cache_lock = threading.RLock()
+
     def __iter__(self):
         return iter(self.find())
 
@@ -543,13 +682,16 @@ class Dataset:
         return info
 
     def collect(self, start=None, end=None, files=None, read_args=None,
-                return_info=False, concat=True, concat_args=None, **find_args):
+                return_info=False, concat=True, concat_args=None,
+                preallocate=False, worker_type=None, trim=False,
+                **find_args):
         """Load all files between two dates sorted by their starting time
 
         This parallelizes the reading of the files by using threads. This
         should give a speed up if the file handler's read function internally
-        uses CPython code that releases the GIL. Note that this method is
-        faster than :meth:`icollect` but also more memory consuming.
+        uses CPython code that releases the GIL. Otherwise, you can use
+        processes (see *worker_type*). Note that this method is faster than
+        :meth:`icollect` but also more memory consuming.
 
         Use this if you need all files at once but if want to use a for-loop
         consider using :meth:`icollect` instead.
@@ -569,6 +711,27 @@ class Dataset:
                 value indicating to which file the function was applied.
             concat: If true (default), return the data concatenated by using
                 standard concatenate functions.
+            preallocate: If true and *concat* is true, the sizes of the
+                dimensions of all files are retrieved first (via the file
+                handler's *get_dimensions* method). Then the concatenated
+                arrays are allocated once and each file is copied to its
+                slice directly after reading. This needs only half of the
+                memory but works only with GroupedArrays objects. Variables
+                whose first dimension is the one of a *time* variable are
+                preallocated and get the common type of all files (see
+                numpy.result_type). Other variables are concatenated
+                afterwards, scalar variables get the value of the first
+                file. Falls back to the standard concatenation if the file
+                handler does not support it.
+            worker_type: Either *thread* (default) or *process*. Processes
+                pass the read arrays via shared memory to this process (see
+                the parameter *shared_memory* of :meth:`map`).
+            trim: If true and the file handler supports it (e.g.
+                :class:`~typhon.spareice.handlers.common.NetCDF4`), only the
+                data between *start* and *end* is read from the files instead
+                of their whole content. The time period is passed as
+                *time_window* to the handler's read method. *preallocate* is
+                ignored then.
             **find_args: Additional keyword arguments that are allowed
                 for :meth:`find`.
 
@@ -602,16 +765,35 @@ class Dataset:
         if concat_args is None:
             concat_args = {}
 
-        # If we used map with processes, it would need to pickle the data
-        # coming from all workers. This would be very inefficient. Threads
-        # are better because sharing data does not cost much and a file
-        # reading function is typically io-bound. However, if the reading
-        # function consists mainly of pure python code that does not
-        # release the GIL, this will slow down the performance.
+        if trim:
+            read_args = self._add_time_window(start, end, read_args)
+
+        # The sizes of trimmed files are unknown before reading them:
+        if concat and preallocate and "time_window" not in read_args:
+            if files is None:
+                files = list(self.find(start, end, **find_args))
+            else:
+                files = list(files)
+            start = end = None
+            find_args = {}
+
+            results = self._collect_preallocated(files, read_args)
+            if results is not None:
+                if return_info:
+                    return results
+                return results[1]
+
+        # Threads are the default because sharing data does not cost much
+        # and a file reading function is typically io-bound. However, if the
+        # reading function consists mainly of pure python code that does not
+        # release the GIL, processes are faster. They pass the data via
+        # shared memory since pickling it would be very inefficient.
+        if worker_type is None:
+            worker_type = "thread"
         results = self.map(
             start, end, files, func=Dataset.read, args=(self,),
-            kwargs=read_args, worker_type="thread", return_info=True,
-            **find_args
+            kwargs=read_args, worker_type=worker_type, return_info=True,
+            shared_memory=worker_type == "process", **find_args
         )
 
         # Tell the python interpreter explicitly to free up memory to improve
@@ -633,8 +815,207 @@ class Dataset:
         else:
             return data
 
+    def _add_time_window(self, start, end, read_args):
+        """Pass the time period to the file handler if it supports it
+
+        Args:
+            start: Start date either as datetime object or as string.
+            end: End date. Same format as "start".
+            read_args: Key word arguments for the *read* method of the used
+                file handler class.
+
+        Returns:
+            A new dictionary with reading arguments.
+        """
+        if self.handler is None or not self.handler.time_window_support \
+                or (start is None and end is None):
+            return read_args
+
+        # Open bounds stay None (not all handlers can convert datetime.min
+        # and datetime.max, e.g. to pandas timestamps):
+        start = None if start is None else to_datetime(start)
+        end = None if end is None else to_datetime(end)
+        return {**read_args, "time_window": (start, end)}
+
+    def _collect_preallocated(self, files, read_args):
+        """Read files and concatenate them into preallocated arrays
+
+        See the parameter *preallocate* of :meth:`collect` for more details.
+
+        Args:
+            files: A list of FileInfo objects.
+            read_args: Additional key word arguments for the
+                *read* method of the used file handler class.
+
+        Returns:
+            A tuple of the FileInfo objects of all non-empty files and a
+            GroupedArrays object with their concatenated content. None if the
+            files cannot be read into preallocated arrays.
+        """
+        # Linked datasets or bundles of files contain dimensions that we do
+        # not know before reading them:
+        if self._link or not files \
+                or not all(isinstance(file, FileInfo) for file in files):
+            return None
+
+        pool = ThreadPool(min(self.max_threads, len(files)))
+        try:
+            # First pass: get the dimensions of all files
+            try:
+                dimensions = pool.map(self._get_dimensions, files)
+            except NotImplementedError:
+                return None
+
+            # Where does each file start in the concatenated arrays?
+            offsets = []
+            totals = defaultdict(int)
+            for file_dimensions in dimensions:
+                offsets.append({dim: totals[dim] for dim in file_dimensions})
+                for dim, size in file_dimensions.items():
+                    totals[dim] += size
+
+            output = GroupedArrays()
+            lock = threading.Lock()
+
+            # Variables that are not concatenated along the record dimension
+            # are concatenated afterwards:
+            leftovers = defaultdict(dict)
+
+            # How many elements have been copied to each variable?
+            filled = defaultdict(int)
+
+            # The types of the variables in all files and the pieces that
+            # cannot be cast safely to the preallocated arrays (they are
+            # copied after promoting the arrays):
+            dtypes = defaultdict(set)
+            promoted = defaultdict(dict)
+
+            def read_into(args):
+                i, file_info = args
+                data = self.read(file_info, **read_args)
+                if data is None or not isinstance(data, GroupedArrays):
+                    return data
+
+                # The files are concatenated along the dimensions of their
+                # time variables:
+                records = {
+                    array.dims[0]
+                    for var, array in data.items(deep=True)
+                    if var.split("/")[-1] == "time" and array.ndim
+                }
+
+                copies = []
+                with lock:
+                    if i == 0:
+                        output.attrs.update(data.attrs)
+
+                    for var, array in data.items(deep=True):
+                        dim = array.dims[0] if array.ndim else None
+                        if dim not in records or dim not in offsets[i] \
+                                or len(array) != dimensions[i][dim]:
+                            leftovers[var][i] = array
+                            continue
+
+                        if var not in output:
+                            output[var] = Array(
+                                np.empty(
+                                    (totals[dim], *array.shape[1:]),
+                                    dtype=array.dtype),
+                                attrs=array.attrs, dims=array.dims,
+                            )
+                        elif i == 0:
+                            # The meta data come from the first file:
+                            output[var].attrs = array.attrs
+                            output[var].dims = array.dims
+                        filled[var] += len(array)
+                        dtypes[var].add(array.dtype)
+
+                        offset = offsets[i][dim]
+                        if np.can_cast(array.dtype, output[var].dtype):
+                            copies.append((var, offset, array))
+                        else:
+                            promoted[var][offset] = array
+
+                    if i == 0:
+                        for group in data.groups(deep=True):
+                            output[group].attrs.update(data[group].attrs)
+
+                # Copy the data into the slices of the concatenated arrays
+                # (outside of the lock, so other threads can copy at the same
+                # time):
+                for var, offset, array in copies:
+                    output[var][offset:offset+len(array)] = array
+
+                return True
+
+            # Second pass: read the files into the concatenated arrays
+            results = pool.map(read_into, enumerate(files))
+        finally:
+            pool.terminate()
+
+        if all(result is None for result in results):
+            return None
+
+        files, results = zip(*[
+            [info, result]
+            for info, result in zip(files, results)
+            if result is not None
+        ])
+
+        # The file handler did not return GroupedArrays objects:
+        if any(result is not True for result in results):
+            return files, self._concat_data(results)
+
+        for var, size in filled.items():
+            if var in leftovers or size != len(output[var]):
+                raise ValueError(
+                    f"Cannot concatenate '{var}' in preallocated arrays since "
+                    f"it is missing in some files or its size differs from the "
+                    f"file dimensions!")
+
+        # The type of a variable must not depend on the order in which the
+        # files were read:
+        for var, var_dtypes in dtypes.items():
+            dtype = np.result_type(*var_dtypes)
+            if dtype != output[var].dtype:
+                output[var] = Array(
+                    output[var].astype(dtype), attrs=output[var].attrs,
+                    dims=output[var].dims,
+                )
+            for offset, array in promoted[var].items():
+                output[var][offset:offset+len(array)] = array
+
+        for var, pieces in leftovers.items():
+            first = pieces[min(pieces)]
+            if not first.ndim:
+                values = first
+            else:
+                values = np.concatenate([pieces[i] for i in sorted(pieces)])
+            output[var] = Array(values, attrs=first.attrs, dims=first.dims)
+
+        return files, output
+
+    def _get_dimensions(self, file_info):
+        """Get the dimension sizes of a file via the file handler
+
+        Args:
+            file_info: A FileInfo object.
+
+        Returns:
+            A dictionary with the dimension names and their sizes.
+        """
+        if self._path_extension not in self.handler.handle_compression_formats\
+                and self.decompress:
+            with typhon.files.decompress(file_info.path) as decompressed_path:
+                decompressed_file = file_info.copy()
+                decompressed_file.path = decompressed_path
+                return self.handler.get_dimensions(decompressed_file)
+
+        return self.handler.get_dimensions(file_info)
+
     def icollect(self, start=None, end=None, files=None, read_args=None,
-                 preload=True, return_info=False, **find_args):
+                 preload=True, return_info=False, prefetch=None,
+                 prefetch_bytes=None, trim=False, **find_args):
         """Load all files between two dates sorted by their starting time
 
         Use this in for-loops but if you need all files at once, use
@@ -658,6 +1039,13 @@ class Dataset:
                 background thread. Set this to False, if you do not want this.
             return_info: If true, return a FileInfo object with each return
                 value indicating to which file the function was applied.
+            prefetch: Maximal number of files that are loaded in advance
+                (see :meth:`imap`). Default is 2.
+            prefetch_bytes: Maximal number of bytes of the data that are
+                loaded in advance (see :meth:`imap`). Default is no limit.
+            trim: If true and the file handler supports it, only the data
+                between *start* and *end* is read from the files (see
+                :meth:`collect`).
             **find_args: Additional keyword arguments that are allowed
                 for :meth:`find`.
 
@@ -683,11 +1071,14 @@ class Dataset:
         if read_args is None:
             read_args = {}
 
+        if trim:
+            read_args = self._add_time_window(start, end, read_args)
+
         if preload:
             results = self.imap(
                 start, end, files, func=Dataset.read, args=(self,),
                 kwargs=read_args, worker_type="thread", return_info=True,
-                **find_args
+                prefetch=prefetch, prefetch_bytes=prefetch_bytes, **find_args
             )
 
             for info, data in results:
@@ -906,11 +1297,12 @@ class Dataset:
         timestamp = to_datetime(timestamp)
 
         # We might need some more fillings than given by the user therefore
-        # we need the error catching:
+        # we need the error catching. If we have an index, we do not want to
+        # touch the file system:
         try:
             # Maybe there is a file with exact this timestamp?
             path = self.generate_filename(timestamp,)
-            if os.path.isfile(path):
+            if self.index is None and os.path.isfile(path):
                 return self.get_info(path)
         except (UnknownPlaceholderError, UnfilledPlaceholderError):
             pass
@@ -962,7 +1354,15 @@ class Dataset:
             end: End date. Same format as "start". If not given, it is
                 datetime.max per default.
             sort: If true, all files will be yielded
-                sorted by their starting time. Default is true.
+                sorted by their starting time. Default is true. If this is
+                *stream* and the sub directories of this dataset contain
+                temporal placeholders, the files are only sorted within each
+                directory and the directories are merged lazily. Hence, the
+                first file is yielded directly after scanning the first
+                directory. This requires that no file starts before the time
+                of its directory (e.g. files that cross midnight and are
+                stored under their ending date). Otherwise, a ValueError is
+                raised when such a file is found.
             bundle: Instead of only yielding one file at a time, you can get a
                 bundle of files. There are two possibilities: by setting this
                 to an integer, you can define the size of the bundle directly
@@ -1081,37 +1481,102 @@ class Dataset:
             print(f"Loaded filters:\nWhitelist: {white_list}"
                   f"\nBlacklist: {black_list}")
 
-        # Find all files by iterating over all searching paths and check
-        # whether they match the path regex and the time period.
-        file_finder = (
-            file_info
-            for path, _ in self._get_search_dirs(dir_start, end, white_list)
-            for file_info in self._get_matching_files(path, regex, start, end,)
-            if not black_list or self._check_file(black_list, file_info.attr)
-        )
-
-        # Even if no files were found, the user does not want to know.
-        if not no_files_error:
-            yield from self._prepare_find_files_return(
-                file_finder, sort, bundle)
-            return
-
-        # The users wants an error to be raised if no files were found. Since
-        # the file_finder is an iterator, we have to check whether it is empty.
-        # I do not know whether there is a more pythonic way but Matthew
-        # Flaschen shows how to do it with itertools.tee:
-        # https://stackoverflow.com/a/3114423
-        return_files, check_files = tee(file_finder)
+        # The directories and files are listed concurrently by the same
+        # threads for the whole search (see _scan):
+        pool = None
         try:
-            next(check_files)
+            if self.index is not None:
+                # We answer the search from the index but add the directories
+                # first that have not been indexed (or checked for too long):
+                if self.index_refresh:
+                    max_age = None
+                elif self.index_max_age is None:
+                    max_age = timedelta.max
+                else:
+                    max_age = self.index_max_age
+                self.refresh_index(dir_start, end, max_age=max_age)
+
+                # The index sorts the files by itself:
+                presorted = sort or isinstance(bundle, int)
+                file_finder = (
+                    file_info
+                    for file_info in self.index.query(start, end, presorted)
+                    if regex.match(file_info.path)
+                    and not self.is_excluded(file_info.times)
+                    and (not black_list
+                         or self._check_file(black_list, file_info.attr))
+                )
+            else:
+                if self.scan_workers is not None and self.scan_workers > 1:
+                    pool = ThreadPool(self.scan_workers)
+
+                search_dirs = self._get_search_dirs(
+                    dir_start, end, white_list, pool)
+
+                def dir_finder(path):
+                    return [
+                        file_info
+                        for file_info in self._get_matching_files(
+                            path, regex, start, end,)
+                        if not black_list
+                        or self._check_file(black_list, file_info.attr)
+                    ]
+
+                # If the directories can be ordered by time, we do not have
+                # to scan all of them before yielding the first sorted file
+                # (only on request since files may start before their
+                # directories):
+                dir_starts = self._get_dir_starts(search_dirs) \
+                    if sort == "stream" else None
+                presorted = dir_starts is not None
+
+                if presorted:
+                    dirs = sorted(
+                        zip(dir_starts, (path for path, _ in search_dirs)),
+                        key=lambda x: x[0]
+                    )
+                    file_finder = self._merge_sorted_dirs(zip(
+                        (dir_start for dir_start, _ in dirs),
+                        self._scan(
+                            dir_finder, [path for _, path in dirs], pool)
+                    ))
+                else:
+                    # Find all files by iterating over all searching paths and
+                    # check whether they match the path regex and the time
+                    # period.
+                    file_finder = (
+                        file_info
+                        for files in self._scan(
+                            dir_finder, [path for path, _ in search_dirs],
+                            pool)
+                        for file_info in files
+                    )
 
-            # We have found some files and can return them
-            yield from self._prepare_find_files_return(
-                return_files, sort, bundle)
-        except StopIteration as err:
-            raise NoFilesError(self, start, end)
+            # Even if no files were found, the user does not want to know.
+            if not no_files_error:
+                yield from self._prepare_find_files_return(
+                    file_finder, sort, bundle, presorted)
+                return
 
-    def _get_search_dirs(self, start, end, white_list):
+            # The users wants an error to be raised if no files were found.
+            # Since the file_finder is an iterator, we have to check whether
+            # it is empty. I do not know whether there is a more pythonic way
+            # but Matthew Flaschen shows how to do it with itertools.tee:
+            # https://stackoverflow.com/a/3114423
+            return_files, check_files = tee(file_finder)
+            try:
+                next(check_files)
+
+                # We have found some files and can return them
+                yield from self._prepare_find_files_return(
+                    return_files, sort, bundle, presorted)
+            except StopIteration as err:
+                raise NoFilesError(self, start, end)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def _get_search_dirs(self, start, end, white_list, pool=None):
         """Yields all searching directories for a time period.
 
         Args:
@@ -1120,6 +1585,8 @@ class Dataset:
                 coverage of the files should overlap with this interval.
             white_list: A dictionary that limits placeholders to certain
                 values.
+            pool: A ThreadPool that lists the directories concurrently (see
+                :meth:`_scan`).
 
         Returns:
             A tuple of path as string and parsed placeholders as dictionary.
@@ -1137,7 +1604,34 @@ class Dataset:
         if not self._sub_dir:
             return search_dirs
 
-        for subdir_chunk in self._sub_dir_chunks:
+        # Generating the directory paths from the time period makes only
+        # sense if the period is bounded:
+        synthesize = self.synthesize_dirs and start > datetime.min \
+            and end < datetime.max
+
+        chunks = iter(enumerate(self._sub_dir_chunks))
+        for i, subdir_chunk in chunks:
+            # Maybe we can generate the paths of this and the following sub
+            # directories without listing them?
+            if synthesize \
+                    and self._is_temporal_chunk(subdir_chunk, white_list):
+                # Find all following chunks that can be generated as well:
+                last = i
+                for chunk in self._sub_dir_chunks[i+1:]:
+                    if not self._is_temporal_chunk(chunk, white_list) \
+                            and any(ch in self._special_chars for ch in chunk):
+                        break
+                    last += 1
+
+                template = os.path.join(*self._sub_dir_chunks[i:last+1])
+                search_dirs = self._synthesize_dirs(
+                    search_dirs, template, start, end, pool)
+
+                # Skip the chunks that we have already handled:
+                for _ in range(last - i):
+                    next(chunks)
+                continue
+
             # Sometimes there is a sub directory part that has no
             # regex/placeholders:
             if not any(True for ch in subdir_chunk
@@ -1163,27 +1657,276 @@ class Dataset:
             regex = self._fill_placeholders_with_regexes(
                 subdir_chunk, extra_placeholder=white_list,
             )
+            # List all sibling directories concurrently:
             search_dirs = [
                 (new_dir, attr)
-                for search_dir in search_dirs
-                for new_dir, attr in self._get_matching_dirs(search_dir, regex)
+                for matching_dirs in self._scan(
+                    lambda x: list(self._get_matching_dirs(x, regex)),
+                    search_dirs, pool
+                )
+                for new_dir, attr in matching_dirs
                 if self._check_placeholders(attr, start_check, end_check)
             ]
 
         return search_dirs
 
+    def _is_temporal_chunk(self, chunk, white_list=None):
+        """Check whether a sub directory consists only of time placeholders
+
+        Args:
+            chunk: One level of the sub directory, e.g. *{year}{month}*.
+            white_list: A dictionary that limits placeholders to certain
+                values. Placeholders in it are not treated as temporal.
+
+        Returns:
+            True if the directory contains only placeholders that can be
+            generated from a timestamp (and no other regex).
+        """
+        placeholders = re.findall("\{(\w+)\}", chunk)
+        rest = re.sub("\{\w+\}", "", chunk)
+        return bool(placeholders) and all(
+            p in self._time_placeholder and p not in self._user_placeholder
+            and p not in (white_list or {})
+            and not p.startswith("end_") and p != "millisecond"
+            for p in placeholders
+        ) and not any(ch in self._special_chars for ch in rest)
+
+    def _synthesize_dirs(self, search_dirs, template, start, end, pool=None):
+        """Generate the sub directories for a time period
+
+        Args:
+            search_dirs: A list of tuples of path and parsed placeholders of
+                the parent directories.
+            template: The relative path of the sub directories with temporal
+                placeholders only (e.g. *{year}/{doy}*).
+            start: Datetime that defines the start of a time interval.
+            end: Datetime that defines the end of a time interval.
+            pool: A ThreadPool that checks the directories concurrently (see
+                :meth:`_scan`).
+
+        Returns:
+            A list of tuples of path and parsed placeholders of all existing
+            sub directories.
+        """
+        resolution = self._get_time_resolution(template)[0]
+        regex = self._fill_placeholders_with_regexes(template)
+
+        # The same directory might be generated several times:
+        sub_dirs = OrderedDict()
+        for timestamp in self._time_steps(start, end, resolution):
+            sub_dir = self.generate_filename(timestamp, template)
+            if sub_dir not in sub_dirs:
+                sub_dirs[sub_dir] = self.parse_filename(sub_dir, regex)
+
+        # The base directory may end with the beginning of a directory name
+        # (see _get_matching_dirs), hence we simply concatenate the paths:
+        candidates = [
+            (os.path.join(
+                parent + sub_dir if parent == self._base_dir
+                else os.path.join(parent, sub_dir), ""),
+             {**attr, **sub_attr})
+            for parent, attr in search_dirs
+            for sub_dir, sub_attr in sub_dirs.items()
+        ]
+
+        # Check whether the generated directories exist:
+        return [
+            candidate
+            for candidate, exists in zip(
+                candidates,
+                self._scan(
+                    os.path.isdir, [path for path, _ in candidates], pool)
+            )
+            if exists
+        ]
+
+    @staticmethod
+    def _time_steps(start, end, resolution):
+        """Yield timestamps between two dates in a certain resolution
+
+        Args:
+            start: Datetime object.
+            end: Datetime object.
+            resolution: Name of a temporal placeholder, e.g. *day*.
+
+        Yields:
+            Datetime objects from *start* (truncated to *resolution*) until
+            *end*.
+        """
+        timestamp = set_time_resolution(start, resolution)
+        while timestamp <= end:
+            yield timestamp
+
+            if resolution == "year":
+                if timestamp.year == datetime.max.year:
+                    return
+                timestamp = timestamp.replace(year=timestamp.year + 1)
+            elif resolution == "month":
+                if timestamp.month == 12:
+                    if timestamp.year == datetime.max.year:
+                        return
+                    timestamp = timestamp.replace(
+                        year=timestamp.year + 1, month=1)
+                else:
+                    timestamp = timestamp.replace(month=timestamp.month + 1)
+            else:
+                try:
+                    timestamp += Dataset._temporal_resolution[resolution]
+                except OverflowError:
+                    return
+
+    def _scan(self, func, items, pool=None):
+        """Apply a function on items in parallel threads
+
+        This is used to list many directories concurrently. Only a limited
+        number of items is processed ahead of the consumer.
+
+        Args:
+            func: A reference to a function that accepts one item.
+            items: A list of items.
+            pool: A ThreadPool whose threads apply the function. :meth:`find`
+                creates one for all directory levels and the files of a
+                search. If this is None, the items are processed one after
+                another.
+
+        Yields:
+            The return values of *func* in the order of *items*.
+        """
+        if pool is None or len(items) <= 1:
+            yield from map(func, items)
+            return
+
+        pending = deque()
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= 2 * self.scan_workers:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    @staticmethod
+    def _list_dir(path, dirs_only=False):
+        """List the entries of a directory
+
+        This uses os.scandir which provides the type of each entry without
+        additional stat calls. Hidden entries (starting with a dot) are
+        ignored.
+
+        Args:
+            path: Path to the directory.
+            dirs_only: If true, only sub directories are listed.
+
+        Returns:
+            A list of the entries' names. If the directory does not exist, the
+            list is empty.
+        """
+        try:
+            with os.scandir(path) as entries:
+                return [
+                    entry.name for entry in entries
+                    if not entry.name.startswith(".")
+                    and (not dirs_only or entry.is_dir())
+                ]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+    def _get_dir_starts(self, search_dirs):
+        """Get the starting times of the search directories
+
+        Args:
+            search_dirs: A list of tuples of path and parsed placeholders as
+                returned by :meth:`_get_search_dirs`.
+
+        Returns:
+            A list of datetime objects or None if the directories cannot be
+            ordered by time (e.g. because they have no temporal placeholders).
+        """
+        if len(search_dirs) == 1:
+            return [datetime.min]
+
+        dir_starts = []
+        for _, attr in search_dirs:
+            start_args, _ = self._to_datetime_args(attr)
+            if "year" not in start_args:
+                return None
+
+            try:
+                dir_starts.append(
+                    datetime(**{"month": 1, "day": 1, **start_args}))
+            except (TypeError, ValueError):
+                return None
+
+        return dir_starts
+
+    @staticmethod
+    def _merge_sorted_dirs(dirs):
+        """Yield the files of all directories sorted by their starting times
+
+        Only the files within each directory are sorted. The directories are
+        merged lazily, i.e. the files of a directory are not requested before
+        all files that start before its starting time have been yielded.
+
+        Args:
+            dirs: An iterable of tuples of the starting time of a directory
+                and its files. Must be sorted by the starting times.
+
+        Yields:
+            A FileInfo object for each found file.
+
+        Raises:
+            ValueError: If a file starts before a file that has been yielded
+                already (i.e. before the time of its directory).
+        """
+        # The counter avoids comparing FileInfo objects on the heap if two
+        # files start at the same time and keeps the original order of them:
+        counter = count()
+        dirs = iter(dirs)
+        next_dir = next(dirs, None)
+        heap = []
+        last_start = None
+
+        while heap or next_dir is not None:
+            # Scan all directories that might contain files that start
+            # before the earliest file that we know so far:
+            while next_dir is not None \
+                    and (not heap or next_dir[0] <= heap[0][0]):
+                for file_info in sorted(
+                        next_dir[1], key=lambda x: x.times[0]):
+                    if last_start is not None \
+                            and file_info.times[0] < last_start:
+                        raise ValueError(
+                            f"Cannot stream the files sorted since "
+                            f"'{file_info.path}' starts before the time of its "
+                            f"directory! Use sort=True instead.")
+                    heapq.heappush(
+                        heap, (file_info.times[0], next(counter), file_info)
+                    )
+                next_dir = next(dirs, None)
+
+            # The remaining directories might have been empty:
+            if heap:
+                last_start, _, file_info = heapq.heappop(heap)
+                yield file_info
+
     def _get_matching_dirs(self, dir_with_attrs, regex):
         base_dir, dir_attr = dir_with_attrs
-        for new_dir in glob.iglob(os.path.join(base_dir + "*", "")):
-            # The glob function yields full paths, but we want only to check
-            # the new pattern that was added:
-            basename = new_dir[len(base_dir):].rstrip(os.sep)
+
+        # The base directory may end with the beginning of a directory name
+        # (e.g. "/path/t" if the sub directory is "t{year}"):
+        parent_dir, prefix = os.path.split(base_dir)
+        for name in self._list_dir(parent_dir, dirs_only=True):
+            if not name.startswith(prefix):
+                continue
+
+            # We want only to check the new pattern that was added:
+            basename = name[len(prefix):]
             try:
                 new_attr = {
                     **dir_attr,
                     **self.parse_filename(basename, regex)
                 }
-                yield new_dir, new_attr
+                yield os.path.join(parent_dir, name, ""), new_attr
             except ValueError:
                 pass
 
@@ -1215,7 +1958,18 @@ class Dataset:
             A FileInfo object with the file path and time coverage
         """
 
-        for filename in glob.iglob(os.path.join(path, "*")):
+        filenames = [
+            os.path.join(path, filename) for filename in self._list_dir(path)
+        ]
+
+        # If the time coverage comes from the filenames only, we can parse
+        # the whole directory at once:
+        if self.info_via == "filename" and regex.groups:
+            yield from self._get_matching_files_batch(
+                filenames, regex, start, end)
+            return
+
+        for filename in filenames:
             if regex.match(filename):
                 file_info = self.get_info(filename)
 
@@ -1226,6 +1980,67 @@ class Dataset:
                         and not self.is_excluded(file_info.times):
                     yield file_info
 
+    def _get_matching_files_batch(self, filenames, regex, start, end):
+        """Yield files that matches the search conditions (vectorized).
+
+        Works like :meth:`_get_matching_files` but parses all filenames at
+        once. FileInfo objects are only created for the files that overlap
+        with the time period.
+
+        Args:
+            filenames: A list of paths to files that should be checked.
+            regex: A regular expression that should match the filename.
+            start: Datetime that defines the start of a time interval.
+            end: Datetime that defines the end of a time interval. The time
+                coverage of the file should overlap with this interval.
+
+        Yields:
+            A FileInfo object with the file path and time coverage
+        """
+        filenames = pd.Series(filenames, dtype=object)
+        filenames = filenames[filenames.str.match(regex).astype(bool)]
+
+        # Files that are in the info cache already do not need to be parsed:
+        cached = np.array(
+            [filename in self.info_cache for filename in filenames.values],
+            dtype=bool
+        )
+        if cached.all():
+            uncached = None
+        else:
+            fields = filenames[~cached].str.extract(regex, expand=True)
+            starts, ends = self._retrieve_time_coverages(fields)
+            overlapping = \
+                (starts <= np.datetime64(end)) & (ends >= np.datetime64(start))
+            uncached = iter(zip(
+                fields.index.values, overlapping, starts, ends))
+
+        user_placeholder = [
+            p for p in regex.groupindex if p in self._user_placeholder
+        ]
+
+        for i, filename, is_cached in zip(
+                filenames.index.values, filenames.values, cached):
+            if is_cached:
+                file_info = self.info_cache[filename]
+                if not IntervalTree.interval_overlaps(
+                        file_info.times, (start, end)):
+                    continue
+            else:
+                _, overlaps, file_start, file_end = next(uncached)
+                if not overlaps:
+                    continue
+
+                file_info = FileInfo(
+                    filename, [file_start.item(), file_end.item()],
+                    {p: fields.at[i, p] for p in user_placeholder},
+                )
+                with self._info_cache_lock:
+                    self.info_cache[filename] = file_info
+
+            if not self.is_excluded(file_info.times):
+                yield file_info
+
     @staticmethod
     def _check_file(black_list, placeholders):
         """Check whether placeholders are filled with something forbidden
@@ -1250,7 +2065,8 @@ class Dataset:
         return True
 
     @staticmethod
-    def _prepare_find_files_return(file_iterator, sort, bundle_size):
+    def _prepare_find_files_return(
+            file_iterator, sort, bundle_size, presorted=False):
         """Prepares the return value of the find method.
 
         Args:
@@ -1259,13 +2075,15 @@ class Dataset:
                 starting times.
             bundle_size: See the documentation of the *bundle* argument in
                 :meth`find` method.
+            presorted: If true, *file_iterator* yields the files already
+                sorted by their starting times.
 
         Yields:
             Either one FileInfo object or - if bundle_size is set - a list of
             FileInfo objects.
         """
         # We want to have sorted files if we want to bundle them.
-        if sort or isinstance(bundle_size, int):
+        if not presorted and (sort or isinstance(bundle_size, int)):
             file_iterator = sorted(file_iterator, key=lambda x: x.times[0])
 
         if bundle_size is None:
@@ -1275,12 +2093,11 @@ class Dataset:
         # The argument bundle was defined. Either it sets the bundle size
         # directly via a number or indirectly by setting time periods.
         if isinstance(bundle_size, int):
-            files = list(file_iterator)
-
-            yield from (
-                files[i:i + bundle_size]
-                for i in range(0, len(files), bundle_size)
-            )
+            file_iterator = iter(file_iterator)
+            bundle = list(islice(file_iterator, bundle_size))
+            while bundle:
+                yield bundle
+                bundle = list(islice(file_iterator, bundle_size))
         elif isinstance(bundle_size, str):
             files = list(file_iterator)
 
@@ -1476,7 +2293,8 @@ class Dataset:
             else:
                 info.times[1] = info.times[0]
 
-        self.info_cache[info.path] = info
+        with self._info_cache_lock:
+            self.info_cache[info.path] = info
         return info
 
     def _concat_data(self, objects, **kwargs):
@@ -1579,10 +2397,18 @@ class Dataset:
     def load_info_cache(self, filename):
         """ Loads the information cache from a file.
 
+        Args:
+            filename: Path to a JSON file or a binary cache file (see the
+                parameter *info_cache* of :class:`Dataset`).
+
         Returns:
             None
         """
-        if filename is not None and os.path.exists(filename):
+        if filename is not None and os.path.exists(filename) \
+                and _is_binary_info_cache(filename):
+            with self._info_cache_lock:
+                self.info_cache.update(InfoCache(filename))
+        elif filename is not None and os.path.exists(filename):
             try:
                 with open(filename) as file:
                     json_info_cache = json.load(file)
@@ -1591,7 +2417,8 @@ class Dataset:
                         json_dict["path"]: FileInfo.from_json_dict(json_dict)
                         for json_dict in json_info_cache
                     }
-                    self.info_cache.update(info_cache)
+                    with self._info_cache_lock:
+                        self.info_cache.update(info_cache)
             except Exception as err:
                 warnings.warn(
                     f"Could not load the file information from cache file "
@@ -1603,7 +2430,7 @@ class Dataset:
             kwargs=None, file_arg_keys=None, on_content=False, read_args=None,
             output=None, max_workers=None, worker_type=None,
             worker_initializer=None, worker_initargs=None, return_info=False,
-            **find_args
+            shared_memory=False, **find_args
     ):
         """Apply a function on all files of this dataset between two dates.
 
@@ -1666,6 +2493,13 @@ class Dataset:
             worker_initargs: A tuple with arguments for *worker_initializer*.
             return_info: If true, return a FileInfo object with each return
                 value indicating to which file the function was applied.
+            shared_memory: If true and *worker_type* is *process*, the
+                workers store all numpy arrays of their return values (also
+                in GroupedArrays or xarray objects) in shared memory blocks
+                instead of pickling them. This process gets views on these
+                blocks without copying the data. The blocks are freed when
+                the returned arrays are not used any longer. Requires Python
+                3.8 or newer.
             **find_args: Additional keyword arguments that are allowed
                 for :meth`find`.
 
@@ -1734,14 +2568,27 @@ class Dataset:
             self._call_map_function, func_args_queue,
         )
 
-    def imap(self, *args, **kwargs):
+    def imap(self, *args, prefetch=None, prefetch_bytes=None, **kwargs):
         """Apply a function on all files of this dataset between two dates.
 
         This method does exact the same as :meth:`map` but works as a generator
         and is therefore less memory space consuming.
 
+        The files are processed in the background while the results are
+        yielded. How far the workers may run ahead is limited by the number of
+        files (*prefetch*) and the size of their results (*prefetch_bytes*).
+        If one of these limits is reached, no further files are processed
+        until the consumer has taken some results. Statistics about the
+        prefetching are stored in :attr:`prefetch_stats`.
+
         Args:
             *args: The same positional arguments as for :meth:`map`.
+            prefetch: Maximal number of files that are processed or waiting
+                to be yielded at the same time. Default is 2.
+            prefetch_bytes: Maximal number of bytes of the results (e.g.
+                read arrays) that are waiting to be yielded. At least one file
+                is always processed even if its result exceeds this limit.
+                Default is no limit.
             **kwargs: The same keyword arguments as for :meth:`map`.
 
         Yields:
@@ -1756,28 +2603,143 @@ class Dataset:
             *args, **kwargs
         )
 
-        # Preload the first file
-        pre_loaded = pool.apply_async(
-            self._call_map_function,
-            args=(next(func_args_queue), ),
-        )
+        prefetch = 2 if prefetch is None else max(prefetch, 1)
 
-        for i, func_args in enumerate(func_args_queue):
-            yield_this = pre_loaded
-            pre_loaded = pool.apply_async(
-                self._call_map_function, args=(func_args, )
-            )
-            yield yield_this.get()
+        # All submitted files (in order) that have not been yielded yet:
+        pending = deque()
+        condition = threading.Condition()
+        state = {
+            "bytes": 0, "done": False, "closed": False, "error": None,
+            "results": 0, "result_bytes": 0,
+        }
+        stats = self.prefetch_stats = {
+            "files": 0,
+            "max_queued_files": 0,
+            "mean_queued_files": 0.,
+            "max_queued_bytes": 0,
+            "consumer_wait": 0.,
+            "producer_wait": 0.,
+        }
+
+        def on_result(result):
+            nbytes = self._get_nbytes(result)
+            with condition:
+                state["bytes"] += nbytes
+                state["results"] += 1
+                state["result_bytes"] += nbytes
+
+        def is_full():
+            if len(pending) >= prefetch:
+                return True
+            elif prefetch_bytes is None:
+                return False
+
+            # We do not know the size of the results that are still in
+            # process. Hence, we estimate them from the results so far:
+            in_process = sum(not result.ready() for result in pending)
+            if not state["results"]:
+                return in_process > 0
+
+            estimate = state["result_bytes"] / state["results"]
+            return state["bytes"] + in_process * estimate >= prefetch_bytes
+
+        def feed():
+            try:
+                for func_args in func_args_queue:
+                    with condition:
+                        # Backpressure: wait until the consumer has taken
+                        # enough results (we always allow one file at least)
+                        timer = time()
+                        while pending and is_full() and not state["closed"]:
+                            condition.wait()
+                        stats["producer_wait"] += time() - timer
+
+                        if state["closed"]:
+                            return
+
+                        pending.append(pool.apply_async(
+                            self._call_map_function, args=(func_args,),
+                            callback=on_result,
+                        ))
+                        condition.notify_all()
+            except Exception as err:
+                state["error"] = err
+            finally:
+                with condition:
+                    state["done"] = True
+                    condition.notify_all()
+
+        # Submitting the files in a separate thread lets the workers continue
+        # while the consumer is busy with the yielded results:
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        try:
+            while True:
+                timer = time()
+                with condition:
+                    while not pending and not state["done"]:
+                        condition.wait()
+                    if not pending:
+                        break
+                    next_result = pending[0]
+
+                result = next_result.get()
+                stats["consumer_wait"] += time() - timer
+
+                with condition:
+                    pending.popleft()
+                    queued_files = sum(r.ready() for r in pending)
+                    stats["max_queued_files"] = max(
+                        stats["max_queued_files"], queued_files)
+                    stats["mean_queued_files"] += queued_files
+                    stats["max_queued_bytes"] = max(
+                        stats["max_queued_bytes"], state["bytes"])
+                    state["bytes"] -= self._get_nbytes(result)
+                    stats["files"] += 1
+                    condition.notify_all()
+
+                yield result
+
+            if state["error"] is not None:
+                raise state["error"]
+        finally:
+            with condition:
+                state["closed"] = True
+                condition.notify_all()
+
+            if stats["files"]:
+                stats["mean_queued_files"] /= stats["files"]
 
-        # Flush the last processed file
-        yield pre_loaded.get()
+    @staticmethod
+    def _get_nbytes(obj):
+        """Estimate the memory size of a result object
+
+        Args:
+            obj: A numpy array, GroupedArrays, xarray or pandas object or a
+                tuple / list of them.
+
+        Returns:
+            The number of bytes (0 if unknown).
+        """
+        if isinstance(obj, GroupedArrays):
+            return sum(array.nbytes for array in obj.values(deep=True))
+        elif isinstance(obj, pd.DataFrame):
+            return int(obj.memory_usage().sum())
+        elif isinstance(obj, (np.ndarray, xr.Dataset, xr.DataArray)):
+            return obj.nbytes
+        elif isinstance(obj, (tuple, list)):
+            return sum(Dataset._get_nbytes(item) for item in obj)
+
+        return 0
 
     def _configure_map_pool_and_worker_args(
             self, start=None, end=None, files=None, func=None, args=None,
             kwargs=None, file_arg_keys=None,
             on_content=False, read_args=None, output=None,
             max_workers=None, worker_type=None, worker_initializer=None,
-            worker_initargs=None, return_info=False, **find_args
+            worker_initargs=None, return_info=False, shared_memory=False,
+            **find_args
     ):
         if func is None:
             raise ValueError("The parameter *func* must be given!")
@@ -1824,9 +2786,12 @@ class Dataset:
         if files is None:
             files = self.find(start, end, **find_args)
 
+        # Threads do not need shared memory:
+        shared_memory = shared_memory and worker_type == "process"
+
         function_arguments = (
             (self, file, func, args, kwargs, file_arg_keys, output,
-             on_content, read_args, return_info)
+             on_content, read_args, return_info, shared_memory)
             for file in files
         )
 
@@ -1840,7 +2805,8 @@ class Dataset:
         Args:
             all_args: A tuple containing following elements:
                 (Dataset object, file_info, function,
-                args, kwargs, output, on_content, read_args, return_info)
+                args, kwargs, output, on_content, read_args, return_info,
+                shared_memory)
 
         Returns:
             The return value of *function* called with the arguments *args* and
@@ -1848,7 +2814,7 @@ class Dataset:
             content).
         """
         dataset, file_info, func, args, kwargs, file_arg_keys, output, \
-            on_content, read_args, return_info = all_args
+            on_content, read_args, return_info, shared_memory = all_args
 
         args = [] if args is None else list(args)
 
@@ -1881,9 +2847,11 @@ class Dataset:
             """Small helper for return / not return the file info object."""
 
             if return_info:
-                return file_info, return_value
-            else:
-                return return_value
+                return_value = file_info, return_value
+
+            if shared_memory:
+                return SharedObject(return_value)
+            return return_value
 
         if output is None:
             # No output is needed, simply return the file info and the
@@ -2353,14 +3321,28 @@ class Dataset:
 
         read_args = {**self.read_args, **read_args}
 
-        if self._path_extension not in self.handler.handle_compression_formats\
-                and self.decompress:
-            with typhon.files.decompress(file_info.path) as decompressed_path:
-                decompressed_file = file_info.copy()
-                decompressed_file.path = decompressed_path
-                data = self.handler.read(decompressed_file, **read_args)
-        else:
-            data = self.handler.read(file_info, **read_args)
+        # Data from linked datasets is not cached since their files might
+        # change independently:
+        cache_key = None
+        if self.read_cache is not None and not self._link:
+            cache_key = self.read_cache.key(
+                file_info.path, self.handler, **read_args)
+            data = self.read_cache.get(cache_key)
+            if data is not None:
+                return data
+
+        data = None
+        shadow_key = None
+        if self.shadow_cache is not None and not self._link:
+            shadow_key = self.shadow_cache.key(
+                file_info.path, self.handler, **read_args)
+            data = self.shadow_cache.get(shadow_key)
+
+        if data is None:
+            data = self._read_with_handler(file_info, read_args)
+
+            if shadow_key is not None:
+                self.shadow_cache.put(shadow_key, data)
 
         # Add also data from linked datasets:
         if self._link:
@@ -2382,8 +3364,163 @@ class Dataset:
 
             return self._merge_data([data, *linked_data])
 
+        if cache_key is not None:
+            self.read_cache.put(cache_key, data, self._get_nbytes(data))
+
         return data
 
+    def _read_with_handler(self, file_info, read_args):
+        """Decompress the file if necessary and read it with the handler"""
+        if self._path_extension not in self.handler.handle_compression_formats\
+                and self.decompress:
+            with typhon.files.decompress(file_info.path) as decompressed_path:
+                decompressed_file = file_info.copy()
+                decompressed_file.path = decompressed_path
+                data = self.handler.read(decompressed_file, **read_args)
+
+                # Lazily loaded variables must be read before the
+                # decompressed file is deleted:
+                if isinstance(data, GroupedArrays) \
+                        and decompressed_path != file_info.path:
+                    data.load()
+                return data
+
+        return self.handler.read(file_info, **read_args)
+
+    def refresh_index(self, start=None, end=None, max_age=None):
+        """Update the persistent file index of this dataset.
+
+        Only those directories are rescanned whose modification time has
+        changed since the last refresh. Directories that do not exist any
+        longer are removed from the index.
+
+        Args:
+            start: Start date either as datetime object or as string
+                ("YYYY-MM-DD hh:mm:ss"). Only the directories that cover the
+                period between *start* and *end* are refreshed. If not given,
+                it is datetime.min per default.
+            end: End date. Same format as "start". If not given, it is
+                datetime.max per default.
+            max_age: A timedelta object. If given, directories that have been
+                checked within this period are trusted without looking at
+                their modification times. Default is to check all directories.
+
+        Returns:
+            None
+        """
+        if self.index is None:
+            raise ValueError(
+                f"The dataset '{self.name}' has no file index! Set one via "
+                f"the parameter 'index'.")
+
+        if self.single_file:
+            return
+
+        start = datetime.min if start is None else to_datetime(start)
+        end = datetime.max if end is None else to_datetime(end)
+
+        # Everything that influences which files are indexed and how their
+        # information is retrieved. If it has been changed, the index is
+        # useless and must be rebuilt:
+        self.index.check_signature(
+            f"{self._path_regex.pattern}|{self.info_via}|{self.time_coverage}"
+        )
+
+        # We do the same as in _get_search_dirs but ask the index before
+        # listing a directory:
+        search_dirs = [(self._base_dir, {}), ]
+        for subdir_chunk in self._sub_dir_chunks:
+            if not any(True for ch in subdir_chunk
+                       if ch in self._special_chars):
+                search_dirs = [
+                    (os.path.join(old_dir, subdir_chunk), attr)
+                    for old_dir, attr in search_dirs
+                ]
+                continue
+
+            resolution = self._get_time_resolution(subdir_chunk)[0]
+            start_check = set_time_resolution(start, resolution)
+            end_check = set_time_resolution(end, resolution)
+
+            regex = self._fill_placeholders_with_regexes(subdir_chunk)
+            search_dirs = [
+                (new_dir, attr)
+                for search_dir in search_dirs
+                for new_dir, attr in self._get_indexed_dirs(
+                    search_dir, regex, max_age)
+                if self._check_placeholders(attr, start_check, end_check)
+            ]
+
+        for path, _ in search_dirs:
+            if max_age is not None and self.index.is_fresh(path, max_age):
+                continue
+
+            mtime = self._get_mtime(path)
+            if mtime is None:
+                self.index.remove(path)
+            elif mtime == self.index.get_mtime(path):
+                self.index.touch(path)
+            else:
+                files = [
+                    self.get_info(filename)
+                    for filename in (
+                        os.path.join(path, name)
+                        for name in self._list_dir(path)
+                    )
+                    if self._path_regex.match(filename)
+                ]
+                self.index.set_files(path, mtime, files)
+
+    def _get_indexed_dirs(self, dir_with_attrs, regex, max_age=None):
+        """Get the matching sub directories from the index if possible
+
+        Args:
+            dir_with_attrs: A tuple of the directory path and its parsed
+                placeholders.
+            regex: A regular expression that should match the sub directories.
+            max_age: A timedelta object. If the directory has been checked
+                within this period, the index is used without looking at its
+                modification time.
+
+        Returns:
+            A list of tuples of the sub directory path and its parsed
+            placeholders.
+        """
+        # The path may end with the beginning of a directory name (see
+        # _get_matching_dirs), hence we need the modification time of the
+        # directory that is going to be listed:
+        path = dir_with_attrs[0]
+        if max_age is not None and self.index.is_fresh(path, max_age):
+            return self.index.get_children(path)
+
+        mtime = self._get_mtime(os.path.split(path)[0])
+        if mtime is None:
+            self.index.remove(path)
+            return []
+
+        if mtime == self.index.get_mtime(path):
+            self.index.touch(path)
+            return self.index.get_children(path)
+
+        children = list(self._get_matching_dirs(dir_with_attrs, regex))
+        self.index.set_children(path, mtime, children)
+        return children
+
+    @staticmethod
+    def _get_mtime(path):
+        """Get the modification time of a directory in nanoseconds
+
+        Args:
+            path: Path of the directory.
+
+        Returns:
+            The modification time or None if the directory does not exist.
+        """
+        try:
+            return os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
     def _retrieve_time_coverage(self, filled_placeholder,):
         """Retrieve the time coverage from a dictionary of placeholders.
 
@@ -2419,22 +3556,142 @@ class Dataset:
 
         return start_date, end_date
 
+    def _retrieve_time_coverages(self, fields):
+        """Retrieve the time coverages from placeholders of many files.
+
+        This is the vectorized counterpart of :meth:`_retrieve_time_coverage`
+        for files whose time coverage comes only from their filenames.
+
+        Args:
+            fields: A pandas.DataFrame with one column for each placeholder and
+                one row for each file.
+
+        Returns:
+            A tuple of two numpy.datetime64 arrays (starts and ends).
+        """
+        start_args = self._standardise_datetime64_args({
+            p: fields[p].values.astype(int)
+            for p in fields.columns
+            if not p.startswith("end_") and p in self._time_placeholder
+        })
+        end_args = self._standardise_datetime64_args({
+            p[len("end_"):]: fields[p].values.astype(int)
+            for p in fields.columns
+            if p.startswith("end_") and p in self._time_placeholder
+        })
+
+        if start_args:
+            starts = self._compose_datetime64(start_args)
+        elif end_args:
+            # Something went wrong, we need a starting time if we have an
+            # ending time.
+            raise ValueError(
+                "Could not retrieve the starting time information from the "
+                "files of the %s dataset!" % self.name
+            )
+        else:
+            # This is obviously a non-temporal dataset, set the times to
+            # minimum and maximum so we have no problem to find it
+            return (
+                np.full(len(fields), np.datetime64(datetime.min, "us")),
+                np.full(len(fields), np.datetime64(datetime.max, "us")),
+            )
+
+        if end_args:
+            ends = self._compose_datetime64({**start_args, **end_args})
+
+            # Make sure that the end date is always later than the start date
+            # (see _retrieve_time_coverage):
+            ends = np.where(
+                ends < starts, ends + np.timedelta64(
+                    self._end_time_superior, "us"), ends)
+        elif isinstance(self.time_coverage, timedelta):
+            ends = starts + np.timedelta64(self.time_coverage, "us")
+        else:
+            ends = starts
+
+        return starts, ends
+
+    def _standardise_datetime64_args(self, args):
+        """Vectorized version of :meth:`_standardise_datetime_args`
+
+        Args:
+            args: A dictionary of placeholders with integer arrays.
+
+        Returns:
+            The standardised placeholder dictionary.
+        """
+        year2 = args.pop("year2", None)
+        if year2 is not None:
+            args["year"] = np.where(
+                year2 < self.year2_threshold, 2000 + year2, 1900 + year2)
+        millisecond = args.pop("millisecond", None)
+        if millisecond is not None:
+            args["microsecond"] = millisecond * 1000
+        doy = args.pop("doy", None)
+        if doy is not None:
+            date = (args["year"] - 1970).astype("M8[Y]").astype("M8[D]") \
+                + (doy - 1)
+            month = date.astype("M8[M]")
+            args["month"] = \
+                (month - date.astype("M8[Y]").astype("M8[M]")).astype(int) + 1
+            args["day"] = (date - month.astype("M8[D]")).astype(int) + 1
+
+        return args
+
+    @staticmethod
+    def _compose_datetime64(args):
+        """Convert datetime arguments to a numpy.datetime64 array
+
+        Args:
+            args: A dictionary of standardised datetime placeholders (see
+                :meth:`_standardise_datetime_args`) with integer arrays.
+
+        Returns:
+            A numpy.datetime64 array with microseconds resolution.
+        """
+        dates = (args["year"] - 1970).astype("M8[Y]").astype("M8[M]")
+        dates = (dates + (args.get("month", 1) - 1)).astype("M8[D]")
+        dates = (dates + (args.get("day", 1) - 1)).astype("M8[us]")
+
+        for unit, factor in (("hour", 3600_000_000), ("minute", 60_000_000),
+                             ("second", 1_000_000), ("microsecond", 1)):
+            if unit in args:
+                dates = dates + (args[unit] * factor).astype("m8[us]")
+
+        return dates
+
     def save_info_cache(self, filename):
         """ Saves information cache to a file.
 
+        Args:
+            filename: Path to a JSON file or a binary cache file (see the
+                parameter *info_cache* of :class:`Dataset`).
+
         Returns:
             None
         """
-        if filename is not None:
+        if isinstance(self.info_cache, InfoCache) \
+                and self.info_cache.filename == filename:
+            # Only the new entries have to be appended:
+            self.info_cache.save()
+        elif filename is not None and _is_binary_info_cache(filename):
+            info_cache = InfoCache(filename)
+            with self._info_cache_lock:
+                info_cache.update(self.info_cache)
+            info_cache.save()
+        elif filename is not None:
             # First write all to a backup file. If something happens, only the
             # backup file will be overwritten.
             with open(filename+".backup", 'w') as file:
                 # We cannot save datetime objects with json directly. We have
-                # to convert them to strings first:
-                info_cache = [
-                    info.to_json_dict()
-                    for info in self.info_cache.values()
-                ]
+                # to convert them to strings first (the threads of find must
+                # not change the cache meanwhile):
+                with self._info_cache_lock:
+                    info_cache = [
+                        info.to_json_dict()
+                        for info in self.info_cache.values()
+                    ]
                 json.dump(info_cache, file)
 
             # Then rename the backup file
@@ -2494,7 +3751,10 @@ class Dataset:
 
         # Reset the info cache because some file information may have changed
         # now
-        self.info_cache = {}
+        if isinstance(getattr(self, "info_cache", None), InfoCache):
+            self.info_cache.clear()
+        else:
+            self.info_cache = {}
 
     def write(self, data, file_info=None, times=None, fill=None,
               in_background=False, **write_args):
@@ -2512,8 +3772,13 @@ class Dataset:
             data: An object that can be stored by the used file handler class.
             file_info: A string, path-alike object or a
                 :class:`~typhon.spareice.handlers.common.FileInfo` object.
-            in_background: If true (default), this runs the writing process in
-                a background thread so it does not pause the main process.
+            in_background: If true, this runs the writing process in a
+                background thread so it does not pause the main process. If
+                all background writers are busy and the queue is full (see
+                *write_workers* and *write_queue_size* of :class:`Dataset`),
+                this blocks until there is space again. Errors are raised by
+                the next call of this method or :meth:`flush`. Default is
+                false.
             **write_args: Additional key word arguments for the *write* method
                 of the used file handler object.
 
@@ -2557,6 +3822,9 @@ class Dataset:
             # plot is saved...
             do_other_stuff(...)
 
+            # Make sure that all plots are saved:
+            plots.flush()
+
         """
 
         if file_info is None:
@@ -2579,11 +3847,9 @@ class Dataset:
             )
 
         if in_background:
-            # Run this function again but as a background thread in a queue:
-            threading.Thread(
-                target=Dataset.write, args=(self, data, file_info),
-                kwargs=write_args.update(in_background=False),
-            ).start()
+            # Let one of the background writers run this function again:
+            self._raise_write_errors()
+            self._start_writers().put((data, file_info, write_args))
             return
 
         write_args = {**self.write_args, **write_args}
@@ -2606,7 +3872,63 @@ class Dataset:
         Returns:
             True if all writing threads are done.
         """
-        return self._write_queue.empty()
+        return self._write_queue is None \
+            or not self._write_queue.unfinished_tasks
+
+    def flush(self):
+        """Wait until all files passed to :meth:`write` are written.
+
+        If writing one of the files in the background has failed, the first
+        error is raised.
+
+        Returns:
+            None
+        """
+        if self._write_queue is not None:
+            self._write_queue.join()
+
+        self._raise_write_errors()
+
+    def _start_writers(self):
+        """Start the background writers if they are not running yet
+
+        Returns:
+            The queue for the writing jobs.
+        """
+        with self._write_lock:
+            if self._write_queue is None:
+                self._write_queue = Queue(max(self.write_queue_size, 1))
+                for _ in range(max(self.write_workers, 1)):
+                    threading.Thread(
+                        target=self._writer, args=(self._write_queue,),
+                        daemon=True,
+                    ).start()
+
+                # The writers are daemons, hence we have to make sure that
+                # they are finished before exiting:
+                atexit.register(Dataset.flush, self)
+
+            return self._write_queue
+
+    def _writer(self, queue):
+        """Write files from a queue (runs in a background thread)"""
+        while True:
+            data, file_info, write_args = queue.get()
+            try:
+                self.write(data, file_info, **write_args)
+            except Exception as err:
+                with self._write_lock:
+                    self._write_errors.append(err)
+            finally:
+                queue.task_done()
+
+    def _raise_write_errors(self):
+        """Raise the first error that occurred in the background writers"""
+        with self._write_lock:
+            errors, self._write_errors = self._write_errors, []
+
+        if errors:
+            raise errors[0]
 
 
 class DataSlider:
@@ -2616,28 +3938,61 @@ class DataSlider:
     """
 
     def __init__(
-            self, start, end, *datasets,):
+            self, start, end, *datasets, read_cache=None, files=None):
         """Initialise a DataSlider object
 
         Args:
             *datasets: A list / tuple of a datasets that should be iterated,
                 which read-method returns such an array set.
+            files: A list of files (FileInfo objects) of the primary dataset
+                that should be iterated. If this is given, *start* and *end*
+                must be None.
+            read_cache: The files of the secondary datasets are often needed
+                for several primary files. Hence, their content is kept in
+                a :class:`~typhon.spareice.cache.ReadCache`. This can be
+                either a ReadCache object (e.g. shared by several
+                DataSliders) or its maximal number of bytes. Secondary
+                datasets that already have their own read cache keep it.
+                Default is a new ReadCache that holds up to 1 GB. The cached
+                arrays are read-only (see ReadCache). Set it to False to
+                disable the caching.
         """
 
         self.start = None if start is None else to_datetime(start)
         self.end = None if end is None else to_datetime(end)
 
+        self.files = files
+
         self._cache = {}
         self._current_end = None
 
+        if read_cache is None or read_cache is True:
+            read_cache = ReadCache()
+        elif read_cache is not False \
+                and not isinstance(read_cache, ReadCache):
+            read_cache = ReadCache(read_cache)
+        self.read_cache = read_cache or None
+
         # In this container will only sources be saved that are 'collectable',
         # i.e. Dataset objects. Static sources as arrays will be directly saved
         # to the cache.
-        self.datasets = datasets
+        self.datasets = [
+            self._with_read_cache(dataset) if i else dataset
+            for i, dataset in enumerate(datasets)
+        ]
 
     def __iter__(self):
         return iter(self.move())
 
+    def _with_read_cache(self, dataset):
+        """Get a shallow copy of a dataset that uses our read cache"""
+        if self.read_cache is None or dataset.read_cache is not None:
+            return dataset
+
+        dataset = copy.copy(dataset)
+        dataset.read_cache = self.read_cache
+        return dataset
+
     def add(self, source, name=None):
         """Add a new source to this data slider
 
@@ -2654,12 +4009,12 @@ class DataSlider:
                 f"Source of type {type(source)} is not a Dataset-like object!"
             )
 
-        self.datasets.append(source)
+        self.datasets.append(self._with_read_cache(source))
 
     def move(self):
         primary = self.datasets[0]
         primary_files = primary.icollect(
-            self.start, self.end, return_info=True
+            self.start, self.end, files=self.files, return_info=True
         )
         for primary_file, primary_data in primary_files:
             # We add the primary data later:
@@ -2668,9 +4023,9 @@ class DataSlider:
 
             if len(self.datasets) > 1:
                 for secondary in self.datasets[1:]:
-                    # Get the corresponding secondary files:
-                    # TODO: Use caching to avoid multiple reading of the same
-                    # files
+                    # Get the corresponding secondary files (files that
+                    # overlap with several primary files are read only once
+                    # thanks to the read cache):
                     secondary_files, secondary_data = secondary.collect(
                         *primary_file.times, return_info=True, concat=False,
                     )
@@ -2679,6 +4034,11 @@ class DataSlider:
                     )
                     files[secondary.name] = secondary_files
 
+                    # Remember which points come from which file:
+                    data[secondary.name].attrs["__original_file_sizes"] = [
+                        len(content["time"]) for content in secondary_data
+                    ]
+
             # data = self._align_to_primary(data, primary_data)
             data[primary.name] = primary_data
 
@@ -5,6 +5,7 @@ from inspect import signature, ismethod
 import os
 import pickle
 
+import netCDF4
 import pandas as pd
 from typhon.spareice.array import GroupedArrays
 import xarray as xr
@@ -109,6 +110,13 @@ class FileHandler:
     # handle_compression_formats = ["zip", ]
     handle_compression_formats = []
 
+    # Flag whether the read method of this file handler accepts the parameter
+    # *time_window* (a tuple of two datetime objects) to read only the data
+    # between these two times (the end is exclusive). One of them can be
+    # None for an open bound. Dataset.collect passes its time period to such
+    # handlers if asked to do so.
+    time_window_support = False
+
     def __init__(
             self, reader=None, info=None, writer=None, data_merger=None,
             data_concatenator=None, **kwargs):
@@ -183,6 +191,28 @@ class FileHandler:
             "This file handler does not support reading data from a file. You "
             "should use a different file handler.")
 
+    @expects_file_info()
+    def get_dimensions(self, filename, **kwargs):
+        """Return the sizes of the dimensions in a file without reading it.
+
+        This is used by :meth:`~typhon.spareice.datasets.Dataset.collect` to
+        allocate the concatenated data before reading the files.
+
+        Notes:
+            This is the base class method that does nothing per default.
+
+        Args:
+            filename: A string containing path and name or a :class:`FileInfo`
+                object of the file.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            A dictionary with the dimension names and their sizes.
+        """
+        raise NotImplementedError(
+            "This file handler does not support reading the dimensions of a "
+            "file.")
+
     @expects_file_info()
     def read(self, filename, **kwargs):
         """Open a file by its name, read its content and return it
@@ -471,6 +501,8 @@ class NetCDF4(FileHandler):
     file.
     """
 
+    time_window_support = True
+
     def __init__(self, return_type=None, **kwargs):
         """Initializes a NetCDF4 file handler class.
 
@@ -487,9 +519,35 @@ class NetCDF4(FileHandler):
         # Set merger and concatenator for standard return types:
         self._set_standard_return_type(return_type)
 
+    @expects_file_info()
+    def get_dimensions(self, filename, **kwargs):
+        """Return the sizes of the dimensions in a NetCDF file.
+
+        Only the header of the file is read.
+
+        Args:
+            filename: Path and name of the file as string or FileInfo object.
+            **kwargs: Additional keyword arguments (ignored).
+
+        Returns:
+            A dictionary with the dimension names (of all groups) and their
+            sizes.
+        """
+        def get_group_dimensions(group):
+            dimensions = {
+                name: len(dimension)
+                for name, dimension in group.dimensions.items()
+            }
+            for subgroup in group.groups.values():
+                dimensions.update(get_group_dimensions(subgroup))
+            return dimensions
+
+        with netCDF4.Dataset(filename.path, "r") as root:
+            return get_group_dimensions(root)
+
     @expects_file_info()
     def read(self, filename, fields=None, mapping=None, main_group=None,
-             **kwargs):
+             time_window=None, time_field="time", **kwargs):
         """Reads and parses NetCDF files and load them to an GroupedArrays.
 
         If you need another return value, change it via the parameter
@@ -505,6 +563,15 @@ class NetCDF4(FileHandler):
                 keys are the old and the values are the new names.
             main_group: If the file contains multiple groups, the main group
                 will be linked to this one (only valid for GroupedArrays).
+            time_window: A tuple of two datetime objects. If given, only the
+                data from the first time (inclusive) until the second time
+                (exclusive) is read. None means an open bound. The time
+                variable must be
+                one-dimensional and sorted, the variables are read only along
+                the matching slice of its dimension (see
+                :meth:`GroupedArrays.from_netcdf` for details).
+            time_field: Name of the time variable that is used for
+                *time_window*. Default is *time*.
 
         Returns:
             An GroupedArrays object.
@@ -512,7 +579,10 @@ class NetCDF4(FileHandler):
 
         # GroupedArrays supports reading from multiple files.
         if self.return_type == "GroupedArrays":
-            ds = GroupedArrays.from_netcdf(filename.path, fields, **kwargs)
+            ds = GroupedArrays.from_netcdf(
+                filename.path, fields, time_window=time_window,
+                time_field=time_field, **kwargs
+            )
             if not ds:
                 return None
             if main_group is not None:
@@ -521,6 +591,22 @@ class NetCDF4(FileHandler):
             ds = xr.open_dataset(filename.path, **kwargs)
             if not ds.variables:
                 return None
+
+            # xarray reads the data lazily, hence only the selected slice is
+            # loaded from disk:
+            if time_window is not None and time_field in ds \
+                    and ds[time_field].ndim == 1 \
+                    and ds.indexes.get(time_field) is not None \
+                    and ds.indexes[time_field].is_monotonic_increasing:
+                # Slicing with labels would include the end:
+                index = ds.indexes[time_field]
+                start, end = time_window
+                ds = ds.isel({time_field: slice(
+                    None if start is None
+                    else index.searchsorted(pd.Timestamp(start)),
+                    None if end is None
+                    else index.searchsorted(pd.Timestamp(end)),
+                )})
         else:
             raise ValueError("Unknown return type '%s'!" % self.return_type)
 
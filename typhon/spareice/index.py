@@ -0,0 +1,492 @@
+"""
+This module contains persistent stores for datasets consisting of many files:
+a file index to answer requests for files without walking the whole directory
+tree each time and a cache for the information about single files. Both are
+used by :class:`~typhon.spareice.datasets.Dataset`.
+"""
+
+from collections.abc import MutableMapping
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+import json
+import os
+import sqlite3
+import threading
+
+from typhon.spareice.handlers import FileInfo
+
+__all__ = [
+    "FileIndex",
+    "InfoCache",
+]
+
+# Times are stored as integer microseconds since datetime.min since SQLite
+# has no native datetime type.
+_TIME_UNIT = timedelta(microseconds=1)
+
+
+def _to_int(timestamp):
+    if timestamp is None:
+        return None
+    return (timestamp - datetime.min) // _TIME_UNIT
+
+
+def _to_datetime(value):
+    if value is None:
+        return None
+    return datetime.min + value * _TIME_UNIT
+
+
+class FileIndex:
+    """Persistent on-disk index of the files of a dataset.
+
+    The index is a SQLite database holding the path, time coverage and the
+    user-defined placeholders of each file. It also remembers the modification
+    time of each directory when it was scanned and when this was checked the
+    last time. Hence, a refresh only needs to rescan directories whose content
+    has changed since then and may skip those that were checked recently.
+
+    You should not need to use this class directly. Set the parameter *index*
+    of :class:`~typhon.spareice.datasets.Dataset` instead.
+    """
+
+    def __init__(self, filename):
+        """Initialise a FileIndex object.
+
+        Args:
+            filename: Path and name of the SQLite file (need not exist).
+        """
+        self.filename = filename
+
+        # SQLite connections cannot be shared between processes. Hence, we
+        # open a new connection for each operation and serialize the writing
+        # operations of threads of one process:
+        self._lock = threading.RLock()
+
+        with self._transaction() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY, value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY, parent TEXT, attr TEXT,
+                    mtime INTEGER, checked INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY, dir TEXT, start INTEGER,
+                    end INTEGER, attr TEXT
+                );
+                CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+                CREATE INDEX IF NOT EXISTS files_start ON files (start);
+                CREATE INDEX IF NOT EXISTS files_end ON files (end);
+            """)
+
+            # Indices created by older versions have no check times:
+            columns = [
+                row[1] for row in connection.execute("PRAGMA table_info(dirs)")
+            ]
+            if "checked" not in columns:
+                connection.execute(
+                    "ALTER TABLE dirs ADD COLUMN checked INTEGER")
+
+    def __getstate__(self):
+        # Locks cannot be pickled (needed when using Dataset.map with
+        # processes):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=60)
+
+    @contextmanager
+    def _transaction(self):
+        """Open a connection, commit all changes and close it afterwards"""
+        with self._lock, closing(self._connect()) as connection:
+            with connection:
+                yield connection
+
+    def clear(self):
+        """Remove all directories and files from the index.
+
+        Returns:
+            None
+        """
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM dirs")
+            connection.execute("DELETE FROM files")
+
+    def check_signature(self, signature):
+        """Clear the index if it was built with a different signature
+
+        The signature should describe everything that influences which files
+        are indexed and how their information is retrieved (e.g. the path
+        regex of the dataset).
+
+        Args:
+            signature: A string.
+
+        Returns:
+            True if the index was still valid, False if it has been cleared.
+        """
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            if row is not None and row[0] == signature:
+                return True
+
+            connection.execute("DELETE FROM dirs")
+            connection.execute("DELETE FROM files")
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('signature', ?)",
+                (signature,)
+            )
+            return False
+
+    def get_mtime(self, path):
+        """Get the modification time of a directory when it was last indexed.
+
+        Args:
+            path: Path of the directory.
+
+        Returns:
+            The modification time in nanoseconds or None if the directory has
+            not been scanned yet.
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT mtime FROM dirs WHERE path = ?", (path,)
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def is_fresh(self, path, max_age):
+        """Check whether a directory has been checked recently.
+
+        Args:
+            path: Path of the directory.
+            max_age: A timedelta object.
+
+        Returns:
+            True if the directory has been scanned or checked within the last
+            *max_age*, otherwise False.
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT checked FROM dirs WHERE path = ?", (path,)
+            ).fetchone()
+
+        if row is None or row[0] is None:
+            return False
+        return datetime.now() - _to_datetime(row[0]) <= max_age
+
+    def touch(self, path):
+        """Mark a directory as checked now (its content did not change).
+
+        Args:
+            path: Path of the directory.
+
+        Returns:
+            None
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE dirs SET checked = ? WHERE path = ?",
+                (_to_int(datetime.now()), path)
+            )
+
+    def get_children(self, path):
+        """Get the indexed sub directories of a directory.
+
+        Args:
+            path: Path of the parent directory.
+
+        Returns:
+            A list of tuples of the sub directory path and its parsed
+            placeholders as dictionary.
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT path, attr FROM dirs WHERE parent = ? ORDER BY path",
+                (path,)
+            ).fetchall()
+
+        return [(child, json.loads(attr)) for child, attr in rows]
+
+    def set_children(self, path, mtime, children):
+        """Set the sub directories of a directory.
+
+        Sub directories that were indexed before but are not given any longer
+        are removed from the index together with all their files.
+
+        Args:
+            path: Path of the parent directory.
+            mtime: Current modification time of the parent directory in
+                nanoseconds.
+            children: A list of tuples of the sub directory path and its
+                parsed placeholders as dictionary.
+
+        Returns:
+            None
+        """
+        with self._transaction() as connection:
+            old_children = {
+                child for child, in connection.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (path,))
+            }
+
+            for child in old_children - {child for child, _ in children}:
+                self._remove_tree(connection, child)
+
+            connection.executemany(
+                "INSERT OR IGNORE INTO dirs (path, parent, attr) "
+                "VALUES (?, ?, ?)",
+                [(child, path, json.dumps(attr)) for child, attr in children]
+            )
+            self._set_mtime(connection, path, mtime)
+
+    def set_files(self, path, mtime, files):
+        """Set the files of a directory.
+
+        Args:
+            path: Path of the directory.
+            mtime: Current modification time of the directory in nanoseconds.
+            files: A list of FileInfo objects.
+
+        Returns:
+            None
+        """
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM files WHERE dir = ?", (path,))
+            connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [
+                    (file.path, path, _to_int(file.times[0]),
+                     _to_int(file.times[1]),
+                     json.dumps(file.attr, default=str))
+                    for file in files
+                ]
+            )
+            self._set_mtime(connection, path, mtime)
+
+    def remove(self, path):
+        """Remove a directory and everything below it from the index.
+
+        Args:
+            path: Path of the directory.
+
+        Returns:
+            None
+        """
+        with self._transaction() as connection:
+            self._remove_tree(connection, path)
+
+    @staticmethod
+    def _set_mtime(connection, path, mtime):
+        checked = _to_int(datetime.now())
+        cursor = connection.execute(
+            "UPDATE dirs SET mtime = ?, checked = ? WHERE path = ?",
+            (mtime, checked, path)
+        )
+        if not cursor.rowcount:
+            connection.execute(
+                "INSERT INTO dirs (path, attr, mtime, checked) "
+                "VALUES (?, '{}', ?, ?)",
+                (path, mtime, checked)
+            )
+
+    @staticmethod
+    def _remove_tree(connection, path):
+        prefix = (path.rstrip(os.sep) + os.sep, len(path.rstrip(os.sep)) + 1)
+        connection.execute(
+            "DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+            (path, prefix[1], prefix[0])
+        )
+        connection.execute(
+            "DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?",
+            (path, prefix[1], prefix[0])
+        )
+
+    def query(self, start, end, sort=False):
+        """Find all indexed files that overlap with a time period.
+
+        Args:
+            start: Datetime that defines the start of a time interval.
+            end: Datetime that defines the end of a time interval. The time
+                coverage of the files should overlap with this interval.
+            sort: If true, the files are yielded sorted by their starting
+                times.
+
+        Yields:
+            A FileInfo object for each found file.
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT path, start, end, attr FROM files "
+                "WHERE start <= ? AND end >= ?"
+                + (" ORDER BY start, path" if sort else ""),
+                (_to_int(end), _to_int(start))
+            )
+            for path, file_start, file_end, attr in rows:
+                yield FileInfo(
+                    path,
+                    [_to_datetime(file_start),
+                     _to_datetime(file_end)],
+                    json.loads(attr),
+                )
+
+
+class InfoCache(MutableMapping):
+    """Persistent cache of FileInfo objects.
+
+    Works like a dictionary of paths and FileInfo objects but stores them in
+    a SQLite table with one column for the paths, the starting and ending
+    times (as integers) and the attributes. The table is not read before the
+    first lookup and the FileInfo objects are only created when they are
+    requested. :meth:`save` appends only the new entries to the table, hence
+    several processes can share one cache file.
+
+    You should not need to use this class directly. Set the parameter
+    *info_cache* of :class:`~typhon.spareice.datasets.Dataset` instead.
+    """
+
+    def __init__(self, filename):
+        """Initialise an InfoCache object.
+
+        Args:
+            filename: Path and name of the SQLite file (need not exist).
+        """
+        self.filename = filename
+
+        # The raw rows from the table (loaded on the first lookup) and the
+        # FileInfo objects created so far:
+        self._rows = None
+        self._infos = {}
+
+        # Entries that have not been saved yet:
+        self._new = {}
+
+        self._lock = threading.RLock()
+
+        with self._transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS infos (
+                    path TEXT PRIMARY KEY, start INTEGER, end INTEGER,
+                    attr TEXT
+                )
+            """)
+
+    def __getstate__(self):
+        # Locks cannot be pickled (needed when using Dataset.map with
+        # processes):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __contains__(self, path):
+        return path in self._infos or path in self._get_rows()
+
+    def __getitem__(self, path):
+        info = self._infos.get(path, None)
+        if info is not None:
+            return info
+
+        start, end, attr = self._get_rows()[path]
+        info = FileInfo(
+            path, [_to_datetime(start), _to_datetime(end)],
+            json.loads(attr) if attr else {},
+        )
+        self._infos[path] = info
+        return info
+
+    def __setitem__(self, path, info):
+        # save() may swap the new entries meanwhile:
+        with self._lock:
+            self._infos[path] = info
+            self._new[path] = info
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+
+        self._infos.pop(path, None)
+        self._new.pop(path, None)
+        self._get_rows().pop(path, None)
+
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM infos WHERE path = ?", (path,))
+
+    def __iter__(self):
+        yield from self._infos
+        yield from (path for path in self._get_rows()
+                    if path not in self._infos)
+
+    def __len__(self):
+        return len(self._infos) \
+            + sum(path not in self._infos for path in self._get_rows())
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=60)
+
+    @contextmanager
+    def _transaction(self):
+        """Open a connection, commit all changes and close it afterwards"""
+        with self._lock, closing(self._connect()) as connection:
+            with connection:
+                yield connection
+
+    def _get_rows(self):
+        """Load the table into memory (only once)"""
+        if self._rows is None:
+            with self._lock:
+                if self._rows is None:
+                    with closing(self._connect()) as connection:
+                        self._rows = {
+                            path: (start, end, attr)
+                            for path, start, end, attr in connection.execute(
+                                "SELECT path, start, end, attr FROM infos")
+                        }
+        return self._rows
+
+    def clear(self):
+        """Remove all entries from the cache and its file.
+
+        Returns:
+            None
+        """
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM infos")
+            self._rows = {}
+            self._infos = {}
+            self._new = {}
+
+    def save(self):
+        """Append all new entries to the cache file.
+
+        Returns:
+            None
+        """
+        with self._transaction() as connection:
+            new, self._new = self._new, {}
+            connection.executemany(
+                "INSERT OR REPLACE INTO infos VALUES (?, ?, ?, ?)",
+                [
+                    (path, _to_int(info.times[0]), _to_int(info.times[1]),
+                     json.dumps(info.attr, default=str))
+                    for path, info in new.items()
+                ]
+            )
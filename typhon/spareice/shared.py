@@ -0,0 +1,205 @@
+"""
+This module contains helpers to pass numpy arrays between processes via
+shared memory instead of pickling their content.
+"""
+
+import io
+import os
+import pickle
+import threading
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+__all__ = [
+    "SharedObject",
+]
+
+class SharedObject:
+    """Wraps an object whose numpy arrays are passed via shared memory.
+
+    When a SharedObject is pickled (e.g. when returning it from a worker
+    process of a multiprocessing pool), all numpy arrays in the wrapped
+    object (also in GroupedArrays, xarray or pandas objects, tuples, etc.) are
+    stored in shared memory blocks and only the names of the blocks are
+    pickled. When unpickling, the original object is rebuilt with arrays that
+    are views on these blocks, i.e. no data is copied.
+
+    Arrays with object dtype, masked arrays and arrays smaller than
+    *min_bytes* are pickled as usual.
+
+    Examples:
+
+    .. code-block:: python
+
+        def worker(filename):
+            data = read_big_arrays(filename)
+            # The process pool will return the data without copying:
+            return SharedObject(data)
+
+        with multiprocessing.Pool(4) as pool:
+            # results is a list of the original data objects:
+            results = pool.map(worker, filenames)
+    """
+
+    def __init__(self, obj, transfer=True, min_bytes=None):
+        """Initialise a SharedObject.
+
+        The shared memory blocks are created and filled directly.
+
+        Args:
+            obj: Any picklable object.
+            transfer: If true (default), the object should be loaded exactly
+                once (e.g. a return value of a worker process). The shared
+                memory blocks are freed as soon as the loaded arrays are not
+                used any longer. If false, the object may be loaded several
+                times (e.g. as input for many worker processes) and the blocks
+                must be freed explicitly by calling :meth:`release`.
+            min_bytes: Arrays that have less bytes than this are pickled as
+                usual. Default is 4096 (one memory page).
+        """
+        if shared_memory is None:
+            raise ImportError(
+                "Shared memory requires Python 3.8 or newer!")
+
+        self.transfer = transfer
+        self.min_bytes = 4096 if min_bytes is None else min_bytes
+
+        # The names of all created shared memory blocks:
+        self.blocks = []
+
+        buffer = io.BytesIO()
+        _SharingPickler(buffer, self).dump(obj)
+        self._payload = buffer.getvalue()
+
+    def __reduce__(self):
+        return _load, (self._payload, self.transfer)
+
+    def load(self):
+        """Rebuild the wrapped object in this process
+
+        Returns:
+            The wrapped object with arrays that are views on the shared memory.
+        """
+        return _load(self._payload, False)
+
+    def release(self):
+        """Free all shared memory blocks of this object
+
+        Already loaded arrays stay valid until they are garbage collected.
+
+        Returns:
+            None
+        """
+        for name in self.blocks:
+            try:
+                block = shared_memory.SharedMemory(name)
+            except FileNotFoundError:
+                continue
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+class _SharingPickler(pickle.Pickler):
+    """Pickler that stores numpy arrays in shared memory blocks"""
+
+    def __init__(self, file, shared_object):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.shared_object = shared_object
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, np.ndarray) \
+                or isinstance(obj, np.ma.MaskedArray) \
+                or obj.dtype.hasobject \
+                or obj.nbytes < self.shared_object.min_bytes:
+            return NotImplemented
+
+        block = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        view = np.ndarray(obj.shape, obj.dtype, buffer=block.buf)
+        view[...] = obj
+        del view
+        block.close()
+
+        if self.shared_object.transfer:
+            # The process that loads the block is responsible for it now.
+            # Otherwise the resource tracker of this process would try to
+            # remove it when this process exits:
+            _untrack(block)
+
+        self.shared_object.blocks.append(block.name)
+
+        # Subclasses (such as Array) keep their attributes:
+        return _attach, (
+            block.name, obj.shape, obj.dtype, type(obj),
+            getattr(obj, "__dict__", None),
+        )
+
+
+def _load(payload, transfer):
+    # The thread-local flag tells _attach whether to unlink the blocks:
+    _loading.transfer = transfer
+    try:
+        return pickle.loads(payload)
+    finally:
+        _loading.transfer = False
+
+
+_loading = threading.local()
+
+
+def _attach(name, shape, dtype, cls, state):
+    """Create an array that is a view on a shared memory block"""
+    block = shared_memory.SharedMemory(name)
+
+    if getattr(_loading, "transfer", False):
+        # Nobody else needs this block. The memory is freed when the last
+        # view on it is gone:
+        block.unlink()
+    else:
+        # The block belongs to the process that created it:
+        _untrack(block)
+
+    # The array keeps the memory mapping alive. It is unmapped as soon as
+    # the array and all its views are garbage collected:
+    array = np.ndarray(shape, dtype, buffer=_detach_mapping(block))
+
+    if cls is not np.ndarray:
+        array = array.view(cls)
+        if state:
+            array.__dict__.update(state)
+
+    return array
+
+
+def _untrack(block):
+    """Stop the resource tracker of this process from removing a block"""
+    # Only POSIX shared memory blocks are tracked:
+    if os.name == "posix":
+        resource_tracker.unregister(block._name, "shared_memory")
+
+
+def _detach_mapping(block):
+    """Take the memory mapping of a block and close the block
+
+    A SharedMemory object cannot be closed while arrays use its buffer.
+    Instead, the arrays use its mmap object directly, which unmaps the memory
+    when it is garbage collected (i.e. when the arrays are not used any
+    longer). Only the file descriptor of the block is closed here.
+
+    Args:
+        block: A SharedMemory object.
+
+    Returns:
+        The mmap object of the block.
+    """
+    mapping = block._mmap
+    block._buf.release()
+    block._buf = None
+    block._mmap = None
+    block.close()
+    return mapping
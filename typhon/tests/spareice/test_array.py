@@ -0,0 +1,47 @@
+import netCDF4
+import numpy as np
+from typhon.spareice.array import num2date
+
+
+class TestArray:
+    """Testing the array methods."""
+
+    def test_num2date(self):
+        """The fast conversion gives the same results as netCDF4."""
+        times = np.ma.masked_array(
+            [0, 1.5, 86400.25, 1.5e9 + 0.001, -100., 7.],
+            mask=[False, False, False, False, False, True],
+        )
+        units = "seconds since 2000-01-01T06:00:00Z"
+
+        converted = num2date(times, units)
+        assert converted.dtype == np.dtype("M8[ns]")
+        assert np.isnat(converted[-1])
+
+        check = netCDF4.num2date(
+            times[:-1].data, units, only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
+        )
+        assert np.all(
+            np.abs(converted[:-1] - check.astype("M8[ns]"))
+            < np.timedelta64(1, "us")
+        )
+
+        # Integers and other units:
+        assert num2date(np.array([1, 2]), "days since 1970-01-01")[1] \
+            == np.datetime64("1970-01-03")
+        assert num2date(np.array([90]), "min since 1970-01-01 00:00")[0] \
+            == np.datetime64("1970-01-01T01:30")
+
+        # Other calendars use netCDF4:
+        assert num2date(
+            np.array([59.]), "days since 1970-01-01", "360_day"
+        )[0].month == 2
+
+    def test_num2date_early_epoch(self):
+        """Epochs out of the datetime64[ns] range fall back to netCDF4."""
+        converted = num2date(np.array([0., 1.]), "days since 1500-01-01")
+        assert len(converted) == 2
+        assert num2date(
+            np.array([0.]), "days since 1500-01-01", "proleptic_gregorian"
+        )[0].year == 1500
@@ -1,7 +1,19 @@
+from datetime import timedelta
+import json
+import os
 from os.path import dirname, join
 
 import numpy as np
+import pytest
+from scipy.spatial import distance_matrix
+import typhon.constants
+from typhon.geodesy import geocentric2cart
 from typhon.spareice import collocate, collocate_datasets, Dataset
+from typhon.spareice.handlers import NetCDF4
+from typhon.utils.time import to_timedelta
+from typhon.spareice.collocations.algorithms import (
+    BallTree, BruteForce, GridHash, SweepLine
+)
 
 
 class TestCollocator:
@@ -9,3 +21,371 @@ class TestCollocator:
 
     datasets = None
     refdir = join(dirname(__file__), 'reference')
+
+    @staticmethod
+    def _random_swath(size, seed):
+        """Create random points along a satellite-like track"""
+        random = np.random.RandomState(seed)
+        return {
+            "time": np.datetime64("2018-01-01")
+            + np.sort(random.randint(0, 86400_000, size)).astype("m8[ms]"),
+            "lat": random.uniform(-90, 90, size),
+            "lon": random.uniform(-180, 180, size),
+        }
+
+    def _assert_same_pairs(self, finder, *args):
+        """Compare the pairs of a finder with those of the BallTree"""
+        check = BallTree().find_collocations(*args)
+        pairs = finder.find_collocations(*args)
+        assert set(zip(*pairs)) == set(zip(*check))
+        assert len(pairs[0]) == len(check[0])
+
+    def test_ball_tree(self):
+        """The BallTree finds the same pairs as a brute-force search."""
+        primary = self._random_swath(1000, 2)
+        secondary = self._random_swath(1500, 3)
+        max_interval = timedelta(hours=2)
+
+        pairs = BallTree().find_collocations(
+            primary, secondary, max_interval, 500)
+
+        distances = distance_matrix(
+            np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                primary["lat"], primary["lon"])),
+            np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                secondary["lat"], secondary["lon"])),
+        )
+        intervals = np.abs(
+            primary["time"][:, np.newaxis] - secondary["time"][np.newaxis, :])
+        check = np.nonzero(
+            (distances <= 500_000) & (intervals < np.timedelta64(max_interval))
+        )
+
+        assert pairs.dtype == np.int32
+        assert len(pairs[0]) > 0
+        assert set(zip(*pairs)) == set(zip(*check))
+
+    def test_brute_force(self):
+        """The tiled brute-force search finds the same pairs as comparing
+        all points at once.
+        """
+        primary = self._random_swath(700, 10)
+        secondary = self._random_swath(900, 11)
+
+        distances = distance_matrix(
+            np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                primary["lat"], primary["lon"])),
+            np.column_stack(geocentric2cart(
+                typhon.constants.earth_radius,
+                secondary["lat"], secondary["lon"])),
+        )
+        intervals = np.abs(
+            primary["time"][:, np.newaxis] - secondary["time"][np.newaxis, :])
+
+        for max_interval, max_distance in [
+                ("2 hours", 1000), (None, 300), ("1 min", None)]:
+            check = np.ones_like(distances, dtype=bool)
+            if max_distance is not None:
+                check &= distances < max_distance * 1000
+            if max_interval is not None:
+                check &= intervals < np.timedelta64(
+                    to_timedelta(max_interval))
+            check = np.nonzero(check)
+
+            # Small tiles with threads and one big tile:
+            for finder in [BruteForce(max_bytes=20_000, threads=3),
+                           BruteForce()]:
+                pairs = finder.find_collocations(
+                    primary, secondary, max_interval, max_distance)
+                assert len(pairs[0]) > 0
+                assert len(pairs[0]) == len(check[0])
+                assert set(zip(*pairs)) == set(zip(*check))
+
+        # At least one criterion is needed:
+        with pytest.raises(ValueError):
+            BruteForce().find_collocations(primary, secondary, None, None)
+
+    def test_index_cache(self):
+        """The Ball tree of the secondary data is built only once."""
+        from typhon.spareice import ReadCache
+
+        secondary = self._random_swath(3000, 12)
+        finder = BallTree()
+        finder.index_cache = ReadCache()
+        uncached = BallTree()
+        uncached.index_cache = None
+
+        for seed in [13, 14]:
+            primary = self._random_swath(500, seed)
+            # The index is found by the key of the secondary data:
+            pairs = finder.find_collocations(
+                primary, secondary, "1 hour", 500,
+                index_key=("secondary.nc", (0, 3000)))
+            check = uncached.find_collocations(
+                primary, secondary, "1 hour", 500)
+            assert set(zip(*pairs)) == set(zip(*check))
+        assert finder.index_cache.stats["misses"] == 1
+        assert finder.index_cache.stats["hits"] == 1
+
+        # Another key needs a new tree, data without a key are not cached:
+        finder.find_collocations(
+            primary, secondary, "1 hour", 500,
+            index_key=("secondary.nc", (0, 2999)))
+        finder.find_collocations(primary, secondary, "1 hour", 500)
+        assert finder.index_cache.stats["misses"] == 2
+        assert len(finder.index_cache) == 2
+
+        # A tree of secondary data smaller than the primary data is not
+        # built (nor cached) since the tree is built with the larger data:
+        pairs = finder.find_collocations(
+            secondary, primary, "1 hour", 500, index_key="primary.nc")
+        check = uncached.find_collocations(secondary, primary, "1 hour", 500)
+        assert set(zip(*pairs)) == set(zip(*check))
+        assert len(finder.index_cache) == 2
+
+        # The caching is disabled by default:
+        assert BallTree().index_cache is None
+
+    def test_space_time_ball_tree(self):
+        """The space-time BallTree finds the same pairs as the BallTree."""
+        primary = self._random_swath(5000, 8)
+        secondary = self._random_swath(8000, 9)
+
+        for max_interval, max_distance in [
+                ("1 hour", 300), ("10 min", 1000), (None, 50), ("30s", None)]:
+            self._assert_same_pairs(
+                BallTree(space_time=True), primary, secondary, max_interval,
+                max_distance
+            )
+
+    def test_sweep_line(self):
+        """The sweep line finds the same pairs as the BallTree."""
+        primary = self._random_swath(5000, 0)
+        secondary = self._random_swath(8000, 1)
+
+        for max_interval, max_distance in [
+                ("1 hour", 300), ("10 min", 1000), (None, 50), ("30s", None)]:
+            self._assert_same_pairs(
+                SweepLine(block_size=500), primary, secondary, max_interval,
+                max_distance
+            )
+
+    def test_grid_hash(self):
+        """The grid hash finds the same pairs as the BallTree."""
+        primary = self._random_swath(5000, 4)
+        secondary = self._random_swath(8000, 5)
+
+        for max_interval, max_distance in [
+                ("1 hour", 300), (None, 100), (None, 30), ("30s", None)]:
+            self._assert_same_pairs(
+                GridHash(), primary, secondary, max_interval, max_distance
+            )
+
+    def test_time_boundary(self):
+        """All finders compare the times in nanoseconds and exclude points
+        at exactly max_interval.
+        """
+        primary = {
+            "time": np.array(["2018-01-01T12:00:00"], dtype="M8[ns]"),
+            "lat": np.array([10.]),
+            "lon": np.array([20.]),
+        }
+        # Secondary points at the same position around the time limits (also
+        # with fractions of seconds):
+        offsets = np.array([
+            -60_000_000_001, -60_000_000_000, -59_999_999_999,
+            -59_500_000_000, 0, 59_999_999_999, 60_000_000_000,
+            60_000_000_001, 60_500_000_000,
+        ], dtype="m8[ns]")
+        secondary = {
+            "time": primary["time"][0] + offsets,
+            "lat": np.full(len(offsets), 10.),
+            "lon": np.full(len(offsets), 20.),
+        }
+        expected = {
+            (0, index) for index in
+            np.flatnonzero(np.abs(offsets) < np.timedelta64(60, "s"))
+        }
+
+        finders = [
+            BallTree(), BallTree(space_time=True), BruteForce(), GridHash(),
+            SweepLine(),
+        ]
+        for max_distance in [None, 100]:
+            for finder in finders:
+                pairs = finder.find_collocations(
+                    primary, secondary, "1 min", max_distance)
+                assert set(zip(*pairs)) == expected
+
+    def test_nearest_collocations(self):
+        """Only the k nearest neighbours that meet the criteria are found."""
+        primary = self._random_swath(2000, 15)
+        secondary = self._random_swath(6000, 16)
+
+        for max_interval, max_distance in [
+                ("1 hour", 500), (None, 300), ("2 min", None)]:
+            for k in [1, 3]:
+                # The SweepLine cannot search for the nearest neighbours,
+                # hence they are selected afterwards:
+                check = collocate(
+                    [primary, secondary], max_interval=max_interval,
+                    max_distance=max_distance, k=k, algorithm=SweepLine(),
+                )
+                assert len(check[0])
+                assert np.bincount(check[0]).max() <= k
+
+                for parallel_args in [{}, {"threads": 2}]:
+                    pairs = collocate(
+                        [primary, secondary], max_interval=max_interval,
+                        max_distance=max_distance, k=k, **parallel_args
+                    )
+                    if max_distance is None:
+                        # The BallTree compares the times in whole seconds,
+                        # i.e. it may choose others of equally near points:
+                        assert np.array_equal(
+                            np.bincount(pairs[0]), np.bincount(check[0]))
+                    else:
+                        assert set(zip(*pairs)) == set(zip(*check))
+
+    def test_parallel_collocate(self):
+        """Collocating in time bins with processes or threads finds the same
+        pairs as collocating everything at once.
+        """
+        primary = self._random_swath(3000, 6)
+        secondary = self._random_swath(4000, 7)
+
+        for max_interval, max_distance in [("1 hour", 300), (None, 100)]:
+            check = BallTree().find_collocations(
+                primary, secondary, to_timedelta(max_interval)
+                if max_interval is not None else None, max_distance)
+            for parallel_args in [{"processes": 3}, {"threads": 2}]:
+                pairs = collocate(
+                    [primary, secondary], max_interval=max_interval,
+                    max_distance=max_distance, **parallel_args
+                )
+                assert set(zip(*pairs)) == set(zip(*check))
+                assert len(pairs[0]) == len(check[0])
+
+    def _tutorial_datasets(self):
+        """Get the datasets of satellite A and B from the tutorial"""
+        path = join(
+            "{year}", "{month}", "{day}",
+            "{hour}{minute}{second}-{end_hour}{end_minute}{end_second}.nc."
+        )
+        return [
+            Dataset(
+                join(self.refdir, "tutorial_datasets", satellite, path)
+                + compression,
+                name=satellite, handler=NetCDF4()
+            )
+            for satellite, compression in [
+                ("SatelliteA", "zip"), ("SatelliteB", "gz")]
+        ]
+
+    def test_collocate_datasets(self, tmpdir):
+        """Completed chunks are recorded and skipped when running again."""
+        datasets = self._tutorial_datasets()
+        output = join(str(tmpdir), "{year}", "{doy}",
+                      "{hour}{minute}{second}.nc")
+        manifest = join(str(tmpdir), "collocations_manifest.json")
+        args = dict(
+            max_distance=300, max_interval="1 hour", chunk="12 hours",
+            verbose=False,
+        )
+
+        collocated = collocate_datasets(
+            datasets, "2018-01-01", "2018-01-02", output=output,
+            manifest=manifest, max_workers=2, **args
+        )
+        with open(manifest) as file:
+            chunks = json.load(file)["chunks"]
+        outputs = [
+            filename for chunk in chunks.values()
+            for filename in chunk["outputs"]
+        ]
+        assert len(chunks) == 2
+        assert outputs
+        assert sorted(outputs) == sorted(
+            file.path for file in collocated.find())
+
+        # The completed chunks are not processed again:
+        mtimes = [os.stat(filename).st_mtime_ns for filename in outputs]
+        collocate_datasets(
+            datasets, "2018-01-01", "2018-01-02", output=collocated,
+            manifest=manifest, **args
+        )
+        assert mtimes == [
+            os.stat(filename).st_mtime_ns for filename in outputs]
+
+        # Unless their outputs are missing:
+        os.remove(outputs[0])
+        collocate_datasets(
+            datasets, "2018-01-01", "2018-01-02", output=collocated,
+            manifest=manifest, **args
+        )
+        assert os.path.exists(outputs[0])
+
+        # Without a manifest, nothing is skipped or recorded:
+        os.remove(manifest)
+        os.remove(outputs[0])
+        collocate_datasets(
+            datasets, "2018-01-01", "2018-01-02", output=collocated, **args
+        )
+        assert os.path.exists(outputs[0])
+        assert not os.path.exists(manifest)
+
+    def test_collocate_datasets_read_cache(self, tmpdir):
+        """Each secondary file is read only once for all chunks."""
+        datasets = self._tutorial_datasets()
+        handler = datasets[1].handler
+        reads = []
+
+        def read(file_info, **kwargs):
+            reads.append(tuple(file_info.times))
+            return NetCDF4.read(handler, file_info, **kwargs)
+        handler.read = read
+
+        collocate_datasets(
+            datasets, "2018-01-01", "2018-01-03",
+            output=join(str(tmpdir), "{year}", "{doy}",
+                        "{hour}{minute}{second}.nc"),
+            max_distance=300, max_interval="1 hour", verbose=False,
+        )
+        assert reads
+        assert len(reads) == len(set(reads))
+
+    def test_index_only_collocations(self, tmpdir):
+        """Hydrated index-only collocations equal the fully stored ones."""
+        datasets = self._tutorial_datasets()
+        collocated = {}
+        for index_only in [False, True]:
+            collocated[index_only] = collocate_datasets(
+                datasets, "2018-01-01", "2018-01-03",
+                output=join(str(tmpdir), str(index_only), "{year}", "{doy}",
+                            "{hour}{minute}{second}.nc"),
+                max_distance=500, max_interval="2 hours", verbose=False,
+                index_only=index_only,
+            )
+
+        for full_file, index_file in zip(
+                collocated[False].find(), collocated[True].find()):
+            full = collocated[False].read(full_file)
+            data = collocated[True].read(index_file)
+            assert "data" not in data["SatelliteB"]
+
+            # Each group knows the sizes of its original files (also for a
+            # single file):
+            for group in ["SatelliteA", "SatelliteB"]:
+                attrs = data[group].attrs
+                assert len(np.atleast_1d(attrs["__original_file_sizes"])) \
+                    == len(attrs["__original_files"].split(";"))
+
+            data = collocated[True].hydrate(data, datasets, {
+                "SatelliteA": ["data"], "SatelliteB": ["data"],
+            })
+            for field in ["SatelliteA/data", "SatelliteB/data",
+                          "SatelliteB/time"]:
+                assert np.array_equal(data[field], full[field])
@@ -1,9 +1,18 @@
+import copy
 import datetime
+import json
+import os
 from os.path import dirname, join
+import pickle
+import shutil
 
 import numpy as np
+import pytest
+import typhon.spareice.datasets
+from typhon.spareice.array import GroupedArrays, LazyArray
 from typhon.spareice.datasets import Dataset, DatasetManager
 from typhon.spareice.handlers import FileHandler, FileInfo, NetCDF4
+from typhon.spareice.shared import SharedObject
 
 
 class TestDataset:
@@ -355,6 +364,56 @@ class TestDataset:
     def _tutorial_map_content(data, file_info):
         return data["data"].mean().item(0)
 
+    @staticmethod
+    def _tutorial_map_arrays(file_info):
+        data = GroupedArrays()
+        data["hour"] = np.full(10000, file_info.times[0].hour)
+        data["hour"].attrs["file"] = file_info.path
+        return data
+
+    def test_map_shared_memory(self):
+        """Process workers return arrays via shared memory."""
+        tutorial = self.init_datasets()["tutorial"]
+
+        check = tutorial.map(
+            "2018-01-01", "2018-01-03", func=TestDataset._tutorial_map_arrays,
+            worker_type="process",
+        )
+        results = tutorial.map(
+            "2018-01-01", "2018-01-03", func=TestDataset._tutorial_map_arrays,
+            worker_type="process", shared_memory=True,
+        )
+
+        assert len(results) == len(check)
+        for result, check_result in zip(results, check):
+            assert np.array_equal(result["hour"], check_result["hour"])
+            assert result["hour"].attrs == check_result["hour"].attrs
+
+            # The arrays are views on shared memory blocks:
+            assert result["hour"].base is not None
+
+    @pytest.mark.skipif(not os.path.exists("/proc/self/maps"),
+                        reason="needs /proc/self/maps")
+    def test_shared_memory_release(self):
+        """Transferred shared memory is unmapped when its arrays are gone."""
+        shared = SharedObject(np.arange(100000.))
+        name = shared.blocks[0]
+
+        def is_mapped():
+            with open("/proc/self/maps") as file:
+                return name in file.read()
+
+        array = pickle.loads(pickle.dumps(shared))
+        view = array[10:]
+        assert is_mapped()
+
+        del array
+        assert is_mapped()
+        assert view[0] == 10.
+
+        del view
+        assert not is_mapped()
+
     def test_files_overlap_subdirectory(self):
         """A file covers a time period longer than its sub directory.
         """
@@ -580,6 +639,535 @@ class TestDataset:
         ]
         assert files == check
 
+    def test_sorted_streaming(self):
+        """Sorted files are yielded before all directories are scanned.
+        """
+        datasets = self.init_datasets()
+        tutorial = datasets["tutorial"]
+
+        found_files = list(
+            tutorial.find("2018-01-01", "2018-01-03", sort="stream"))
+        check = sorted(
+            tutorial.find("2018-01-01", "2018-01-03", sort=False),
+            key=lambda x: x.times[0]
+        )
+        assert [file.times[0] for file in found_files] \
+            == [file.times[0] for file in check]
+
+        scanned = []
+
+        def dir_finder(path):
+            scanned.append(path)
+            return tutorial._get_matching_files(
+                path, tutorial._path_regex,
+                datetime.datetime.min, datetime.datetime.max
+            )
+
+        search_dirs = tutorial._get_search_dirs(
+            datetime.datetime.min, datetime.datetime.max, {})
+        dirs = sorted(
+            zip(tutorial._get_dir_starts(search_dirs),
+                (path for path, _ in search_dirs)),
+            key=lambda x: x[0]
+        )
+        files = tutorial._merge_sorted_dirs(
+            (dir_start, dir_finder(path)) for dir_start, path in dirs
+        )
+        first_file = next(files)
+        assert first_file.times[0] == check[0].times[0]
+        assert len(scanned) < len(search_dirs)
+
+    def test_parallel_scanning(self, monkeypatch):
+        """Scanning directories in parallel threads finds the same files.
+        """
+        datasets = self.init_datasets()
+
+        # All directory levels and files of one search share one pool:
+        pools = []
+        thread_pool = typhon.spareice.datasets.ThreadPool
+
+        def counting_pool(*args, **kwargs):
+            pools.append(args)
+            return thread_pool(*args, **kwargs)
+
+        monkeypatch.setattr(
+            typhon.spareice.datasets, "ThreadPool", counting_pool)
+
+        for name, dataset in datasets.items():
+            if dataset.single_file:
+                continue
+
+            sequential = copy.copy(dataset)
+            sequential.scan_workers = 1
+            parallel = copy.copy(dataset)
+            parallel.scan_workers = 8
+
+            check = list(sequential.find(no_files_error=False))
+            pools.clear()
+            assert list(parallel.find(no_files_error=False)) == check
+            assert len(pools) == 1
+            assert list(parallel.find(sort=False, no_files_error=False)) \
+                == list(sequential.find(sort=False, no_files_error=False))
+
+    def test_synthesized_dirs(self):
+        """Generating the temporal sub directories finds the same files as
+        listing them.
+        """
+        datasets = list(self.init_datasets().values())
+        datasets.append(Dataset(
+            join(self.refdir,
+                 "pinocchio_dataset/t{year2}{month}{day}/tm{year2}{month}{day}"
+                 "{hour}{minute}{second}{millisecond}.jpg",
+                 ),
+        ))
+        periods = [
+            ("2017-11-01", "2017-11-03"),
+            ("2018-01-01", "2018-01-02 12:00:00"),
+            ("2018-01-01 02:00:00", "2018-01-03"),
+            ("1999-05-01", "1999-06-01"),
+        ]
+
+        for dataset in datasets:
+            if dataset.single_file:
+                continue
+
+            synthesizing = copy.copy(dataset)
+            synthesizing.synthesize_dirs = True
+
+            for start, end in periods:
+                assert list(synthesizing.find(
+                    start, end, no_files_error=False)) \
+                    == list(dataset.find(start, end, no_files_error=False))
+
+    def test_batch_parsing(self):
+        """Parsing whole directories at once yields the same time coverages
+        as parsing each file on its own.
+        """
+        datasets = list(self.init_datasets().values())
+        datasets.append(Dataset(
+            join(self.refdir,
+                 "pinocchio_dataset/t{year2}{month}{day}/tm{year2}{month}{day}"
+                 "{hour}{minute}{second}{millisecond}.jpg",
+                 ),
+        ))
+
+        for dataset in datasets:
+            if dataset.single_file or dataset.info_via != "filename":
+                continue
+
+            batch = copy.copy(dataset)
+            batch.info_cache = {}
+            single = copy.copy(dataset)
+            single.info_cache = {}
+
+            files = list(batch.find(no_files_error=False))
+            check = [single.get_info(file.path) for file in files]
+            assert files
+            assert files == check
+            assert [file.attr for file in files] \
+                == [file.attr for file in check]
+            assert files == list(batch.find(no_files_error=False))
+
+    def test_sort_across_directories(self, tmpdir):
+        """Files that start before the time of their directory are sorted
+        correctly (or refused by the streaming merge).
+        """
+        path = join(str(tmpdir), "{year}", "{month}", "{day}", "{hour}.dat")
+        starts = {
+            "2018/01/01/00.dat": datetime.datetime(2018, 1, 1, 0),
+            "2018/01/01/23.dat": datetime.datetime(2018, 1, 1, 23),
+            # Crosses midnight and is stored under its ending date:
+            "2018/01/02/00.dat": datetime.datetime(2018, 1, 1, 22),
+            "2018/01/02/12.dat": datetime.datetime(2018, 1, 2, 12),
+        }
+        for name in starts:
+            filename = join(str(tmpdir), *name.split("/"))
+            os.makedirs(dirname(filename), exist_ok=True)
+            open(filename, "w").close()
+
+        def get_info(file_info):
+            name = "/".join(file_info.path.split(os.sep)[-4:])
+            start = starts[name]
+            return FileInfo(
+                file_info.path, [start, start + datetime.timedelta(hours=1)])
+
+        dataset = Dataset(
+            path, handler=FileHandler(info=get_info), info_via="both")
+        found_files = list(dataset.find("2018-01-01", "2018-01-03"))
+        assert [file.times[0] for file in found_files] \
+            == sorted(starts.values())
+
+        with pytest.raises(ValueError):
+            list(dataset.find("2018-01-01", "2018-01-03", sort="stream"))
+
+    def test_index(self, tmpdir):
+        """Find files via the persistent file index.
+        """
+        root = join(str(tmpdir), "tutorial_datasets")
+        path = join(
+            root, "{satellite}/{year}/{month}/{day}/{hour}{minute}"
+            "{second}-{end_hour}{end_minute}{end_second}.nc.{compression}"
+        )
+        shutil.copytree(join(self.refdir, "tutorial_datasets"), root)
+        plain = Dataset(path)
+        indexed = Dataset(path, index=join(str(tmpdir), "index.sqlite"))
+
+        check = list(plain.find("2018-01-01", "2018-01-03"))
+        assert list(indexed.find("2018-01-01", "2018-01-03")) == check
+        assert len(indexed.index) == len(check)
+
+        # A warm index answers the search without checking the directories:
+        new_file = join(
+            root, "SatelliteB/2018/01/02/230000-233000.nc.gz")
+        shutil.copy(join(
+            root, "SatelliteB/2018/01/02/180000-000000.nc.gz"),
+            new_file
+        )
+        found_files = list(indexed.find("2018-01-02 22:00", "2018-01-03"))
+        assert new_file not in [file.path for file in found_files]
+
+        # Only the changed directory has to be rescanned:
+        indexed.refresh_index()
+        found_files = list(indexed.find("2018-01-02 22:00", "2018-01-03"))
+        assert new_file in [file.path for file in found_files]
+        assert found_files == list(plain.find("2018-01-02 22:00", "2018-01-03"))
+
+        # Revalidate the directories before each search:
+        os.remove(new_file)
+        indexed.index_refresh = True
+        found_files = list(indexed.find("2018-01-02 22:00", "2018-01-03"))
+        assert new_file not in [file.path for file in found_files]
+
+        # Or when their last check is too old:
+        shutil.copy(join(
+            root, "SatelliteB/2018/01/02/180000-000000.nc.gz"),
+            new_file
+        )
+        aged = Dataset(path, index=join(str(tmpdir), "index.sqlite"),
+                       index_max_age="0 seconds")
+        found_files = list(aged.find("2018-01-02 22:00", "2018-01-03"))
+        assert new_file in [file.path for file in found_files]
+
+    def test_info_cache(self, tmpdir):
+        """Test the binary information cache."""
+        path = join(
+            self.refdir,
+            "tutorial_datasets/{satellite}/{year}/{month}/{day}/{hour}"
+            "{minute}{second}-{end_hour}{end_minute}{end_second}.nc.gz"
+        )
+        cache = join(str(tmpdir), "cache.sqlite")
+
+        dataset = Dataset(path, info_cache=cache)
+        files = list(dataset.find("2018-01-01", "2018-01-02"))
+        dataset.save_info_cache(cache)
+
+        # The cache file is not read before the first lookup:
+        cached = Dataset(path, info_cache=cache)
+        assert cached.info_cache._rows is None
+        assert len(cached.info_cache) == len(files)
+        assert [cached.info_cache[file.path] for file in files] == files
+        assert list(cached.find("2018-01-01", "2018-01-02")) == files
+
+        # New entries are appended:
+        others = list(cached.find("2018-01-02", "2018-01-03"))
+        cached.save_info_cache(cache)
+        assert len(Dataset(path, info_cache=cache).info_cache) \
+            == len({file.path for file in files + others})
+
+        # JSON caches are still used if their name does not end with .json:
+        json_cache = join(str(tmpdir), "cache.dat")
+        Dataset(path, info_cache=json_cache).save_info_cache(json_cache)
+        dataset = Dataset(path, info_cache=json_cache)
+        files = list(dataset.find("2018-01-01", "2018-01-02"))
+        dataset.save_info_cache(json_cache)
+        with open(json_cache) as file:
+            assert len(json.load(file)) == len(files)
+        cached = Dataset(path, info_cache=json_cache)
+        assert isinstance(cached.info_cache, dict)
+        assert [cached.info_cache[file.path] for file in files] == files
+
+    def test_preallocated_collect(self):
+        """Collecting into preallocated arrays gives the same data as
+        concatenating them afterwards.
+        """
+        tutorial = self.init_datasets()["tutorial"]
+
+        files, check = tutorial.collect(
+            "2018-01-01", "2018-01-02", return_info=True)
+        preallocated_files, data = tutorial.collect(
+            "2018-01-01", "2018-01-02", return_info=True, preallocate=True)
+
+        assert list(preallocated_files) == list(files)
+        assert set(data.vars(deep=True)) == set(check.vars(deep=True))
+        for var in check.vars(deep=True):
+            assert np.array_equal(data[var], check[var])
+
+    def test_preallocated_collect_variables(self, tmpdir):
+        """Only variables along the time dimension are preallocated, they get
+        the common type of all files and scalars the value of the first
+        file.
+        """
+        def read(file_info):
+            hour = file_info.times[0].hour
+            data = GroupedArrays()
+            data["time"] = np.datetime64("2018-01-01") \
+                + np.arange(3).astype("m8[m]") + np.timedelta64(hour, "h")
+            data["time"].dims = ["time"]
+            # int16 in the first, float32 in the second file:
+            data["data"] = np.arange(3, dtype="int16") if not hour \
+                else np.arange(3, dtype="f4") + np.float32(.5)
+            data["data"].dims = ["time"]
+            data["channel"] = np.arange(3) * (hour + 1)
+            data["channel"].dims = ["channel"]
+            data["scalar"] = np.array(hour)
+            return data
+
+        class Handler(FileHandler):
+            def get_dimensions(self, filename, **kwargs):
+                return {"time": 3, "channel": 3}
+
+        path = join(str(tmpdir), "{year}", "{month}", "{day}", "{hour}.dat")
+        for hour in ["00", "01"]:
+            filename = path.format(year=2018, month="01", day="01", hour=hour)
+            os.makedirs(dirname(filename), exist_ok=True)
+            open(filename, "w").close()
+
+        dataset = Dataset(path, handler=Handler(reader=read))
+        data = dataset.collect("2018-01-01", "2018-01-02", preallocate=True)
+
+        assert data["data"].dtype == np.dtype("f4")
+        assert np.array_equal(data["data"], [0, 1, 2, .5, 1.5, 2.5])
+        assert np.array_equal(data["channel"], [0, 1, 2, 0, 2, 4])
+        assert data["channel"].dims == ["channel"]
+        assert data["scalar"] == 0
+        assert len(data["time"]) == 6
+
+    def test_trimmed_collect(self):
+        """Reading only the requested time window gives the same data as
+        selecting it afterwards.
+        """
+        tutorial = self.init_datasets()["tutorial"]
+        start, end = "2018-01-01 03:00", "2018-01-01 07:30"
+        filters = {"satellite": "SatelliteB"}
+
+        check = tutorial.collect(start, end, filters=filters)
+        check = check[(check["time"] >= np.datetime64(start))
+                      & (check["time"] < np.datetime64(end))]
+        data = tutorial.collect(start, end, filters=filters, trim=True)
+
+        assert len(data["time"]) == len(check["time"])
+        for var in check.vars(deep=True):
+            assert np.array_equal(data[var], check[var])
+
+    def test_lazy_reading(self, tmpdir):
+        """Lazy variables give the same data and read only hyperslabs."""
+        filename = join(str(tmpdir), "lazy.nc")
+        check = GroupedArrays()
+        check["time"] = np.arange(
+            "2018-01-01", "2018-01-02", dtype="M8[h]").astype("M8[s]")
+        check["time"].dims = ["time"]
+        check["group/matrix"] = np.arange(24 * 3.).reshape(24, 3)
+        check["group/matrix"].dims = ["time", "channel"]
+        check.to_netcdf(filename)
+
+        dataset = Dataset(filename, handler=NetCDF4())
+        data = dataset.read(filename, lazy=True)
+
+        matrix = data["group/matrix"]
+        assert isinstance(matrix, LazyArray)
+        assert matrix.shape == (24, 3) and not matrix.loaded
+        assert np.array_equal(
+            matrix[2:10:2, -1], check["group/matrix"][2:10:2, -1])
+        assert matrix[5, 1] == check["group/matrix"][5, 1]
+        assert not matrix.loaded
+
+        assert np.array_equal(matrix * 2, check["group/matrix"] * 2)
+        assert matrix.loaded
+        assert np.array_equal(data["time"], check["time"])
+
+        # Lazy reading works also together with the time window:
+        data = dataset.read(filename, lazy=True, time_window=(
+            datetime.datetime(2018, 1, 1, 6), datetime.datetime(2018, 1, 1, 8)
+        ))
+        assert data["group/matrix"].shape == (2, 3)
+        assert np.array_equal(data["group/matrix"][1:],
+                              check["group/matrix"][7:8])
+        assert np.array_equal(data["time"], check["time"][6:8])
+
+        # The end of the time window is exclusive, hence adjacent windows do
+        # not share the records on their boundary:
+        windows = [
+            dataset.read(filename, time_window=(
+                datetime.datetime(2018, 1, 1, hour),
+                datetime.datetime(2018, 1, 1, hour + 2)
+            ))
+            for hour in [6, 8]
+        ]
+        assert np.array_equal(
+            np.concatenate([window["time"] for window in windows]),
+            check["time"][6:10]
+        )
+
+        # Open bounds of the time window are None (also with xarray):
+        read_args = dataset._add_time_window(None, "2018-01-01 08:00", {})
+        assert read_args["time_window"] == \
+            (None, datetime.datetime(2018, 1, 1, 8))
+        data = dataset.read(filename, **read_args)
+        assert np.array_equal(data["time"], check["time"][:8])
+        xr_dataset = Dataset(filename, handler=NetCDF4(return_type="xarray"))
+        data = xr_dataset.read(filename, **read_args)
+        assert np.array_equal(data["time"].values, check["time"][:8])
+
+    def test_prefetch(self):
+        """Prefetching with limited queues yields the same results in the
+        same order.
+        """
+        # Reading netCDF files in parallel threads is not safe with all HDF5
+        # builds, hence we read the raw bytes:
+        tutorial = Dataset(
+            self.init_datasets()["tutorial"].path,
+            handler=FileHandler(
+                reader=lambda file: np.fromfile(file.path, dtype=np.uint8)),
+        )
+        check = [
+            tutorial.read(file)
+            for file in tutorial.find("2018-01-01", "2018-01-03")
+        ]
+
+        # One file needs more bytes than the budget, i.e. only one file is
+        # loaded at once:
+        for prefetch, prefetch_bytes in ((None, None), (4, None), (4, 1)):
+            data = list(tutorial.icollect(
+                "2018-01-01", "2018-01-03", prefetch=prefetch,
+                prefetch_bytes=prefetch_bytes
+            ))
+            assert len(data) == len(check)
+            for content, check_content in zip(data, check):
+                assert np.array_equal(content, check_content)
+
+            stats = tutorial.prefetch_stats
+            assert stats["files"] == len(check)
+            assert stats["max_queued_files"] < (prefetch or 2)
+            if prefetch_bytes is not None:
+                assert stats["max_queued_files"] == 0
+
+    def test_background_writing(self, tmpdir):
+        """Files written in background are on disk after flushing."""
+        def writer(data, file_info):
+            if data is None:
+                raise ValueError("Cannot write None!")
+            with open(file_info.path, "w") as file:
+                file.write(str(data))
+
+        dataset = Dataset(
+            join(str(tmpdir), "{year}/{doy}.txt"),
+            handler=FileHandler(writer=writer), write_workers=2,
+            write_queue_size=2,
+        )
+
+        times = [
+            datetime.datetime(2018, 1, 1) + datetime.timedelta(days=day)
+            for day in range(10)
+        ]
+        for day, time in enumerate(times):
+            dataset.write(day, times=(time, time), in_background=True)
+        dataset.flush()
+
+        assert dataset.writing_complete()
+        assert len(list(dataset.find())) == len(times)
+
+        # Errors are raised by flush:
+        dataset.write(None, times=(times[0], times[0]), in_background=True)
+        with pytest.raises(ValueError):
+            dataset.flush()
+
+    def test_read_cache(self, tmpdir):
+        """Cached files are read only once unless they have been changed."""
+        reads = []
+
+        def reader(file_info, **kwargs):
+            reads.append(file_info.path)
+            return np.fromfile(file_info.path, dtype=np.uint8)
+
+        filename = join(str(tmpdir), "file.bin")
+        np.arange(100, dtype=np.uint8).tofile(filename)
+
+        dataset = Dataset(
+            filename, handler=FileHandler(reader=reader), read_cache=1000,
+        )
+        for _ in range(3):
+            assert np.array_equal(dataset.read(filename), np.arange(100))
+        assert len(reads) == 1
+
+        # The cached arrays are shared and hence read-only:
+        with pytest.raises(ValueError):
+            dataset.read(filename)[0] = 1
+        assert dataset.read(filename)[0] == 0
+
+        # Other reading arguments are cached separately:
+        dataset.read(filename, flag=True)
+        assert len(reads) == 2
+
+        # Changed files are read again:
+        np.arange(200, dtype=np.uint8).tofile(filename)
+        assert len(dataset.read(filename)) == 200
+        assert len(reads) == 3
+
+        # The outdated entry is still there until it gets evicted:
+        assert dataset.read_cache.stats == {
+            "hits": 4, "misses": 3, "entries": 3, "nbytes": 400,
+        }
+
+        # The budget allows only five of these files:
+        for size in range(6):
+            np.arange(190 + size, dtype=np.uint8).tofile(filename)
+            dataset.read(filename)
+        assert dataset.read_cache.nbytes <= 1000
+        assert len(dataset.read_cache) == 5
+
+    def test_shadow_cache(self, tmpdir):
+        """Files are decoded only once and loaded from the shadow cache."""
+        reads = []
+
+        def reader(file_info, **kwargs):
+            reads.append(file_info.path)
+            data = GroupedArrays(name="test")
+            data.attrs["title"] = "test"
+            data["time"] = np.arange(
+                "2018-01-01", "2018-01-02", dtype="M8[h]")
+            data["group/value"] = np.arange(24.)
+            data["group/value"].attrs["units"] = "K"
+            data["group/value"].dims = ["time"]
+            return data
+
+        filename = join(str(tmpdir), "file.bin")
+        open(filename, "w").close()
+
+        dataset = Dataset(
+            filename, handler=FileHandler(reader=reader),
+            shadow_cache=join(str(tmpdir), "cache"),
+        )
+        check = dataset.read(filename)
+        data = dataset.read(filename)
+        assert len(reads) == 1
+        assert dataset.shadow_cache.stats["hits"] == 1
+
+        assert data.attrs == check.attrs
+        assert set(data.vars(deep=True)) == set(check.vars(deep=True))
+        for var in check.vars(deep=True):
+            assert np.array_equal(data[var], check[var])
+            assert data[var].attrs == check[var].attrs
+            assert data[var].dims == check[var].dims
+            assert data[var].base is not None
+
+        # The least recently used entries are removed if the budget is
+        # exceeded:
+        dataset.shadow_cache.max_bytes = dataset.shadow_cache.stats["nbytes"]
+        dataset.read(filename, other_args=True)
+        assert dataset.shadow_cache.stats["entries"] == 1
+        dataset.read(filename)
+        assert len(reads) == 3
+
     def _print_files(self, files, comma=False):
         print("[")
         for file in files: